@@ -1,43 +1,53 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory, session
-import mysql.connector
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory, session, abort, Response
+import hmac
 import os
 from dotenv import load_dotenv
-import firebase_admin
-from firebase_admin import credentials, auth
 import requests
 import json
+import time
+import assets
+import ballot
+import breaker
+import export
+import finalists
+import images
+import ingest
+import leaderboard
+import metrics
+import migrations
+import ratelimit
+import reconcile
+import replicas
+import repository
+import results_stream
+import storage
+import tally
+import token_index
+import token_verify
+from page_cache import PageCache
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY')
-
-# Initialize Firebase Admin SDK
-try:
-    import json
-    # Get the Firebase service account JSON from environment variable
-    cred_json = os.getenv("FIREBASE_CREDENTIALS_JSON")
-    if not cred_json:
-        raise ValueError("FIREBASE_CREDENTIALS_JSON environment variable is not set!")
-
-    # Parse JSON string into dict
-    cred_dict = json.loads(cred_json)
-    cred = credentials.Certificate(cred_dict)
-
-    # Initialize Firebase
-    firebase_admin.initialize_app(cred)
-    print("Firebase Admin SDK initialized successfully!")
-
-except Exception as e:
-    print(f"Firebase Admin SDK initialization failed: {e}")
-    print("Make sure FIREBASE_CREDENTIALS_JSON env variable is set correctly on Render")
-
+# Client IPs (for rate limits) come from the X-Forwarded-For entry Render's proxy adds
+if int(os.getenv("PROXY_HOPS", 1)):
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.getenv("PROXY_HOPS", 1)))
+page_cache = PageCache(app)
+metrics.init_app(app)
+breaker.init_app(app)
+app.jinja_env.globals["srcset_attrs"] = images.srcset_attrs
+app.jinja_env.globals["asset_url"] = assets.url
+app.jinja_env.globals["url_for"] = assets.url_for
 
 # Authentication helper functions
 def verify_firebase_token(token):
     """Verify Firebase ID token"""
     try:
-        decoded_token = auth.verify_id_token(token)
+        # Checked locally against cached signing keys (see token_verify.py)
+        with metrics.token_check():
+            decoded_token = token_verify.verify(token)
         return decoded_token
     except Exception as e:
         print(f"Token verification failed: {e}")
@@ -53,178 +63,129 @@ def require_auth(f):
     decorated_function.__name__ = f.__name__
     return decorated_function
 
-# Database connection using environment variables
-def get_connection():
-    conn = mysql.connector.connect(
-        host=os.getenv("DB_HOST"),
-        port=os.getenv("DB_PORT"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
-        database=os.getenv("DB_NAME"),
-        ssl_ca="ca.pem"  # if Aiven requires SSL cert
-    )
-    return conn
+def require_admin_token(f):
+    """Decorator for operator endpoints: a bearer token matching EXPORT_TOKEN.
+
+    Without EXPORT_TOKEN set the endpoint doesn't exist (404).
+    """
+    def decorated_function(*args, **kwargs):
+        expected = os.getenv("EXPORT_TOKEN")
+        if not expected:
+            abort(404)
+        supplied = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+        if not hmac.compare_digest(supplied.encode(), expected.encode()):
+            return jsonify({"success": False, "message": "Unauthorized"}), 401
+        return f(*args, **kwargs)
+    decorated_function.__name__ = f.__name__
+    return decorated_function
+
+def mark_write():
+    """Remember when this user last voted, so their next reads include it"""
+    if replicas.get() is not None:
+        session['wrote_at'] = time.time()
+
+def read_your_writes():
+    """This user's last vote time while a replica might still lack it, else None (see replicas.py)"""
+    wrote_at = session.get('wrote_at')
+    if wrote_at is None or replicas.get() is None:
+        return None
+    if time.time() - wrote_at > 2 * (replicas.MAX_LAG + replicas.CHECK_SECONDS):
+        return None
+    return wrote_at
+
+def limited(route):
+    """Decorator applying `route`'s rate limits and in-flight cap before any DB work (see ratelimit.py)"""
+    def decorator(f):
+        def decorated_function(*args, **kwargs):
+            limiter = ratelimit.get_limiter()
+            try:
+                limiter.check(route, session.get('user_id'), request.remote_addr)
+                limiter.admit(route)
+            except ratelimit.Shed as e:
+                return shed(e)
+            try:
+                return f(*args, **kwargs)
+            finally:
+                limiter.release()
+        decorated_function.__name__ = f.__name__
+        return decorated_function
+    return decorator
+
+def shed(e):
+    """429 or 503 for a request turned away by the rate limiter"""
+    response = jsonify({"success": False, "message": str(e)})
+    response.status_code = e.status
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+def backlogged(e):
+    """503 for a ballot the ingest log has no room for yet"""
+    response = jsonify({"success": False, "message": "Voting is very busy right now. Please try again in a few seconds."})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+def unavailable(e, message="We can't reach the database right now, so nothing was saved."):
+    """503 for a request that needs the database while it is unreachable (see breaker.py)"""
+    retry_after = getattr(e, "retry_after", breaker.Unavailable.retry_after)
+    response = jsonify({"success": False, "message": f"{message} Please try again in {retry_after} seconds."})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
+def database_unavailable(e):
+    """Pages that can't be served without the database while it is unreachable"""
+    if request.path.startswith("/api/"):
+        return unavailable(e, "We can't reach the database right now.")
+    response = Response("This page is unavailable for a moment. Please try again shortly.", status=503, mimetype="text/plain")
+    response.headers["Retry-After"] = str(getattr(e, "retry_after", breaker.Unavailable.retry_after))
+    return response
+
+for error in storage.UNAVAILABLE:
+    app.register_error_handler(error, database_unavailable)
 
 def init_database():
-    conn = get_connection()
-    cursor = conn.cursor()
-    
+    """Bring the schema up to date (see migrations.py)"""
     try:
-        # Kings table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS kings (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                name VARCHAR(100) NOT NULL,
-                batch VARCHAR(50),
-                bio TEXT,
-                image_path VARCHAR(200),
-                vote_count INT DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Queens table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS queens (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                name VARCHAR(100) NOT NULL,
-                batch VARCHAR(50),
-                bio TEXT,
-                image_path VARCHAR(200),
-                vote_count INT DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Votes table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS votes (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                user_uid VARCHAR(128) NOT NULL,
-                candidate_type ENUM('king','queen','lantern') NOT NULL,
-                candidate_id INT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE KEY unique_vote (user_uid, candidate_type)
-            )
-        """)
-        
-        # Lanterns table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS lanterns (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                name VARCHAR(100) NOT NULL,
-                batch VARCHAR(50),
-                description TEXT,
-                image_path VARCHAR(200),
-                vote_count INT DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Insert king candidates if table is empty
-        cursor.execute("SELECT COUNT(*) FROM kings")
-        if cursor.fetchone()[0] == 0:
-            kings_data = [
-                ("Aung Min Khant", "HND-65", "Bio", "Kings/Aung Min Khant.png"),
-                ("Aung Khant Paing", "HND-65", "Vote Me", "Kings/Aung Khant Paing.png"),
-                ("Aung Thaw Hein", "HND-60", "Vote Me", "Kings/Aung Thaw Hein.png"),
-                ("Bo Bo Linn", "HND-65", "Vote Me", "Kings/Bo Bo Linn.jpg"),
-                ("Han Htoo Naung", "HND-60", "A yin lu htet po myan say ya ml", "Kings/Han Htoo Naung.jpg"),
-                ("Hein Lin Thaw", "HND-60", "လူမရှိလို့ ဝင်ပြိုင်တာ မရှိတဲ့ a shyak တွေလည်း ကုန်ပါပြီ", "Kings/Hein Lin Thaw.png"),
-                ("Htoo Aung Linn", "HND-69", "✨Ready to wear the crown 👑", "Kings/Htoo Aung Linn.png"),
-                ("Kaung Zaw Hein", "HND-57", "I Developed This Website, Vote ME or Get BANNED!", "Kings/Kaung Zaw Hein.jpg"),
-                ("Lin Latt Maung", "HND-52", "Love is crowned with cuteness 👑", "Kings/Lin Latt Maung.png"),
-                ("Lin Sat Naing", "HND-68", "Vote Me", "Kings/Lin Sat Naing.png"),
-                ("Min Thu Ta", "HND-65", "Vote Me", "Kings/Min Thu Ta.png"),
-                ("Naing Aung Khant", "HND-59", "Vote Me", "Kings/Naing Aung Khant.jpg"),
-                ("Nyan Lynn Htun", "HND-60", "Vote Me", "Kings/Nyan Lynn Htun.png"),
-                ("Tun Lin Aung", "HND-68", "Hated, Dated, Still Celebrated.", "Kings/Tun Lin Aung.png"),
-                ("Tun Win Aung", "HND-64", "Vote Me", "Kings/Tun Win Aung.png"),
-                ("Zin Htut Naing", "HND-65", "Vote Me", "Kings/Zin Htut Naing.png")
-            ]
-            
-            cursor.executemany("""
-                INSERT INTO kings (name, batch, bio, image_path) 
-                VALUES (%s, %s, %s, %s)
-            """, kings_data)
-        
-        # Insert queen candidates if table is empty
-        cursor.execute("SELECT COUNT(*) FROM queens")
-        if cursor.fetchone()[0] == 0:
-            queens_data = [
-                ("Aye Thu Aung", "HND-60", "Vote Me", "Queen/Aye Thu Aung.png"),
-                ("Ban Htoi Mai", "L3 Batch42", "Vote Me", "Queen/Ban Htoi Mai.png"),
-                ("Hla Wutt Hmone Oo", "HND-69", "Shinning Bright ✨", "Queen/Hla Wutt Hmone Oo.png"),
-                ("Hnin Oo Shwe Yie", "Level 3 B 41", "Vote Me", "Queen/Hnin Oo Shwe Yie.png"),
-                ("Hnin Thiri", "HND-68", "Taste like your sweetest dreams💭 💕", "Queen/Hnin Thiri.png"),
-                ("Hsu Wati Hnin", "HND-59", "Vote Me", "Queen/Hsu Wati Hnin.png"),
-                ("May Thu Lwin", "HND-8 Business", "💕 \"Brains, beauty, and a heart that shines 🌸\" 💕", "Queen/May Thu Lwin.png"),
-                ("Pan Myat Nadi", "Pre IGCse batch6", "Vote Me", "Queen/Ma Pan Myat Nadi.png"),
-                ("Pwint Phyu Soe", "HND-65", "Through pain, sadness, and loss, never give up 💕 Keep striving for your life’s best. I am cheering you on every step 🍀", "Queen/Pwint Phyu Soe.jpg"),
-                ("Shwe Phyo Wai", "HND-59", "Vote Me", "Queen/Shwe Phyo Wai.png"),
-                ("Thanzin Cho", "HND-69", "Progress, not perfection", "Queen/Thanzin Cho.png"),
-                ("Thet Htar Shwe Zin", "GUF-91", "A queen not only wears a crown but represents her people.", "Queen/Thet Htar Shwe Zin.png"),
-                ("Thet Myat Noe", "HND-64", "Your vibe attracts your tribe.", "Queen/Thet Myat Noe.png"),
-                ("Thiri Naing", "Level-3 Batch-38", "Vote Me", "Queen/Thiri Naing.png"),
-                ("Thoon Waddy", "HND-9 Business", "Vote Me", "Queen/Thoon Waddy.png"),
-                ("Thuu Thuu Han Wai", "HND-65", "Brown tones & soft vibes", "Queen/Thuu Thuu Han Wai.png"),
-                ("Zwe Sandar Htet", "HND-57", "Born to be a princess, destined to be a queen.", "Queen/Zwe Sandar Htet.png")
-            ]
-            
-            cursor.executemany("""
-                INSERT INTO queens (name, batch, bio, image_path) 
-                VALUES (%s, %s, %s, %s)
-            """, queens_data)
-        
-        # Insert lantern candidates if table is empty
-        cursor.execute("SELECT COUNT(*) FROM lanterns")
-        if cursor.fetchone()[0] == 0:
-            lanterns_data = [
-                ("Aurelia light", "GED-1", "a handmade soft pink lantern, inspired by the gentle beauty of the sea. Its ribbons and lights create a dreamy glow, symbolizing hope and creativity for the Thadingyut festival.", "Lantern/ged-1.jpg"),
-                ("ကြာပန်းမီးပုံလေး", "GUF-91", "ကျွန်မတို့သုငယ်ချက်းသုံးယောက်ကဘုရားကိုကပ်လှူချင်သောဆန္ဒကိုဦးတည်ကာတီထွင်ခဲ့ကြခြင်းဖြစ်ပါတယ်။", "Lantern/guf-91.jpg"),
-                ("'Water Lantern'", "GUF-92", "'May our Lantern Flow in the river with the light of hopes and carry our dream'", "Lantern/guf-92.jpg"),
-                ("'Fairybells of Moonlight' Lantern", "HND-6,7", "လမင်းရဲ့အလင်းကို ခေါင်းလောင်းပန်းလေးတစ်ပွင့်ထဲထည့်ထားသကဲ့သို့ ဖန်းတီးပေးထားပါတယ်ရှင့်", "Lantern/hnd-6,7.jpg"),
-                ("Lantern of Thadingyut", "HND-60", "မြန်မာ့ဓ‌လေ့နဲ့ သီတင်းကျွတ်‌နွေးထွေးမှုကို ပေါင်းစပ်ဖန်တီးထားတဲ့ မြန်မာ့သီတင်းကျွတ်မီးပုံးလး ပါရှင့်", "Lantern/hnd-60.jpg"),
-                ("ပဒုမ္မာဒီပ", "HND-65", "ကြာပန်းအလင်းက သန့်ရှင်းစင်ကြယ်တဲ့ အလင်းတရားကို သတိပေးနေတယ် လို့ ကိုယ်စားပြုပါတယ်", "Lantern/hnd-65.jpg"),
-                ("HND-69", "HND-69", "မီးပုံးလေးကို မီးဖွင့်ဖို့မမေ့ပါနဲ့ မှောင်နေတာလေးက မင်းမရှိတဲ့ ဘဝနဲ့တူလို့ပါ ကိုရယ်", "Lantern/hnd-69.jpg"),
-                ("Floral", "LV3-B39", "Floral Elegance for every occasion", "Lantern/lv3-b39.jpg"),
-                ("The Beauty of nature", "LV3-B42", "နွံထဲကနေတိုးထွက်ပြီးပွင့်ဖူးရတာတောင် ညစ်ပေကျံမနေဘဲ အလှပဆုံးပွင့်လန်းကြတာကြောင့်ဖြစ်ပါတယ်ရှင့်", "Lantern/lv3-b42.jpg"),
-                ("luminous lantern", "PreIG-B5", "နှစ်ပါးပေါင်းသွားတဲ့ မီးပုံးအလင်းတွေက လူ့စိတ်ထဲမှာရှိတဲ့ အမှောင်တိမ်တွေကို ဖယ်ရှားပေးသလို သီတင်းကျွတ်ညကို မေတ္တာနဲ့ ငြိမ်းချမ်းမှုအလင်းဖြင့် အလှဆင်ပေးနေပါတယ်", "Lantern/preIG-b5.jpg")
-            ]
-            
-            cursor.executemany("""
-                INSERT INTO lanterns (name, batch, description, image_path) 
-                VALUES (%s, %s, %s, %s)
-            """, lanterns_data)
-        
-        conn.commit()
-        print("Database initialized successfully!")
-        
+        applied = migrations.migrate()
+        print(f"Database initialized successfully! ({applied} migrations applied)")
     except Exception as e:
         print(f"Database initialization error: {e}")
-        conn.rollback()
-    finally:
-        cursor.close()
-        conn.close()
 
 # Routes
 
 @app.route("/api/final-ids")
 def api_final_ids():
-    conn = get_connection()
-    cur = conn.cursor(dictionary=True)
-
-    cur.execute("SELECT id, name, batch FROM final_kings ORDER BY id")
-    kings = cur.fetchall()
-    cur.execute("SELECT id, name, batch FROM final_queens ORDER BY id")
-    queens = cur.fetchall()
-
-    cur.close(); conn.close()
+    kings = [{"id": c.id, "name": c.name, "batch": c.batch} for c in repository.list_candidates("final_king")]
+    queens = [{"id": c.id, "name": c.name, "batch": c.batch} for c in repository.list_candidates("final_queen")]
     return jsonify({"kings": kings, "queens": queens})
 
+@app.route("/api/finalists")
+def api_finalists():
+    """The finalists manifest /final inlines (ids, photos, bios), revalidated by ETag"""
+    manifest = finalists.get()
+    response = Response(manifest.json, mimetype="application/json")
+    response.set_etag(manifest.version)
+    response.headers["Cache-Control"] = "public, max-age=0, must-revalidate"
+    return response.make_conditional(request)
+
+@app.route("/metrics")
+@require_admin_token
+def prometheus_metrics():
+    """Latency histograms for every worker, in Prometheus text format"""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/api/pool-stats")
+@require_admin_token
+def api_pool_stats():
+    """Connection pool counters for this worker (in use, waits, wait time)"""
+    backend = storage.get_backend()
+    return jsonify({"pid": os.getpid(), "backend": backend.name, **backend.get_pool().stats(), "ingest": ingest.stats(),
+                    "shed": ratelimit.stats(), "replicas": replicas.stats()})
+
 @app.route("/login")
 def login():
-    return render_template("login.html")
+    return page_cache.response("login.html")
 
 @app.route("/auth", methods=["POST"])
 def authenticate():
@@ -270,24 +231,16 @@ def logout():
 @app.route("/")
 # @require_auth
 def home():
-    return render_template("home.html")
+    return page_cache.response("home.html", vary=("user_name", "user_email"))
 
 @app.route("/candidates")
 @require_auth
 def candidates():
-    conn = get_connection()
-    cursor = conn.cursor(dictionary=True)
-    
-    cursor.execute("SELECT * FROM kings ORDER BY name")
-    kings = cursor.fetchall()
-    
-    cursor.execute("SELECT * FROM queens ORDER BY name")
-    queens = cursor.fetchall()
-    
-    cursor.close()
-    conn.close()
-    
-    return render_template("candidate-king.html", kings=kings, queens=queens)
+    return render_template(
+        "candidate-king.html",
+        kings=repository.list_candidates("king", by_name=True),
+        queens=repository.list_candidates("queen", by_name=True),
+    )
 
 @app.route("/viewmore")
 @require_auth
@@ -296,29 +249,17 @@ def viewmore():
     if not candidate_id:
         return redirect(url_for('candidates'))
     
-    conn = get_connection()
-    cursor = conn.cursor(dictionary=True)
-    
-    # Try to find in kings first
-    cursor.execute("SELECT *, 'king' as type FROM kings WHERE name LIKE %s", (f"%{candidate_id.replace('_', ' ')}%",))
-    candidate = cursor.fetchone()
-    
-    # If not found in kings, try queens
-    if not candidate:
-        cursor.execute("SELECT *, 'queen' as type FROM queens WHERE name LIKE %s", (f"%{candidate_id.replace('_', ' ')}%",))
-        candidate = cursor.fetchone()
-    
-    cursor.close()
-    conn.close()
-    
+    # Kings are matched before queens, as before
+    candidate = repository.find_candidate(candidate_id)
     if not candidate:
         flash("Candidate not found!", "error")
         return redirect(url_for('candidates'))
     
-    return render_template("viewmore.html", candidate=candidate)
+    return render_template("viewmore.html", candidate=candidate._asdict())
 
 @app.route("/vote", methods=["POST"])
 @require_auth
+@limited("vote")
 def vote():
     try:
         candidate_id = request.form.get('candidate_id')
@@ -326,46 +267,29 @@ def vote():
 
         if not candidate_id or not candidate_type:
             return jsonify({"success": False, "message": "Missing candidate information"})
+        if candidate_type not in ballot.CANDIDATE_TABLES:
+            return jsonify({"success": False, "message": "Invalid candidate type"})
 
-        conn = get_connection()
-        cursor = conn.cursor()
+        outcome = repository.cast_vote(session['user_id'], candidate_type, candidate_id)
 
-        # 1. Check if user already voted for this type
-        cursor.execute(
-            "SELECT * FROM votes WHERE user_uid = %s AND candidate_type = %s",
-            (session['user_id'], candidate_type)
-        )
-        if cursor.fetchone():
-            cursor.close()
-            conn.close()
+        if outcome == ballot.DUPLICATE:
             return jsonify({"success": False, "message": f"You have already voted for a {candidate_type}!"})
-
-        # 2. Update vote count in candidate table
-        table_name = f"{candidate_type}s"
-        cursor.execute(f"UPDATE {table_name} SET vote_count = vote_count + 1 WHERE id = %s", (candidate_id,))
-        if cursor.rowcount == 0:
-            conn.rollback()
-            cursor.close()
-            conn.close()
+        if outcome == ballot.UNKNOWN_CANDIDATE:
             return jsonify({"success": False, "message": "Candidate not found"})
 
-        # 3. Record that the user has voted
-        cursor.execute(
-            "INSERT INTO votes (user_uid, candidate_type, candidate_id) VALUES (%s, %s, %s)",
-            (session['user_id'], candidate_type, candidate_id)
-        )
-
-        conn.commit()
-        cursor.close()
-        conn.close()
-
+        mark_write()
         return jsonify({"success": True, "message": f"{candidate_type.capitalize()} vote recorded successfully!"})
 
+    except ingest.Backlogged as e:
+        return backlogged(e)
+    except storage.UNAVAILABLE as e:
+        return unavailable(e)
     except Exception as e:
         return jsonify({"success": False, "message": f"Error: {str(e)}"})
 
 @app.route("/vote_lantern", methods=["POST"])
 @require_auth
+@limited("vote_lantern")
 def vote_lantern():
     """Handle lantern voting via AJAX"""
     try:
@@ -378,45 +302,27 @@ def vote_lantern():
         if not token:
             return jsonify({"success": False, "message": "Token is required"})
 
-        conn = get_connection()
-        cursor = conn.cursor()
+        outcome = repository.cast_vote(session['user_id'], 'lantern', lantern_id)
 
-        # 1. Check if user already voted for lantern
-        cursor.execute(
-            "SELECT * FROM votes WHERE user_uid = %s AND candidate_type = 'lantern'",
-            (session['user_id'],)
-        )
-        if cursor.fetchone():
-            cursor.close()
-            conn.close()
+        if outcome == ballot.DUPLICATE:
             return jsonify({"success": False, "message": "You have already voted for a lantern!"})
-
-        # 2. Update vote count in lanterns table
-        cursor.execute("UPDATE lanterns SET vote_count = vote_count + 1 WHERE id = %s", (lantern_id,))
-        if cursor.rowcount == 0:
-            conn.rollback()
-            cursor.close()
-            conn.close()
+        if outcome == ballot.UNKNOWN_CANDIDATE:
             return jsonify({"success": False, "message": "Lantern not found"})
 
-        # 3. Record that the user has voted
-        cursor.execute(
-            "INSERT INTO votes (user_uid, candidate_type, candidate_id) VALUES (%s, 'lantern', %s)",
-            (session['user_id'], lantern_id)
-        )
-
-        conn.commit()
-        cursor.close()
-        conn.close()
-
+        mark_write()
         return jsonify({"success": True, "message": "Lantern vote recorded successfully!"})
 
+    except ingest.Backlogged as e:
+        return backlogged(e)
+    except storage.UNAVAILABLE as e:
+        return unavailable(e)
     except Exception as e:
         return jsonify({"success": False, "message": f"Error: {str(e)}"})
 
 
 @app.route("/final_vote", methods=["POST"])
 @require_auth
+@limited("final_vote")
 def final_vote():
     try:
         data = request.get_json(force=True) or {}
@@ -424,87 +330,42 @@ def final_vote():
         category = (data.get("category") or "").strip().lower()
         candidate_id = data.get("candidate_id")
 
-        if not token or not category or not candidate_id:
+        # The reward category has no candidate
+        if not token or not category or (not candidate_id and category != "reward"):
             return jsonify({"success": False, "message": "Token, category, and candidate are required"}), 400
 
         if len(token) != 6:
             return jsonify({"success": False, "message": "Token must be exactly 6 characters"}), 400
 
-        conn = get_connection()
-        cursor = conn.cursor(dictionary=True)
-
-        # Check token existence
-        cursor.execute("SELECT * FROM final_tokens WHERE token = %s", (token,))
-        token_row = cursor.fetchone()
-        if not token_row:
-            cursor.close()
-            conn.close()
+        # Turn away unknown or spent tokens without a database round trip
+        known = token_index.check(token, category)
+        if known == token_index.UNKNOWN:
             return jsonify({"success": False, "message": "Invalid token"}), 400
 
-        # Check if token already used for category
-        used_column = f"used_for_{category}"
-        if used_column not in token_row:
-            cursor.close()
-            conn.close()
+        if category not in ballot.FINAL_CATEGORIES:
             return jsonify({"success": False, "message": "Invalid voting category"}), 400
 
-        if token_row[used_column]:
-            cursor.close()
-            conn.close()
+        if known == token_index.USED:
             return jsonify({"success": False, "message": f"Token already used for {category}"}), 400
 
-        # Handle reward separately (no candidate table, no candidate required)
-        if category == "reward":
-            cursor.execute(
-                "INSERT INTO final_votes (token, category, candidate_id) VALUES (%s, %s, %s)",
-                (token, category, None)
-            )
-            cursor.execute(
-                """
-                UPDATE final_tokens
-                SET used_for_reward = 1,
-                    used_by_reward = %s,
-                    used_at_reward = NOW()
-                WHERE token = %s
-                """,
-                (session['user_id'], token)
-            )
-            
-        # Ensure candidate exists
-        valid = {
-            "king": "final_kings",
-            "queen": "final_queens",
-            "lantern": "lanterns"  # you don't have final_lanterns; keep using lanterns
-        }
-        table_name = valid.get(category)
-        if not table_name:
-            return jsonify({"success": False, "message": "Invalid voting category"}), 400
+        # Claim the token and record the ballot in one transaction; candidate
+        # totals come from the final_votes rollup (tally.py)
+        outcome = repository.redeem_token(token, category, candidate_id, session['user_id'])
 
-        # Record vote
-        cursor.execute(
-            "INSERT INTO final_votes (token, category, candidate_id) VALUES (%s, %s, %s)",
-            (token, category, candidate_id)
-        )
-
-        # Mark token as used and store vote details
-        update_query = f"""
-            UPDATE final_tokens
-            SET {used_column} = 1,
-                candidate_{category} = %s,
-                used_by_{category} = %s,                    used_at_{category} = NOW()
-            WHERE token = %s
-        """
-        cursor.execute(update_query, (candidate_id, session['user_id'], token))
-
-        # Increase candidate vote count where applicable
-        cursor.execute(f"UPDATE {table_name} SET vote_count = vote_count + 1 WHERE id = %s", (candidate_id,))
-
-        conn.commit()
-        cursor.close()
-        conn.close()
+        if outcome == ballot.INVALID_TOKEN:
+            return jsonify({"success": False, "message": "Invalid token"}), 400
+        if outcome == ballot.DUPLICATE:
+            token_index.mark_used(token, category)
+            return jsonify({"success": False, "message": f"Token already used for {category}"}), 400
+        if outcome == ballot.UNKNOWN_CANDIDATE:
+            return jsonify({"success": False, "message": "Candidate not found"}), 400
 
+        token_index.mark_used(token, category, session['user_id'])
+        mark_write()
         return jsonify({"success": True, "message": f"Your vote for {category} has been recorded."})
 
+    except storage.UNAVAILABLE as e:
+        return unavailable(e)
     except Exception as e:
         return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
 
@@ -513,53 +374,135 @@ def final_vote():
 
 @app.route("/results")
 def results():
-    conn = get_connection()
-    cursor = conn.cursor(dictionary=True)
-    
-    cursor.execute("SELECT * FROM kings ORDER BY vote_count DESC")
-    kings = cursor.fetchall()
-    
-    cursor.execute("SELECT * FROM queens ORDER BY vote_count DESC")
-    queens = cursor.fetchall()
-    
-    cursor.close()
-    conn.close()
-    
-    return render_template("voting_result.html", kings=kings, queens=queens)
+    # While anyone is watching the live stream its poller already has the
+    # counts, unless this user's own vote may not have reached its replica yet
+    fresh_since = read_your_writes()
+    live = None if fresh_since else results_stream.latest(max_age=results_stream.POLL_INTERVAL * 2)
+    if live is None:
+        try:
+            counts = repository.tally("votes", fresh_since=fresh_since)["votes"]
+        except storage.UNAVAILABLE:
+            # Read-only mode: the last counts this worker saw, however old
+            live = results_stream.latest()
+            if live is None:
+                raise
+    if live is not None:
+        counts = {category: {int(i): n for i, n in ids.items()} for category, ids in live.get("votes", {}).items()}
+
+    kings = tally.with_counts([c._asdict() for c in repository.list_candidates("king")], counts.get("king", {}))
+    queens = tally.with_counts([c._asdict() for c in repository.list_candidates("queen")], counts.get("queen", {}))
+    vote_counts = {
+        "king": {king["name"]: king["vote_count"] for king in kings},
+        "queen": {queen["name"]: queen["vote_count"] for queen in queens},
+    }
+
+    return render_template("voting_result.html", kings=kings, queens=queens, vote_counts=vote_counts)
+
+@app.route("/api/results")
+@app.route("/api/results/<category>")
+def api_results(category=None):
+    """Ranked standings; `?limit=N` for the top N, `?since=<version>` for changes only"""
+    limit = request.args.get("limit", type=int)
+    since = request.args.get("since", type=int)
+    if limit is not None and limit < 1:
+        return jsonify({"success": False, "message": "limit must be at least 1"}), 400
+    fresh_since = read_your_writes()
+    try:
+        if category is None:
+            data = leaderboard.get_all(limit, since, fresh_since)
+        elif category in leaderboard.CATEGORIES:
+            data = leaderboard.get(category, limit, since, fresh_since)
+        else:
+            return jsonify({"success": False, "message": f"Unknown category: {category}"}), 404
+    except storage.UNAVAILABLE as e:
+        return unavailable(e, "We can't reach the database right now.")
+    except Exception as e:
+        return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
+
+    response = jsonify(data)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@app.route("/results/stream")
+def results_stream_events():
+    """Server-Sent Events: a snapshot of the counts, then deltas as votes come in"""
+    try:
+        events = results_stream.stream()
+    except results_stream.Full as e:
+        # Every open stream holds a request thread; past the cap the page polls /api/results
+        metrics.SHED.add(1, "results_stream", "streams_full")
+        response = Response("Too many live viewers on this server right now.", status=503, mimetype="text/plain")
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response
+    response = Response(events, mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    # Stop nginx-style proxies from buffering the stream
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+@app.route("/admin/export/<table>")
+@require_admin_token
+def admin_export(table):
+    """Stream votes, final_votes or final_tokens as CSV/NDJSON (see export.py)"""
+    fmt = request.args.get("format", "csv")
+    try:
+        chunks = export.export(
+            table, fmt,
+            after=request.args.get("after", 0, type=int),
+            limit=request.args.get("limit", type=int),
+            category=request.args.get("category"),
+            candidate=request.args.get("candidate"),
+            since=request.args.get("since"),
+            until=request.args.get("until"),
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    response = Response(chunks, mimetype=export.FORMATS[fmt])
+    response.headers["Content-Disposition"] = f'attachment; filename="{table}.{fmt}"'
+    response.headers["Cache-Control"] = "no-store"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+@app.route("/api/token-index-stats")
+@require_admin_token
+def api_token_index_stats():
+    """Token index size and how many checks it answered for this worker"""
+    return jsonify({"pid": os.getpid(), **token_index.stats()})
+
+@app.route("/api/results-stream-stats")
+@require_admin_token
+def api_results_stream_stats():
+    """Live results subscribers and poll count for this worker"""
+    return jsonify({"pid": os.getpid(), **results_stream.stats()})
 
 @app.route("/lantern")
 @require_auth
 def lantern():
-    conn = get_connection()
-    cursor = conn.cursor(dictionary=True)
-    
-    cursor.execute("SELECT * FROM lanterns ORDER BY id")
-    lanterns = cursor.fetchall()
-    
-    cursor.close()
-    conn.close()
-    
-    return render_template("lantern.html", lanterns=lanterns)
+    return render_template("lantern.html", lanterns=repository.list_candidates("lantern"))
 
 @app.route("/about")
 def about():
-    return render_template("about_us.html")
+    return page_cache.response("about_us.html")
 
 @app.route("/final")
 def final():
-    return render_template("final.html")
+    # The finalists manifest is inlined, so the page needs no further requests
+    manifest = finalists.get()
+    return page_cache.response("final.html", version=manifest.version, context={"finalists": manifest})
 
 @app.route("/winner")
 def winner():
-    return render_template("winner.html")
+    return page_cache.response("winner.html")
 
 @app.route("/mote_phoe")
 @require_auth
 def mote_phoe():
-    return render_template("mote_phoe.html")
+    return page_cache.response("mote_phoe.html", private=True)
 
 @app.route("/reward_claim", methods=["POST"])
 @require_auth
+@limited("reward_claim")
 def reward_claim():
     try:
         data = request.get_json(force=True) or {}
@@ -570,25 +513,30 @@ def reward_claim():
         if len(token) != 6:
             return jsonify({"success": False, "message": "Token must be exactly 6 characters"}), 400
 
-        conn = get_connection()
-        cursor = conn.cursor(dictionary=True)
+        # Unknown tokens and repeat views of a claimed reward are answered from memory
+        known = token_index.check(token, "reward")
+        if known == token_index.UNKNOWN:
+            return jsonify({"success": False, "message": "Invalid token"}), 400
+        state = token_index.get(token)
+        if known == token_index.USED and state.used_by_reward is not None:
+            if state.used_by_reward == session.get('user_id'):
+                return jsonify({
+                    "success": True,
+                    "message": "Already claimed. Showing your reward.",
+                    "reward_value": state.reward_value,
+                    "token": token
+                })
+            return jsonify({"success": False, "message": "This token has already been used by another user."}), 400
 
-        cursor.execute("SELECT * FROM final_tokens WHERE token = %s", (token,))
-        token_row = cursor.fetchone()
-        if not token_row:
-            cursor.close()
-            conn.close()
+        outcome, used_by_reward, reward_value = repository.claim_reward(token, session['user_id'])
+        if outcome == ballot.INVALID_TOKEN:
             return jsonify({"success": False, "message": "Invalid token"}), 400
 
-        used_for_reward = bool(token_row.get("used_for_reward"))
-        used_by_reward = token_row.get("used_by_reward")
-        reward_value = token_row.get("reward_value")
+        token_index.mark_used(token, "reward", used_by_reward)
 
         # If already used, only allow the same user to view again
-        if used_for_reward:
+        if outcome == ballot.DUPLICATE:
             if used_by_reward == session.get('user_id'):
-                cursor.close()
-                conn.close()
                 return jsonify({
                     "success": True,
                     "message": "Already claimed. Showing your reward.",
@@ -596,30 +544,8 @@ def reward_claim():
                     "token": token
                 })
             else:
-                cursor.close()
-                conn.close()
                 return jsonify({"success": False, "message": "This token has already been used by another user."}), 400
 
-        # Not used yet: claim it for this user and return the value
-        cursor.execute(
-            "INSERT INTO final_votes (token, category, candidate_id) VALUES (%s, %s, %s)",
-            (token, 'reward', None)
-        )
-        cursor.execute(
-            """
-            UPDATE final_tokens
-            SET used_for_reward = 1,
-                used_by_reward = %s,
-                used_at_reward = NOW()
-            WHERE token = %s
-            """,
-            (session['user_id'], token)
-        )
-
-        conn.commit()
-        cursor.close()
-        conn.close()
-
         return jsonify({
             "success": True,
             "message": "Token verified successfully.",
@@ -627,33 +553,47 @@ def reward_claim():
             "token": token
         })
 
+    except storage.UNAVAILABLE as e:
+        return unavailable(e)
     except Exception as e:
         return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
 
 # Serve images from templates folder
 @app.route('/img/<path:filename>')
 def serve_image(filename):
-    return send_from_directory('templates/img', filename)
+    return images.send_image(f"img/{filename}", 'templates/img', filename)
 
 @app.route('/Kings/<path:filename>')
 def serve_king_images(filename):
-    return send_from_directory('templates/Kings', filename)
+    return images.send_image(f"Kings/{filename}", 'templates/Kings', filename)
 
 @app.route('/Queen/<path:filename>')
 def serve_queen_images(filename):
-    return send_from_directory('templates/Queen', filename)
+    return images.send_image(f"Queen/{filename}", 'templates/Queen', filename)
 
 @app.route('/Queen_Viewmore/<path:filename>')
 def serve_queen_viewmore_images(filename):
-    return send_from_directory('templates/img/Queen_Viewmore', filename)
+    return images.send_image(f"img/Queen_Viewmore/{filename}", 'templates/img/Queen_Viewmore', filename)
 
 @app.route('/King_Viewmore/<path:filename>')
 def serve_king_viewmore_images(filename):
-    return send_from_directory('templates/img/King_Viewmore', filename)
+    return images.send_image(f"img/King_Viewmore/{filename}", 'templates/img/King_Viewmore', filename)
 
 @app.route('/Lantern/<path:filename>')
 def serve_lantern_images(filename):
-    return send_from_directory('templates/Lantern', filename)
+    return images.send_image(f"Lantern/{filename}", 'templates/Lantern', filename)
+
+# Content-hashed copies of the files above, cacheable forever
+@app.route('/assets/<path:name>')
+def serve_asset(name):
+    asset = assets.lookup(name)
+    if asset is None:
+        abort(404)
+    if asset.key in images.manifest():
+        response = images.send_image(asset.key, os.path.dirname(asset.path), os.path.basename(asset.path))
+        response.headers["Cache-Control"] = assets.IMMUTABLE
+        return response
+    return assets.send(asset)
 
 # Serve static files (CSS, JS, etc.)
 @app.route('/static/<path:filename>')
@@ -663,5 +603,10 @@ def serve_static(filename):
 # Initialize database on startup
 if __name__ == "__main__":
     init_database()
+    tally.start_background_fold()
+    token_index.start_background_sync()
+    ingest.start_background_commit()
+    reconcile.start_background_reconcile()
+    replicas.start_background_check()
     port = int(os.environ.get("PORT", 5000))  # Use Render's PORT, default to 5000 locally
     app.run(host="0.0.0.0", port=port, debug=True)
\ No newline at end of file
@@ -0,0 +1,154 @@
+"""Content-hashed, precompressed static assets.
+
+On first use every file under the asset folders is fingerprinted and given
+a URL like `/assets/img/SeMeeKut.3f2a9c1b0d.png`. Since the URL changes
+whenever the file does, responses can be cached by browsers forever
+(`Cache-Control: immutable`). Text assets are gzipped (and brotli'd when
+the `brotli` package is installed) once, up front.
+
+Templates get hashed URLs from `asset_url('img/x.png')`, and the `url_for`
+override below rewrites the image/static endpoints the same way.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+from collections import namedtuple
+from urllib.parse import quote
+
+from flask import Response, request, send_file
+from flask import url_for as flask_url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# URL prefix -> directory
+ASSET_DIRS = {
+    "static": "static",
+    "img": "templates/img",
+    "Kings": "templates/Kings",
+    "Queen": "templates/Queen",
+    "Lantern": "templates/Lantern",
+}
+
+# url_for endpoint -> URL prefix of its files
+ENDPOINT_PREFIXES = {
+    "static": "static/",
+    "serve_static": "static/",
+    "serve_image": "img/",
+    "serve_king_images": "Kings/",
+    "serve_queen_images": "Queen/",
+    "serve_lantern_images": "Lantern/",
+    "serve_king_viewmore_images": "img/King_Viewmore/",
+    "serve_queen_viewmore_images": "img/Queen_Viewmore/",
+}
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+TEXT_EXTENSIONS = {".js", ".css", ".svg", ".json", ".txt", ".map", ".webmanifest"}
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+Asset = namedtuple("Asset", "key path hashed mimetype etag encodings")
+
+
+def _fingerprint(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:10]
+
+
+def _precompress(path):
+    with open(path, "rb") as f:
+        raw = f.read()
+    encodings = {"gzip": gzip.compress(raw, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        encodings["br"] = brotli.compress(raw, quality=11)
+    return encodings
+
+
+def build(root=ROOT):
+    """Scan the asset folders and return {key: Asset} plus {hashed name: key}"""
+    by_key, by_hashed = {}, {}
+    for prefix, directory in ASSET_DIRS.items():
+        directory = os.path.join(root, directory)
+        for dirpath, _, files in os.walk(directory):
+            for name in files:
+                path = os.path.join(dirpath, name)
+                key = prefix + "/" + os.path.relpath(path, directory).replace(os.sep, "/")
+                stem, ext = os.path.splitext(key)
+                digest = _fingerprint(path)
+                hashed = f"{stem}.{digest}{ext}"
+                encodings = _precompress(path) if ext.lower() in TEXT_EXTENSIONS else {}
+                mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+                by_key[key] = Asset(key, os.path.abspath(path), hashed, mimetype, digest, encodings)
+                by_hashed[hashed] = key
+    return by_key, by_hashed
+
+
+_by_key = None
+_by_hashed = None
+_lock = threading.Lock()
+
+
+def load(root=ROOT):
+    """(Re)build the manifest now"""
+    global _by_key, _by_hashed
+    by_key, by_hashed = build(root)
+    _by_hashed, _by_key = by_hashed, by_key
+    return by_key
+
+
+def _manifest():
+    if _by_key is None:
+        with _lock:
+            if _by_key is None:
+                load()
+    return _by_key, _by_hashed
+
+
+def lookup(hashed):
+    """Asset for a hashed name like 'img/SeMeeKut.3f2a9c1b0d.png', or None"""
+    by_key, by_hashed = _manifest()
+    key = by_hashed.get(hashed)
+    return by_key[key] if key else None
+
+
+def url(path):
+    """Hashed URL for 'img/x.png'-style paths; unknown files keep their plain URL"""
+    key = path.lstrip("/")
+    asset = _manifest()[0].get(key)
+    if asset is None:
+        return "/" + quote(key)
+    return "/assets/" + quote(asset.hashed)
+
+
+def url_for(endpoint, **values):
+    """Drop-in for Flask's url_for that returns hashed URLs for asset files"""
+    prefix = ENDPOINT_PREFIXES.get(endpoint)
+    if prefix is not None and set(values) == {"filename"}:
+        asset = _manifest()[0].get(prefix + values["filename"])
+        if asset is not None:
+            return "/assets/" + quote(asset.hashed)
+    return flask_url_for(endpoint, **values)
+
+
+def send(asset):
+    """Send an asset with immutable caching and the best precompressed encoding"""
+    accepted = request.accept_encodings
+    encoding = next((e for e in ("br", "gzip") if e in asset.encodings and accepted[e] > 0), None)
+    if encoding is not None:
+        response = Response(asset.encodings[encoding], mimetype=asset.mimetype)
+        response.headers["Content-Encoding"] = encoding
+        response.set_etag(f"{asset.etag}-{encoding}")
+        response.make_conditional(request)
+    else:
+        response = send_file(asset.path, mimetype=asset.mimetype, etag=asset.etag, max_age=None)
+    if asset.encodings:
+        response.vary.add("Accept-Encoding")
+    response.headers["Cache-Control"] = IMMUTABLE
+    return response
@@ -0,0 +1,209 @@
+"""Ballot engine for the first-round votes (`/vote`, `/vote_lantern`) and
+the token-based final round (`/final_vote`, `/reward_claim`).
+
+A vote is a single INSERT ... SELECT against `votes`. The SELECT half checks
+the candidate exists, and `UNIQUE KEY unique_vote (user_uid, candidate_type)`
+decides duplicates, so there is no read-then-write race and the whole thing
+is one round trip on an autocommit connection.
+
+A final-round token is claimed with one conditional
+`UPDATE final_tokens ... WHERE token = %s AND used_for_<category> = 0`
+(which also checks the candidate exists), run in autocommit. Its
+affected-row count decides who wins a race for the same token: a winner
+then writes its `final_votes` row, and only a loser pays for a second
+query to find out why it lost.
+
+`cast_votes()` does the same for a batch of votes drained from the ingest
+log (ingest.py), in one statement.
+"""
+from mysql.connector import errorcode
+from mysql.connector.errors import IntegrityError
+
+import metrics
+import storage
+
+RECORDED = "recorded"
+DUPLICATE = "duplicate"
+UNKNOWN_CANDIDATE = "unknown_candidate"
+INVALID_TOKEN = "invalid_token"
+
+CANDIDATE_TABLES = {
+    "king": "kings",
+    "queen": "queens",
+    "lantern": "lanterns",
+}
+
+# Final round: category -> candidate table (there is no final_lanterns)
+FINAL_CANDIDATE_TABLES = {
+    "king": "final_kings",
+    "queen": "final_queens",
+    "lantern": "lanterns",
+}
+FINAL_CATEGORIES = tuple(FINAL_CANDIDATE_TABLES) + ("reward",)
+
+_INSERT = {
+    candidate_type: f"""
+        INSERT INTO votes (user_uid, candidate_type, candidate_id)
+        SELECT %s, %s, id FROM {table} WHERE id = %s
+    """
+    for candidate_type, table in CANDIDATE_TABLES.items()
+}
+
+
+def cast_vote(conn, user_uid, candidate_type, candidate_id):
+    """Record one vote and return RECORDED, DUPLICATE or UNKNOWN_CANDIDATE.
+
+    Raises ValueError for a candidate_type that isn't king/queen/lantern.
+    """
+    sql = _INSERT.get(candidate_type)
+    if sql is None:
+        raise ValueError(f"Invalid candidate type: {candidate_type}")
+
+    cursor = conn.cursor()
+    try:
+        with metrics.query("vote.insert"):
+            cursor.execute(sql, (user_uid, candidate_type, candidate_id))
+        inserted = cursor.rowcount
+    except IntegrityError as e:
+        if e.errno == errorcode.ER_DUP_ENTRY:
+            return DUPLICATE
+        raise
+    finally:
+        cursor.close()
+    if conn.in_transaction:
+        conn.commit()
+    return RECORDED if inserted == 1 else UNKNOWN_CANDIDATE
+
+
+def cast_votes(conn, votes):
+    """Insert (user_uid, candidate_type, candidate_id) votes in one statement.
+
+    The candidates must already be known to exist (ingest.py checks them
+    against the catalog). Duplicates of a vote already in the table are
+    skipped; returns how many rows were inserted.
+    """
+    if not votes:
+        return 0
+    placeholders = ", ".join(["(%s, %s, %s)"] * len(votes))
+    params = [value for vote in votes for value in vote]
+    cursor = conn.cursor()
+    try:
+        with metrics.query("votes.insert_batch"):
+            cursor.execute(
+                f"{storage.get_backend().insert_ignore} INTO votes (user_uid, candidate_type, candidate_id) "
+                f"VALUES {placeholders}",
+                params
+            )
+        inserted = cursor.rowcount
+    finally:
+        cursor.close()
+    if conn.in_transaction:
+        conn.commit()
+    return inserted
+
+
+_CLAIM = {
+    category: f"""
+        UPDATE final_tokens
+        SET used_for_{category} = 1,
+            candidate_{category} = %s,
+            used_by_{category} = %s,
+            used_at_{category} = CURRENT_TIMESTAMP
+        WHERE token = %s AND used_for_{category} = 0
+          AND EXISTS (SELECT 1 FROM {table} WHERE id = %s)
+    """
+    for category, table in FINAL_CANDIDATE_TABLES.items()
+}
+_CLAIM_REWARD = """
+    UPDATE final_tokens
+    SET used_for_reward = 1,
+        used_by_reward = %s,
+        used_at_reward = CURRENT_TIMESTAMP
+    WHERE token = %s AND used_for_reward = 0
+"""
+
+# Undoes a claim that was committed but whose ballot couldn't be written
+_RELEASE = {
+    category: f"""
+        UPDATE final_tokens
+        SET used_for_{category} = 0,
+            used_by_{category} = NULL,
+            used_at_{category} = NULL{'' if category == 'reward' else f', candidate_{category} = NULL'}
+        WHERE token = %s AND used_for_{category} = 1 AND used_by_{category} = %s
+    """
+    for category in FINAL_CATEGORIES
+}
+
+
+def _why_not_claimed(conn, token, category, candidate_id):
+    """One query to tell an unknown token from a spent one from a bad candidate"""
+    cursor = conn.cursor()
+    table = FINAL_CANDIDATE_TABLES.get(category)
+    with metrics.query("final_tokens.lookup"):
+        if table is None:
+            cursor.execute(
+                f"SELECT (SELECT used_for_{category} FROM final_tokens WHERE token = %s), 1",
+                (token,)
+            )
+        else:
+            cursor.execute(
+                f"""
+                SELECT (SELECT used_for_{category} FROM final_tokens WHERE token = %s),
+                       EXISTS (SELECT 1 FROM {table} WHERE id = %s)
+                """,
+                (token, candidate_id)
+            )
+        used, candidate_exists = cursor.fetchone()
+    cursor.close()
+    if used is None:
+        return INVALID_TOKEN
+    if used:
+        return DUPLICATE
+    if not candidate_exists:
+        return UNKNOWN_CANDIDATE
+    # Only reachable if the row changed between the two statements
+    return DUPLICATE
+
+
+def redeem_final(conn, token, category, candidate_id, user_uid):
+    """Spend `token` on `category` and record the final-round ballot.
+
+    Returns RECORDED, INVALID_TOKEN, DUPLICATE (already used for that
+    category) or UNKNOWN_CANDIDATE. `candidate_id` is ignored for 'reward'.
+    Raises ValueError for a category outside FINAL_CATEGORIES.
+    """
+    if category not in FINAL_CATEGORIES:
+        raise ValueError(f"Invalid voting category: {category}")
+    if category == "reward":
+        candidate_id = None
+        claim, params = _CLAIM_REWARD, (user_uid, token)
+    else:
+        claim, params = _CLAIM[category], (candidate_id, user_uid, token, candidate_id)
+
+    cursor = conn.cursor()
+    try:
+        with metrics.query("final_tokens.claim"):
+            cursor.execute(claim, params)
+        if cursor.rowcount != 1:
+            return _why_not_claimed(conn, token, category, candidate_id)
+        try:
+            with metrics.query("final_votes.insert"):
+                cursor.execute(
+                    "INSERT INTO final_votes (token, category, candidate_id) VALUES (%s, %s, %s)",
+                    (token, category, candidate_id)
+                )
+            if conn.in_transaction:
+                conn.commit()
+        except Exception:
+            # The claim is already committed: give the token back rather
+            # than leave it spent with no ballot behind it
+            if conn.in_transaction:
+                conn.rollback()
+            with metrics.query("final_tokens.release"):
+                cursor.execute(_RELEASE[category], (token, user_uid))
+            if conn.in_transaction:
+                conn.commit()
+            raise
+    finally:
+        cursor.close()
+    return RECORDED
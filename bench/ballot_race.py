@@ -0,0 +1,216 @@
+"""Race and round-trip check for ballot.cast_vote.
+
+Fires many parallel votes per uid at the configured database and checks
+that exactly one ballot per (uid, category) lands. The same storm is run
+through the original /vote flow (SELECT, UPDATE vote_count, INSERT in one
+transaction) for comparison, and every database call is counted so the
+round trips per vote can be compared too.
+
+Point the DB_* variables at a scratch database before running: the run
+inserts ballots with `race-` uids and deletes them again at the end
+(restoring vote_count). `--standin` runs against a fresh SQLite file behind
+bench/standin.py instead, with no server at all. The stand-in takes
+SQLite's write lock when a transaction starts, so the original flow
+can't race there; its lost updates only show against MySQL.
+
+    python -m bench.ballot_race --uids 20 --attempts 200 --connections 16
+    python -m bench.ballot_race --standin --rtt-ms 5
+"""
+import argparse
+import os
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from mysql.connector.errors import IntegrityError
+
+import ballot
+import db_pool
+
+
+class CountingConnection:
+    """Wraps a connection and counts calls that go to the server"""
+
+    def __init__(self, conn, counter):
+        self._conn = conn
+        self._counter = counter
+
+    def _hit(self):
+        self._counter.append(1)
+
+    def cursor(self, *args, **kwargs):
+        return CountingCursor(self._conn.cursor(*args, **kwargs), self._hit)
+
+    def start_transaction(self, *args, **kwargs):
+        self._hit()
+        return self._conn.start_transaction(*args, **kwargs)
+
+    def commit(self):
+        self._hit()
+        return self._conn.commit()
+
+    def rollback(self):
+        self._hit()
+        return self._conn.rollback()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class CountingCursor:
+    def __init__(self, cursor, hit):
+        self._cursor = cursor
+        self._hit = hit
+
+    def execute(self, *args, **kwargs):
+        self._hit()
+        return self._cursor.execute(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def legacy_vote(conn, user_uid, candidate_type, candidate_id):
+    """The original /vote flow: check for a ballot, bump vote_count, insert, commit"""
+    cursor = conn.cursor()
+    # The route's connection had autocommit off, so all three ran in one transaction
+    conn.start_transaction()
+    try:
+        cursor.execute(
+            "SELECT * FROM votes WHERE user_uid = %s AND candidate_type = %s",
+            (user_uid, candidate_type)
+        )
+        if cursor.fetchone():
+            conn.rollback()
+            return ballot.DUPLICATE
+        cursor.execute(f"UPDATE {candidate_type}s SET vote_count = vote_count + 1 WHERE id = %s", (candidate_id,))
+        if cursor.rowcount == 0:
+            conn.rollback()
+            return ballot.UNKNOWN_CANDIDATE
+        try:
+            cursor.execute(
+                "INSERT INTO votes (user_uid, candidate_type, candidate_id) VALUES (%s, %s, %s)",
+                (user_uid, candidate_type, candidate_id)
+            )
+        except IntegrityError:
+            # Passed the pre-read but lost the race; the old route reported this as an error
+            conn.rollback()
+            return "raced"
+        conn.commit()
+        return ballot.RECORDED
+    finally:
+        cursor.close()
+
+
+def storm(pool, flow, uids, attempts, candidate_id, workers):
+    counter = []
+    outcomes = {}
+
+    def one(uid):
+        with pool.connection() as conn:
+            return flow(CountingConnection(conn, counter), uid, "king", candidate_id)
+
+    jobs = [uid for uid in uids for _ in range(attempts)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for outcome in executor.map(one, jobs):
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    elapsed = time.perf_counter() - start
+    return outcomes, len(counter), elapsed
+
+
+def recorded_per_uid(pool, prefix):
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT user_uid, COUNT(*) FROM votes WHERE user_uid LIKE %s GROUP BY user_uid",
+            (prefix + "%",)
+        )
+        rows = dict(cursor.fetchall())
+        cursor.close()
+    return rows
+
+
+def vote_count(pool, candidate_id):
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT vote_count FROM kings WHERE id = %s", (candidate_id,))
+        count = cursor.fetchone()[0]
+        cursor.close()
+    return count
+
+
+def cleanup(pool, prefix, candidate_id, count):
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM votes WHERE user_uid LIKE %s", (prefix + "%",))
+        cursor.execute("UPDATE kings SET vote_count = %s WHERE id = %s", (count, candidate_id))
+        cursor.close()
+
+
+def use_standin(rtt_ms):
+    """Point mysql.connector at a fresh, migrated SQLite file (bench/standin.py)"""
+    from bench import standin
+    path = os.path.join(tempfile.mkdtemp(prefix="race-"), "vote.db")
+    standin.install(path)
+    os.environ["STORAGE_BACKEND"] = "mysql"
+    import migrations
+    migrations.migrate()
+    # The round trip applies to the storm, not to setting up
+    standin.install(path, rtt_ms=rtt_ms)
+    return path
+
+
+def add_arguments(parser):
+    parser.add_argument("--connections", type=int, default=16)
+    parser.add_argument("--standin", action="store_true", help="run on bench/standin.py instead of the DB_* server")
+    parser.add_argument("--rtt-ms", type=float, default=0, help="simulated round trip per statement (--standin)")
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--uids", type=int, default=20)
+    parser.add_argument("--attempts", type=int, default=200, help="parallel votes per uid")
+    add_arguments(parser)
+    args = parser.parse_args()
+    if args.standin:
+        use_standin(args.rtt_ms)
+
+    pool = db_pool.ConnectionPool(size=args.connections, timeout=60, **db_pool.connect_kwargs())
+    pool.warm()
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT MIN(id) FROM kings")
+        candidate_id = cursor.fetchone()[0]
+        cursor.close()
+    if candidate_id is None:
+        raise SystemExit("No kings in this database; run init_database() first")
+
+    failed = False
+    for name, flow in (("legacy", legacy_vote), ("engine", ballot.cast_vote)):
+        prefix = f"race-{name}-{uuid.uuid4().hex[:8]}-"
+        uids = [f"{prefix}{i}" for i in range(args.uids)]
+        count = vote_count(pool, candidate_id)
+        try:
+            outcomes, trips, elapsed = storm(pool, flow, uids, args.attempts, candidate_id, args.connections)
+            landed = recorded_per_uid(pool, prefix)
+        finally:
+            cleanup(pool, prefix, candidate_id, count)
+
+        votes = args.uids * args.attempts
+        exactly_one = all(landed.get(uid) == 1 for uid in uids)
+        reported = outcomes.get(ballot.RECORDED, 0)
+        print(f"{name:>7}: {votes} votes in {elapsed:.2f}s, {trips / votes:.2f} round trips/vote, outcomes {outcomes}")
+        print(f"         one ballot per uid: {exactly_one}; successes reported: {reported} (want {args.uids})")
+        if name == "engine" and not (exactly_one and reported == args.uids):
+            failed = True
+
+    pool.close()
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Throughput vs client concurrency for different gunicorn settings.
+
+Starts gunicorn with the project's gunicorn.conf.py once per setting and
+hammers one path with 1, 8, 32, ... concurrent keep-alive clients.
+
+By default the path is `/_bench/io`, a route added by this module that
+sleeps `--io-ms` (like waiting on a remote MySQL round trip) and returns,
+so no database is needed. The app's real routes are all still there, so
+`--path /api/results` measures a real read against a scratch database.
+
+Only 2xx responses count, and the rate is over the time until the last
+request finished, including those still running at the deadline. Failed
+requests (non-2xx or no answer) are reported per cell.
+
+    python -m bench.concurrency --io-ms 40 --seconds 5
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# (label, workers, worker class, threads)
+SETTINGS = [
+    ("sync 1x1 (old Procfile)", 1, "sync", 1),
+    ("gthread 1x8", 1, "gthread", 8),
+    ("gthread 1x32", 1, "gthread", 32),
+    ("gthread 2x32", 2, "gthread", 32),
+]
+
+if os.getenv("BENCH_IO_MS"):
+    from app import app
+
+    @app.route("/_bench/io")
+    def bench_io():
+        time.sleep(float(os.environ["BENCH_IO_MS"]) / 1000)
+        return "ok"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workers, worker_class, threads, io_ms, port):
+    env = dict(
+        os.environ,
+        GUNICORN_WORKERS=str(workers),
+        GUNICORN_WORKER_CLASS=worker_class,
+        GUNICORN_THREADS=str(threads),
+        PORT=str(port),
+        BENCH_IO_MS=str(io_ms),
+        PAGE_CACHE=os.getenv("PAGE_CACHE", "1"),
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--log-level", "warning", "bench.concurrency:app"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url + "/_bench/io", timeout=1)
+            return server, url
+        except requests.RequestException:
+            time.sleep(0.2)
+    server.kill()
+    raise SystemExit("gunicorn did not come up")
+
+
+def load(url, clients, seconds):
+    """(2xx responses per second, failed requests, p50, p95) for `clients` looping on `url`.
+
+    Requests still in flight at the deadline are waited for, so the rate is
+    over the time until the last one finished, not the nominal `seconds`.
+    """
+    start = time.monotonic()
+    deadline = start + seconds
+
+    def client(_):
+        session = requests.Session()
+        latencies, failed = [], 0
+        while time.monotonic() < deadline:
+            sent = time.perf_counter()
+            try:
+                ok = session.get(url, timeout=30).ok
+            except requests.RequestException:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - sent)
+            else:
+                failed += 1
+        return latencies, failed, time.monotonic()
+
+    with ThreadPoolExecutor(clients) as pool:
+        results = list(pool.map(client, range(clients)))
+    elapsed = max(finished for _, _, finished in results) - start
+    latencies = sorted(t for result, _, _ in results for t in result)
+    failed = sum(n for _, n, _ in results)
+    if not latencies:
+        return 0.0, failed, 0.0, 0.0
+    p95 = latencies[max(int(len(latencies) * 0.95) - 1, 0)]
+    return len(latencies) / elapsed, failed, statistics.median(latencies), p95
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--path", default="/_bench/io")
+    parser.add_argument("--io-ms", type=float, default=40, help="simulated DB wait for /_bench/io")
+    parser.add_argument("--clients", default="1,8,32,64")
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+    levels = [int(n) for n in args.clients.split(",")]
+
+    print(f"{args.path}" + (f" ({args.io_ms:.0f}ms simulated wait)" if args.path == "/_bench/io" else ""))
+    print(f"{'setting':<26}" + "".join(f"{str(n) + ' clients':>22}" for n in levels))
+    for label, workers, worker_class, threads in SETTINGS:
+        server, url = start_server(workers, worker_class, threads, args.io_ms, free_port())
+        try:
+            cells = []
+            for clients in levels:
+                rate, failed, p50, p95 = load(url + args.path, clients, args.seconds)
+                cells.append(f"{rate:>7.0f}/s p95 {p95 * 1000:>5.0f}ms" + (f" ({failed} failed)" if failed else ""))
+            print(f"{label:<26}" + "".join(f"{cell:>22}" for cell in cells))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""Fault injection: the app while its database stops answering.
+
+A stall is the nasty case: the server (or a NAT box or proxy on the way)
+stops answering without closing anything, so without timeouts every
+connect and query just waits. The run drives a voting-night mix through
+a fixed pool of `--threads` request threads, as one gthread worker would,
+and stalls the database for `--stall` seconds in the middle:
+
+    healthy   before the stall
+    stalled   during it: pages that need no database (/, /candidates from
+              the catalog snapshot) should stay fast, and ballots should
+              fail fast with 503 + Retry-After once the breaker opens
+    recovered after it: the breaker's probe closes it and ballots work again
+
+It runs twice, with breaker.py's guards on and with them off (no request
+deadline, no connect or query timeout, a breaker that never opens), and
+checks that no pooled connection is left checked out afterwards.
+
+The stall comes from `StallProxy`, a local TCP proxy that can pass
+traffic, hold it, or refuse connections. With `--upstream` the app talks
+to a scratch MySQL server through it. Without one the database is the
+stand-in (bench/standin.py), stalled in-process, and the proxy, with
+nothing behind it, still checks that a real mysql.connector connect to a
+silent server gives up on time:
+
+    python -m bench.db_faults --stall 8
+    DB_USER=... DB_PASSWORD=... DB_NAME=scratch python -m bench.db_faults --upstream db.local:3306
+"""
+import argparse
+import os
+import selectors
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench import loadtest, standin
+
+MIX = [(3, "home"), (3, "candidates"), (3, "vote"), (2, "api_results")]
+PHASES = ("healthy", "stalled", "recovered")
+
+
+class StallProxy:
+    """A TCP proxy on localhost that passes traffic, stalls it, or refuses connections"""
+
+    def __init__(self, upstream=None):
+        # (host, port), or None: nothing behind the proxy, every connection hangs
+        self.upstream = upstream
+        self.mode = "pass"
+        self._server = socket.create_server(("127.0.0.1", 0))
+        self.port = self._server.getsockname()[1]
+        self._sockets = set()
+        self._lock = threading.Lock()
+        threading.Thread(target=self._accept, name="stall-proxy", daemon=True).start()
+
+    def stall(self):
+        """Hold every byte in both directions and leave connections open"""
+        self.mode = "stall"
+
+    def refuse(self):
+        """Reset open connections and close new ones at once"""
+        self.mode = "refuse"
+        with self._lock:
+            sockets, self._sockets = self._sockets, set()
+        for sock in sockets:
+            sock.close()
+
+    def resume(self):
+        self.mode = "pass"
+
+    def _accept(self):
+        while True:
+            client, _ = self._server.accept()
+            if self.mode == "refuse":
+                client.close()
+                continue
+            threading.Thread(target=self._serve, args=(client,), daemon=True).start()
+
+    def _serve(self, client):
+        with self._lock:
+            self._sockets.add(client)
+        if self.upstream is None:
+            # Accept and never answer, like a server that has stopped responding
+            while client.fileno() != -1 and client.recv(65536):
+                pass
+            return
+        upstream = socket.create_connection(self.upstream)
+        with self._lock:
+            self._sockets.add(upstream)
+        selector = selectors.DefaultSelector()
+        selector.register(client, selectors.EVENT_READ, upstream)
+        selector.register(upstream, selectors.EVENT_READ, client)
+        try:
+            while True:
+                for key, _ in selector.select():
+                    data = key.fileobj.recv(65536)
+                    if not data:
+                        return
+                    while self.mode == "stall":
+                        time.sleep(0.02)
+                    key.data.sendall(data)
+        except OSError:
+            pass
+        finally:
+            client.close()
+            upstream.close()
+
+
+def check_driver_timeouts(connect_timeout):
+    """Connect through the proxy to a silent server: does it give up after connect_timeout?"""
+    import db_pool
+    proxy = StallProxy()
+    pool = db_pool.ConnectionPool(
+        size=2, timeout=1, query_timeout=connect_timeout, name="silent",
+        **{**db_pool.connect_kwargs(), "host": "127.0.0.1", "port": proxy.port, "ssl_ca": None,
+           "user": "bench", "password": "bench", "connection_timeout": connect_timeout},
+    )
+    timings = []
+    errors = []
+    for _ in range(pool.breaker.failures + 3):
+        start = time.perf_counter()
+        try:
+            with pool.connection():
+                pass
+        except Exception as e:
+            errors.append(type(e).__name__)
+        timings.append(time.perf_counter() - start)
+    tripped = pool.breaker.failures
+    print(f"driver: connect to a silent server via the proxy gave up after "
+          f"{max(timings[:tripped]):.1f}s (connect timeout {connect_timeout}s); after {tripped} failures "
+          f"the breaker refused at once ({max(timings[tripped:]) * 1e6:.0f}us): {', '.join(sorted(set(errors)))}")
+    return max(timings[:tripped]) < connect_timeout + 1 and max(timings[tripped:]) < 0.01
+
+
+class Client(loadtest.Client):
+    """A loadtest client whose requests wait for one of the worker's request threads"""
+
+    def __init__(self, server, recorders, clock, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.server = server
+        self.recorders = recorders
+        self.clock = clock
+
+    def request(self, route, method, url, **kwargs):
+        phase = self.clock()
+        start = time.perf_counter()
+        response = self.server.submit(self.http.open, url, method=method, **kwargs).result()
+        self.recorders[phase].add(route, response.status_code, time.perf_counter() - start)
+        if route == "POST /vote" and response.status_code == 503:
+            assert response.headers.get("Retry-After"), "503 without Retry-After"
+        return response
+
+
+def run_scenario(args):
+    path = os.path.join(tempfile.mkdtemp(prefix="db-faults-"), "vote.db")
+    os.environ.update(STORAGE_BACKEND="mysql", SECRET_KEY="bench", RATE_LIMIT="0", SHED_MAX_INFLIGHT="1000000",
+                      PAGE_CACHE="1", BREAKER_OPEN_SECONDS=str(args.open_seconds))
+    if args.guards == "off":
+        os.environ.update(REQUEST_DEADLINE_SECONDS="0", DB_QUERY_TIMEOUT="0", DB_CONNECT_TIMEOUT="0",
+                          BREAKER_FAILURES="1000000000")
+    else:
+        os.environ.update(REQUEST_DEADLINE_SECONDS=str(args.deadline), DB_QUERY_TIMEOUT=str(args.query_timeout),
+                          DB_CONNECT_TIMEOUT=str(args.query_timeout))
+
+    ok = True
+    if not args.upstream and args.guards == "on":
+        # Before the stand-in replaces mysql.connector.connect
+        ok &= check_driver_timeouts(args.query_timeout)
+
+    proxy = None
+    if args.upstream:
+        host, port = args.upstream.rsplit(":", 1)
+        proxy = StallProxy((host, int(port)))
+        os.environ.update(DB_HOST="127.0.0.1", DB_PORT=str(proxy.port))
+        stall, resume = proxy.stall, proxy.resume
+    else:
+        standin.install(path)
+        os.environ["DB_HOST"] = "primary"
+        stall, resume = (lambda: standin.set_stalled("primary")), (lambda: standin.set_stalled("primary", False))
+
+    import app as app_module
+    import catalog
+    import storage
+    import token_verify
+
+    issuer = token_verify.LocalIssuer(loadtest.PROJECT_ID)
+    token_verify.configure(loadtest.PROJECT_ID, key_source=issuer.key_source()).keys.refresh()
+    tokens = loadtest.seed(app_module, args.csv)
+    snapshot = catalog.refresh()
+
+    recorders = {phase: loadtest.Recorder() for phase in PHASES}
+    started = time.monotonic()
+    stall_at, resume_at = args.healthy, args.healthy + args.stall
+    end_at = resume_at + args.recovery
+
+    def clock():
+        elapsed = time.monotonic() - started
+        return PHASES[(elapsed >= stall_at) + (elapsed >= resume_at)]
+
+    def control():
+        time.sleep(stall_at)
+        stall()
+        time.sleep(args.stall)
+        resume()
+
+    server = ThreadPoolExecutor(args.threads)
+    clients = []
+    for i in range(args.clients):
+        client = Client(server, recorders, clock, app_module.app, issuer, snapshot, tokens, None, f"fault-user-{i}")
+        client.login()
+        clients.append(client)
+    threading.Thread(target=control, daemon=True).start()
+    actions, weights = [a for _, a in MIX], [w for w, _ in MIX]
+
+    def drive(client):
+        while time.monotonic() - started < end_at:
+            (action,) = client.random.choices(actions, weights)
+            getattr(client, action)()
+
+    with ThreadPoolExecutor(len(clients)) as pool:
+        list(pool.map(drive, clients))
+    server.shutdown()
+
+    print(f"guards {args.guards}: {args.threads} request threads, {args.clients} clients, "
+          f"database stalled from {stall_at:g}s to {resume_at:g}s")
+    for phase in PHASES:
+        print(f"-- {phase}")
+        routes = recorders[phase].summary(end_at)
+        loadtest.print_table(routes, end_at)
+    stats = storage.get_backend().get_pool().stats()
+    print(f"pool afterwards: {stats['in_use']} checked out, {stats['broken']} discarded as broken, "
+          f"breaker {stats['breaker']}")
+
+    ok &= stats["in_use"] == 0
+    if args.guards == "on":
+        stalled = recorders["stalled"].summary(end_at)
+        recovered = recorders["recovered"].summary(end_at)
+        # Pages that need no database stay fast while it is stalled
+        ok &= stalled["GET /"]["p95_ms"] < 1000 and stalled["GET /candidates"]["p95_ms"] < 1000
+        # Ballots fail fast instead of piling up
+        ok &= stalled["POST /vote"]["5xx"] > 0 and stalled["POST /vote"]["p50_ms"] < 100
+        ok &= recovered["POST /vote"]["5xx"] < recovered["POST /vote"]["count"]
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guards", choices=("on", "off", "both"), default="both")
+    parser.add_argument("--upstream", help="host:port of a scratch MySQL server to put the proxy in front of")
+    parser.add_argument("--threads", type=int, default=8, help="request threads (GUNICORN_THREADS)")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--healthy", type=float, default=2, help="seconds before the stall")
+    parser.add_argument("--stall", type=float, default=8, help="seconds the database is stalled")
+    parser.add_argument("--recovery", type=float, default=6, help="seconds after the stall")
+    parser.add_argument("--deadline", type=float, default=3, help="REQUEST_DEADLINE_SECONDS")
+    parser.add_argument("--query-timeout", type=int, default=2, help="DB_QUERY_TIMEOUT and DB_CONNECT_TIMEOUT")
+    parser.add_argument("--open-seconds", type=float, default=2, help="BREAKER_OPEN_SECONDS")
+    parser.add_argument("--csv", default="Token350.csv")
+    args = parser.parse_args()
+
+    if args.guards != "both":
+        raise SystemExit(0 if run_scenario(args) else 1)
+    # One process per run: the pool, breaker and stand-in are per process
+    failed = False
+    for guards in ("off", "on"):
+        argv = [a for a in sys.argv[1:] if not a.startswith("--guards")]
+        failed |= subprocess.call([sys.executable, "-m", "bench.db_faults", "--guards", guards, *argv]) != 0
+        print()
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
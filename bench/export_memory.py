@@ -0,0 +1,94 @@
+"""Memory and throughput of the audit export (export.py) on a large `votes` table.
+
+Fills a scratch SQLite database (STORAGE_BACKEND=sqlite) with `--rows`
+votes, then exports them as CSV two ways and reports the peak Python
+memory (tracemalloc) and rows per second of each:
+
+    fetchall    one SELECT, fetchall(), then write: how a route in this
+                app would have done it
+    streaming   export.export(): keyset pages through unbuffered cursors
+
+The streaming peak should stay flat as `--rows` grows.
+
+    python -m bench.export_memory --rows 1000000
+"""
+import argparse
+import csv
+import io
+import os
+import tempfile
+import time
+import tracemalloc
+
+
+def seed(rows):
+    import storage
+    with storage.connection() as conn:
+        cursor = conn.cursor()
+        batch = []
+        for n in range(rows):
+            batch.append((f"export-{n // 2}", ("king", "queen")[n % 2], n % 16 + 1))
+            if len(batch) == 10000:
+                cursor.executemany("INSERT INTO votes (user_uid, candidate_type, candidate_id) VALUES (%s, %s, %s)", batch)
+                batch = []
+        if batch:
+            cursor.executemany("INSERT INTO votes (user_uid, candidate_type, candidate_id) VALUES (%s, %s, %s)", batch)
+        cursor.close()
+
+
+def fetchall_export(sink):
+    import export
+    import storage
+    with storage.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {', '.join(export.COLUMNS['votes'])} FROM votes ORDER BY id")
+        rows = cursor.fetchall()
+        cursor.close()
+    writer = csv.writer(sink, lineterminator="\n")
+    writer.writerow(export.COLUMNS["votes"])
+    writer.writerows(rows)
+    return len(rows)
+
+
+def streaming_export(sink):
+    import export
+    lines = 0
+    for chunk in export.export("votes", "csv"):
+        sink.write(chunk)
+        lines += chunk.count("\n")
+    return lines - 1
+
+
+class NullSink(io.TextIOBase):
+    """Discards what is written, as a socket would once it is sent"""
+
+    def write(self, text):
+        return len(text)
+
+
+def measure(name, run):
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = run(NullSink())
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:>10}: {count} rows in {elapsed:.2f}s ({count / elapsed:,.0f} rows/s), peak {peak / 2**20:.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=300000)
+    args = parser.parse_args()
+
+    os.environ.update(STORAGE_BACKEND="sqlite", SQLITE_PATH=os.path.join(tempfile.mkdtemp(prefix="export-"), "vote.db"))
+    import migrations
+    migrations.migrate()
+    seed(args.rows)
+
+    measure("fetchall", fetchall_export)
+    measure("streaming", streaming_export)
+
+
+if __name__ == "__main__":
+    main()
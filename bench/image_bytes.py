@@ -0,0 +1,132 @@
+"""Image bytes per page before and after the derivative pipeline.
+
+Renders each page, collects its <img> tags and works out which file a
+phone (390 CSS px wide, 2x pixel density) would download: the original
+before, and the srcset/Accept-negotiated variant after. Run
+`python build_images.py` first.
+
+    python -m bench.image_bytes
+"""
+import argparse
+import re
+import time
+from urllib.parse import unquote, urlsplit
+
+import assets
+import catalog
+import images
+from app import app
+
+PAGES = ["/", "/candidates", "/lantern", "/about", "/final", "/winner", "/login", "/mote_phoe"]
+
+IMG_TAG = re.compile(r"<img\b[^>]*>", re.S)
+ATTR = re.compile(r'([a-zA-Z-]+)="([^"]*)"')
+SIZE = re.compile(r"(?:\(min-width:\s*(\d+)px\)\s*)?(\d+(?:\.\d+)?)(vw|px)")
+
+
+class Accept:
+    """Minimal stand-in for request.accept_mimetypes"""
+
+    def __init__(self, *mimetypes):
+        self.mimetypes = mimetypes
+
+    def __getitem__(self, mimetype):
+        return 1 if mimetype in self.mimetypes else 0
+
+
+def slot_width(sizes, viewport):
+    for candidate in sizes.split(","):
+        match = SIZE.search(candidate.strip())
+        if not match:
+            continue
+        min_width, value, unit = match.groups()
+        if min_width and viewport < int(min_width):
+            continue
+        return float(value) * viewport / 100 if unit == "vw" else float(value)
+    return viewport
+
+
+def chosen_width(attrs, viewport, dpr):
+    """The srcset width a browser would pick, or None without srcset"""
+    if "srcset" not in attrs:
+        return None
+    widths = sorted(int(part.split()[-1][:-1]) for part in attrs["srcset"].split(", "))
+    need = slot_width(attrs.get("sizes", "100vw"), viewport) * dpr
+    return next((w for w in widths if w >= need), widths[-1])
+
+
+def page_images(html):
+    found = {}
+    for tag in IMG_TAG.findall(html):
+        attrs = dict(ATTR.findall(tag))
+        key = unquote(urlsplit(attrs.get("src", "")).path).lstrip("/")
+        if key.startswith("assets/"):
+            asset = assets.lookup(key[len("assets/"):])
+            key = asset.key if asset else key
+        if key in images.manifest():
+            found.setdefault(key, attrs)
+    return found
+
+
+def variant_bytes(entry, accept, width):
+    variant = images.pick_variant(entry, accept, width)
+    return entry["bytes"] if variant is None else variant["bytes"]
+
+
+def ensure_catalog():
+    """Use the database if it's reachable, otherwise build the catalog from the image folders"""
+    try:
+        catalog.refresh()
+        return "database"
+    except Exception:
+        lists = {}
+        for candidate_type, prefix in (("king", "Kings"), ("queen", "Queen"), ("lantern", "Lantern")):
+            keys = sorted(k for k in images.manifest() if k.startswith(prefix + "/"))
+            lists[candidate_type] = tuple(
+                catalog._record(candidate_type, {"id": i, "name": k.split("/")[-1].rsplit(".", 1)[0], "image_path": k})
+                for i, k in enumerate(keys, 1)
+            )
+        lists["final_king"] = lists["final_queen"] = ()
+        catalog._catalog._snapshot = catalog.Snapshot(lists, time.monotonic())
+        return "image folders"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--viewport", type=int, default=390)
+    parser.add_argument("--dpr", type=float, default=2.0)
+    args = parser.parse_args()
+
+    if not images.manifest():
+        raise SystemExit("No derivatives/manifest.json; run `python build_images.py` first")
+    print(f"Catalog from {ensure_catalog()}; client {args.viewport}px @ {args.dpr}x\n")
+
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s["user_id"] = "bench-user"
+
+    webp, avif = Accept("image/webp"), Accept("image/avif", "image/webp")
+    totals = [0, 0, 0]
+    print(f"{'page':<13}{'images':>7}{'original':>12}{'webp':>12}{'avif':>12}{'saved':>8}")
+    for path in PAGES:
+        html = client.get(path).get_data(as_text=True)
+        found = page_images(html)
+        before = after_webp = after_avif = 0
+        for key, attrs in found.items():
+            entry = images.manifest()[key]
+            width = chosen_width(attrs, args.viewport, args.dpr)
+            before += entry["bytes"]
+            after_webp += variant_bytes(entry, webp, width)
+            after_avif += variant_bytes(entry, avif, width)
+        for i, n in enumerate((before, after_webp, after_avif)):
+            totals[i] += n
+        saved = 100 * (1 - after_webp / before) if before else 0
+        print(f"{path:<13}{len(found):>7}{before / 1024:>10.0f}KB{after_webp / 1024:>10.0f}KB{after_avif / 1024:>10.0f}KB{saved:>7.0f}%")
+
+    before, after_webp, after_avif = totals
+    print(f"{'total':<13}{'':>7}{before / 1024:>10.0f}KB{after_webp / 1024:>10.0f}KB{after_avif / 1024:>10.0f}KB"
+          f"{100 * (1 - after_webp / before) if before else 0:>7.0f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Voting-opens burst: synchronous writes vs the queued ingest log (ingest.py).
+
+Every voter casts a king and a queen vote at once, through
+repository.cast_vote, against the SQLite stand-in for MySQL with a
+simulated round trip. For each VOTE_INGEST mode it reports the latency
+until the voter gets an answer and how long until every vote is in
+`votes`, then checks that each vote landed exactly once.
+
+Finally a child process with no committer appends ballots to a fresh
+log and dies; the parent then drains that log, as the next worker
+would, and checks that nothing was lost or written twice.
+
+    python -m bench.ingest_burst --voters 500 --clients 64 --rtt-ms 30
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench import standin
+from bench.loadtest import percentile
+
+CRASH_CHILD = """
+import os, sys
+import ingest
+log = ingest.IngestLog()
+for n in range(int(sys.argv[1])):
+    log.append("vote", f"crash-{n}", "king", int(sys.argv[2]))
+os._exit(0)
+"""
+
+
+def count_votes(prefix):
+    import storage
+    with storage.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM votes WHERE user_uid LIKE %s", (prefix + "%",))
+        rows = cursor.fetchone()[0]
+        cursor.execute(
+            "SELECT COUNT(*) FROM (SELECT DISTINCT user_uid, candidate_type FROM votes WHERE user_uid LIKE %s) d",
+            (prefix + "%",)
+        )
+        distinct = cursor.fetchone()[0]
+        cursor.close()
+    return rows, distinct
+
+
+def burst(mode, voters, clients, king_id, queen_id):
+    import ingest
+    import repository
+
+    os.environ["VOTE_INGEST"] = mode
+    ingest.start_background_commit()
+    prefix = f"burst-{mode}-"
+
+    def cast(ballot):
+        start = time.perf_counter()
+        outcome = repository.cast_vote(*ballot)
+        return outcome, time.perf_counter() - start
+
+    ballots = [(f"{prefix}{n}", kind, cid) for n in range(voters) for kind, cid in (("king", king_id), ("queen", queen_id))]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        results = list(pool.map(cast, ballots))
+    acked = time.perf_counter() - start
+    if ingest.enabled():
+        while ingest.stats()["pending"]:
+            time.sleep(0.01)
+    stored = time.perf_counter() - start
+
+    latencies = sorted(seconds for _, seconds in results)
+    outcomes = {}
+    for outcome, _ in results:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    rows, distinct = count_votes(prefix)
+    print(f"{mode:>7}: answer p50 {percentile(latencies, 0.5) * 1000:6.1f}ms  p95 {percentile(latencies, 0.95) * 1000:6.1f}ms  "
+          f"p99 {percentile(latencies, 0.99) * 1000:6.1f}ms | all answered {acked:5.2f}s, all stored {stored:5.2f}s")
+    print(f"         outcomes {outcomes}; rows {rows}, distinct {distinct} (want {len(ballots)})")
+    return rows == distinct == len(ballots)
+
+
+def crash_recovery(entries, king_id):
+    import ingest
+
+    path = os.path.join(tempfile.mkdtemp(prefix="ingest-crash-"), "ingest.db")
+    env = dict(os.environ, INGEST_PATH=path, INGEST_FLUSH_MS="60000")
+    subprocess.run([sys.executable, "-c", CRASH_CHILD, str(entries), str(king_id)], env=env, check=True)
+    log = ingest.IngestLog(path=path)
+    pending = log.stats()["pending"]
+    replayed = log.drain()
+    # A second pass must find nothing left to do
+    replayed_again = log.drain()
+    rows, distinct = count_votes("crash-")
+    print(f"  crash: {pending} entries left pending by the dead process, {replayed} replayed, "
+          f"{replayed_again} on a second pass; rows {rows}, distinct {distinct} (want {entries})")
+    return pending == replayed == entries and replayed_again == 0 and rows == distinct == entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--voters", type=int, default=500)
+    parser.add_argument("--clients", type=int, default=64, help="concurrent requests")
+    parser.add_argument("--rtt-ms", type=float, default=30, help="simulated database round trip per statement")
+    parser.add_argument("--crash-entries", type=int, default=200)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="ingest-burst-")
+    standin.install(os.path.join(workdir, "vote.db"))
+    os.environ.update(
+        STORAGE_BACKEND="mysql",
+        INGEST_PATH=os.path.join(workdir, "ingest.db"),
+        DB_POOL_SIZE=os.getenv("DB_POOL_SIZE", "10"),
+        DB_POOL_TIMEOUT="60",
+    )
+    import catalog
+    import migrations
+
+    migrations.migrate()
+    snapshot = catalog.refresh()
+    king_id, queen_id = snapshot.lists["king"][0].id, snapshot.lists["queen"][0].id
+    standin.install(os.path.join(workdir, "vote.db"), rtt_ms=args.rtt_ms)
+
+    print(f"{args.voters} voters x 2 votes, {args.clients} at a time, {args.rtt_ms:.0f}ms simulated round trip")
+    ok = all([burst(mode, args.voters, args.clients, king_id, queen_id) for mode in ("sync", "queued")])
+    ok = crash_recovery(args.crash_entries, king_id) and ok
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+"""Offline load test: the whole app against local stand-ins for MySQL and Firebase.
+
+By default the database is a scratch SQLite file behind bench/standin.py,
+which plays the remote MySQL server (with an optional simulated round
+trip, `--rtt-ms`). `--backend sqlite` runs the embedded SQLite backend
+(STORAGE_BACKEND=sqlite) instead, as a single-host event would. Sign-in
+tokens come from a `token_verify.LocalIssuer`, so nothing here touches
+Aiven or Firebase.
+The database is seeded the way production is: `init_database()` for the
+candidates and finalists, and Token350.csv loaded with upload.py's prize
+table.
+
+Each client is one signed-in user with their own session, making
+requests from a weighted mix of actions:
+
+    login     POST /auth bursts with fresh ID tokens
+    browse    /, /candidates, /viewmore, /lantern
+    vote      /vote and /vote_lantern storms (duplicates included)
+    final     /final_vote redemptions, with some mistyped tokens
+    results   /results and /api/results?since= polling
+    night     all of the above in voting-night proportions
+
+Latency (p50/p95/p99) and throughput are reported per route. Baselines
+are per machine: save one before a change and compare on the same box.
+
+    python -m bench.loadtest night --clients 32 --seconds 20 --rtt-ms 30
+    python -m bench.loadtest night --clients 32 --seconds 20 --backend sqlite
+    python -m bench.loadtest vote --clients 64 --rtt-ms 30 --ingest queued
+    python -m bench.loadtest night --save        # write bench/baselines/night.json
+    python -m bench.loadtest night --compare     # flag routes whose p95 got >20% worse
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench import standin
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+PROJECT_ID = "loadtest-project"
+# A p95 from fewer requests than this is too noisy to call a regression
+MIN_SAMPLES = 50
+
+# (weight, action) per scenario
+SCENARIOS = {
+    "login": [(1, "login")],
+    "browse": [(3, "home"), (3, "candidates"), (3, "viewmore"), (1, "lantern")],
+    "vote": [(4, "vote"), (1, "vote_lantern")],
+    "final": [(1, "final_vote")],
+    "results": [(1, "results_page"), (3, "api_results")],
+    "night": [
+        (1, "login"), (2, "home"), (4, "candidates"), (4, "viewmore"), (1, "lantern"),
+        (4, "vote"), (1, "vote_lantern"), (2, "final_vote"), (1, "results_page"), (3, "api_results"),
+    ],
+}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(int(len(sorted_values) * fraction + 0.5) - 1, 0))]
+
+
+class Recorder:
+    """Latencies and status counts per route, shared by all client threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.statuses = {}
+
+    def add(self, route, status, seconds):
+        with self._lock:
+            self.latencies.setdefault(route, []).append(seconds)
+            counts = self.statuses.setdefault(route, {})
+            counts[status // 100] = counts.get(status // 100, 0) + 1
+
+    def summary(self, elapsed):
+        routes = {}
+        for route, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            statuses = self.statuses[route]
+            routes[route] = {
+                "count": len(values),
+                "rps": len(values) / elapsed,
+                "p50_ms": percentile(values, 0.50) * 1000,
+                "p95_ms": percentile(values, 0.95) * 1000,
+                "p99_ms": percentile(values, 0.99) * 1000,
+                "4xx": statuses.get(4, 0),
+                "5xx": statuses.get(5, 0),
+            }
+        return routes
+
+
+def seed(app_module, csv_path):
+    """Candidates, finalists and final tokens, as on the event database"""
+    import storage
+    import upload
+
+    app_module.init_database()
+    tokens = list(upload.read_csv(csv_path))
+    tiers, rest = upload.parse_rewards(upload.DEFAULT_REWARDS)
+    rewards = upload.RewardPool(tiers, rest, len(tokens))
+    with storage.connection() as conn:
+        cursor = conn.cursor()
+        for batch in upload.batches(tokens, 1000):
+            upload.insert_batch(cursor, [(token, rewards.draw()) for token in batch])
+        cursor.close()
+    return tokens
+
+
+class Client:
+    """One signed-in user making requests through the Flask test client"""
+
+    def __init__(self, app, issuer, snapshot, tokens, recorder, uid):
+        self.http = app.test_client()
+        self.issuer = issuer
+        self.snapshot = snapshot
+        self.tokens = tokens
+        self.recorder = recorder
+        self.uid = uid
+        self.random = random.Random(uid)
+        # Each user from their own address, as far as the rate limiter can tell
+        self.http.environ_base["REMOTE_ADDR"] = "10." + ".".join(str(self.random.randrange(1, 255)) for _ in range(3))
+        self.results_version = None
+
+    def request(self, route, method, url, **kwargs):
+        start = time.perf_counter()
+        response = self.http.open(url, method=method, **kwargs)
+        elapsed = time.perf_counter() - start
+        self.recorder.add(route, response.status_code, elapsed)
+        return response
+
+    def pick(self, candidate_type):
+        return self.random.choice(self.snapshot.lists[candidate_type])
+
+    # Actions
+
+    def login(self):
+        self.request("POST /auth", "POST", "/auth", json={"idToken": self.issuer.mint(self.uid, email=f"{self.uid}@example.com")})
+
+    def home(self):
+        self.request("GET /", "GET", "/")
+
+    def candidates(self):
+        self.request("GET /candidates", "GET", "/candidates")
+
+    def viewmore(self):
+        candidate = self.pick(self.random.choice(("king", "queen")))
+        self.request("GET /viewmore", "GET", "/viewmore", query_string={"id": candidate.slug})
+
+    def lantern(self):
+        self.request("GET /lantern", "GET", "/lantern")
+
+    def vote(self):
+        candidate_type = self.random.choice(("king", "queen"))
+        candidate = self.pick(candidate_type)
+        self.request("POST /vote", "POST", "/vote", data={"candidate_id": candidate.id, "candidate_type": candidate_type})
+
+    def vote_lantern(self):
+        lantern = self.pick("lantern")
+        self.request("POST /vote_lantern", "POST", "/vote_lantern", json={"lantern_id": lantern.id, "token": "lantern"})
+
+    def final_vote(self):
+        token = self.random.choice(self.tokens)
+        if self.random.random() < 0.1:
+            # Misread from the printed sheet
+            token = token[:-1] + self.random.choice("ABCDEFGHJKMNPQRSTUVWXYZ23456789")
+        category = self.random.choice(("king", "queen", "lantern", "reward"))
+        source = {"king": "final_king", "queen": "final_queen", "lantern": "lantern"}.get(category)
+        candidate_id = self.pick(source).id if source else None
+        self.request("POST /final_vote", "POST", "/final_vote",
+                     json={"token": token, "category": category, "candidate_id": candidate_id})
+
+    def results_page(self):
+        self.request("GET /results", "GET", "/results")
+
+    def api_results(self):
+        query = {} if self.results_version is None else {"since": self.results_version}
+        response = self.request("GET /api/results", "GET", "/api/results", query_string=query)
+        if response.status_code == 200:
+            self.results_version = response.get_json().get("version", self.results_version)
+
+
+def run(clients, mix, seconds):
+    actions = [action for _, action in mix]
+    weights = [weight for weight, _ in mix]
+    deadline = time.monotonic() + seconds
+
+    def drive(client):
+        while time.monotonic() < deadline:
+            (action,) = client.random.choices(actions, weights)
+            getattr(client, action)()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(len(clients)) as pool:
+        list(pool.map(drive, clients))
+    return time.perf_counter() - start
+
+
+def print_table(routes, elapsed, baseline=None, tolerance=0.2):
+    """Print per-route results; returns the routes whose p95 regressed"""
+    header = f"{'route':<20}{'count':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'4xx':>7}{'5xx':>6}"
+    if baseline:
+        header += f"{'p95 vs base':>14}"
+    print(header)
+    regressed = []
+    for route, r in routes.items():
+        line = (f"{route:<20}{r['count']:>8}{r['rps']:>9.1f}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}"
+                f"{r['p99_ms']:>9.1f}{r['4xx']:>7}{r['5xx']:>6}")
+        before = (baseline or {}).get(route)
+        if before and before["p95_ms"]:
+            change = r["p95_ms"] / before["p95_ms"] - 1
+            enough = min(r["count"], before["count"]) >= MIN_SAMPLES
+            flag = "  REGRESSED" if change > tolerance and enough else ""
+            line += f"{change:>+13.0%}{flag}"
+            if flag:
+                regressed.append(route)
+        print(line)
+    total = sum(r["count"] for r in routes.values())
+    print(f"{'total':<20}{total:>8}{total / elapsed:>9.1f}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("scenario", nargs="?", default="night", choices=sorted(SCENARIOS))
+    parser.add_argument("--clients", type=int, default=32, help="concurrent signed-in users")
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--backend", choices=("mysql", "sqlite"), default="mysql",
+                        help="mysql: the MySQL code path on the stand-in; sqlite: the embedded backend")
+    parser.add_argument("--rtt-ms", type=float, default=float(os.getenv("BENCH_DB_RTT_MS", 0)),
+                        help="simulated database round trip per statement (mysql only)")
+    parser.add_argument("--ingest", choices=("sync", "queued"), default="sync",
+                        help="VOTE_INGEST mode for /vote and /vote_lantern (see ingest.py)")
+    parser.add_argument("--limits", action="store_true",
+                        help="apply ratelimit.py's per-client budgets and in-flight cap (off by default: "
+                             "virtual users act far faster than people)")
+    parser.add_argument("--csv", default="Token350.csv")
+    parser.add_argument("--db", help="SQLite file to use (default: a new temporary file)")
+    parser.add_argument("--no-background", action="store_true", help="don't start the tally fold / token index threads")
+    parser.add_argument("--save", action="store_true", help="write the results as the scenario's baseline")
+    parser.add_argument("--compare", action="store_true", help="compare against the saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="p95 slowdown that counts as a regression")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix="loadtest-"), "vote.db")
+    if args.backend == "sqlite":
+        os.environ.update(STORAGE_BACKEND="sqlite", SQLITE_PATH=path)
+        args.rtt_ms = 0.0
+    else:
+        os.environ["STORAGE_BACKEND"] = "mysql"
+        standin.install(path)
+
+    os.environ.update(VOTE_INGEST=args.ingest, INGEST_PATH=os.path.join(os.path.dirname(path), "ingest.db"))
+
+    if not args.limits:
+        os.environ.update(RATE_LIMIT="0", SHED_MAX_INFLIGHT="1000000")
+
+    # Only now import the app, so every connection it opens is a stand-in one
+    os.environ.setdefault("SECRET_KEY", "loadtest")
+    import app as app_module
+    import catalog
+    import ingest
+    import tally
+    import token_index
+    import token_verify
+
+    issuer = token_verify.LocalIssuer(PROJECT_ID)
+    verifier = token_verify.configure(PROJECT_ID, key_source=issuer.key_source())
+    verifier.keys.refresh()
+
+    tokens = seed(app_module, args.csv)
+    catalog.refresh()
+    snapshot = catalog.get()
+    if not args.no_background:
+        tally.start_background_fold()
+        token_index.start_background_sync()
+        ingest.start_background_commit()
+
+    # The round trip applies to the run, not to seeding
+    if args.backend == "mysql":
+        standin.install(path, rtt_ms=args.rtt_ms)
+
+    recorder = Recorder()
+    clients = [
+        Client(app_module.app, issuer, snapshot, tokens, recorder, f"load-user-{n}")
+        for n in range(args.clients)
+    ]
+    # Everyone signs in first; the login scenario keeps doing it
+    for client in clients:
+        client.login()
+    recorder = Recorder()
+    for client in clients:
+        client.recorder = recorder
+
+    print(f"{args.scenario} on {args.backend} ({args.ingest} ingest): {args.clients} clients for {args.seconds:.0f}s, "
+          f"{args.rtt_ms:.0f}ms simulated DB round trip, {len(tokens)} final tokens ({path})")
+    elapsed = run(clients, SCENARIOS[args.scenario], args.seconds)
+    routes = recorder.summary(elapsed)
+    if ingest.enabled():
+        start = time.perf_counter()
+        drained = ingest.drain()
+        print(f"Ingest log: {ingest.stats()}; {drained} left to drain after the run "
+              f"({(time.perf_counter() - start) * 1000:.0f}ms)")
+
+    settings = {"backend": args.backend, "clients": args.clients, "rtt_ms": args.rtt_ms}
+    if args.ingest != "sync":
+        settings["ingest"] = args.ingest
+    baseline_path = os.path.join(BASELINE_DIR, f"{args.scenario}.json")
+    baseline = None
+    if args.compare:
+        if not os.path.exists(baseline_path):
+            raise SystemExit(f"No baseline at {baseline_path}; run with --save first")
+        with open(baseline_path, encoding="utf-8") as file:
+            saved = json.load(file)
+        if saved["settings"] != settings:
+            print(f"Note: baseline was recorded with {saved['settings']}")
+        baseline = saved["routes"]
+
+    regressed = print_table(routes, elapsed, baseline, args.tolerance)
+
+    if args.save:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(baseline_path, "w", encoding="utf-8") as file:
+            json.dump({
+                "settings": settings,
+                "seconds": args.seconds,
+                "machine": f"{platform.node()} ({os.cpu_count()} CPU, Python {platform.python_version()})",
+                "recorded_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "routes": routes,
+            }, file, indent=2)
+        print(f"Baseline saved to {baseline_path}")
+
+    if regressed:
+        print(f"p95 regressed by more than {args.tolerance:.0%}: {', '.join(regressed)}")
+    raise SystemExit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
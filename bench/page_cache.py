@@ -0,0 +1,54 @@
+"""Requests per second for the cached static pages, cache off vs on.
+
+Runs in-process through Flask's test client, so it measures the app's own
+work (template rendering vs. a cache hit) without network noise. No
+database is needed for these routes.
+
+    python -m bench.page_cache --requests 2000
+"""
+import argparse
+import time
+
+from app import app, page_cache
+
+ROUTES = ["/", "/about", "/final", "/winner", "/mote_phoe", "/login"]
+
+
+def run(client, path, requests, headers):
+    client.get(path, headers=headers)  # first render / warm-up
+    start = time.perf_counter()
+    for _ in range(requests):
+        client.get(path, headers=headers)
+    return requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s["user_id"] = "bench-user"
+        s["user_name"] = "Bench User"
+        s["user_email"] = "bench@example.com"
+
+    gzip_headers = {"Accept-Encoding": "gzip"}
+    print(f"{'route':<12}{'uncached':>12}{'cached':>12}{'304':>12}{'speedup':>10}{'bytes':>18}")
+    for path in ROUTES:
+        page_cache.enabled = False
+        before = run(client, path, args.requests, gzip_headers)
+        plain_size = len(client.get(path, headers=gzip_headers).data)
+
+        page_cache.enabled = True
+        page_cache.clear()
+        after = run(client, path, args.requests, gzip_headers)
+        cached = client.get(path, headers=gzip_headers)
+        etag = cached.headers["ETag"]
+        revalidate = run(client, path, args.requests, dict(gzip_headers, **{"If-None-Match": etag}))
+
+        print(f"{path:<12}{before:>10.0f}/s{after:>10.0f}/s{revalidate:>10.0f}/s{after / before:>9.1f}x{plain_size:>9} -> {len(cached.data):<7}")
+
+
+if __name__ == "__main__":
+    main()
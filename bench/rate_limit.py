@@ -0,0 +1,66 @@
+"""Cross-worker rate limiting (ratelimit.py): do workers share one budget?
+
+Starts `--workers` processes that all draw from the same bucket file as
+fast as they can for `--seconds`, as gunicorn workers behind one scripted
+guesser would. With a budget of `--capacity` and a refill of `--rate` per
+second, the grants across all of them should add up to about capacity +
+rate x seconds, not that times the number of workers. Also reports the
+cost of one check.
+
+    python -m bench.rate_limit --workers 4 --seconds 3
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+
+def hammer(path, capacity, rate, seconds, results):
+    import ratelimit
+    store = ratelimit.BucketStore(path)
+    granted = checks = 0
+    deadline = time.time() + seconds
+    start = time.perf_counter()
+    try:
+        while time.time() < deadline:
+            granted += store.take("final_vote:u:guesser", capacity, rate) == 0
+            checks += 1
+    finally:
+        results.put((granted, checks, time.perf_counter() - start))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--capacity", type=float, default=8)
+    parser.add_argument("--rate", type=float, default=2, help="tokens refilled per second")
+    args = parser.parse_args()
+
+    import ratelimit
+    path = os.path.join(tempfile.mkdtemp(prefix="ratelimit-"), "buckets.db")
+    # Create the file up front, as the first request under gunicorn would
+    ratelimit.BucketStore(path).take("warm-up", 1, 1)
+    results = multiprocessing.Queue()
+    procs = [
+        multiprocessing.Process(target=hammer, args=(path, args.capacity, args.rate, args.seconds, results))
+        for _ in range(args.workers)
+    ]
+    for proc in procs:
+        proc.start()
+    outcomes = [results.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+
+    granted = sum(g for g, _, _ in outcomes)
+    checks = sum(c for _, c, _ in outcomes)
+    per_check = sum(t for _, _, t in outcomes) / checks
+    allowed = args.capacity + args.rate * args.seconds
+    print(f"{args.workers} workers, {checks} checks ({per_check * 1e6:.0f}us each): "
+          f"{granted} granted, budget allows about {allowed:.0f}")
+    raise SystemExit(0 if granted <= allowed + 1 else 1)
+
+
+if __name__ == "__main__":
+    main()
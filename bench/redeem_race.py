@@ -0,0 +1,174 @@
+"""Parallel redemption check for ballot.redeem_final.
+
+Creates scratch tokens, then has many users try to spend each token on
+each final-round category at the same time. For every (token, category)
+exactly one attempt may succeed and exactly one `final_votes` row may land.
+The old read-check-write flow from `/final_vote` is run the same way for
+comparison, and database calls are counted for round trips per redemption.
+
+Point the DB_* variables at a scratch database before running: tokens are
+named `rr-...` and they and their ballots are deleted at the end.
+`--standin` runs against a fresh SQLite file behind bench/standin.py
+instead.
+
+    python -m bench.redeem_race --tokens 20 --attempts 50 --connections 16
+    python -m bench.redeem_race --standin --rtt-ms 5
+"""
+import argparse
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+import ballot
+import db_pool
+from bench.ballot_race import CountingConnection, add_arguments, use_standin
+
+
+def legacy_redeem(conn, token, category, candidate_id, user_uid):
+    """The pre-CAS /final_vote flow: read the row, check in Python, then write"""
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("SELECT * FROM final_tokens WHERE token = %s", (token,))
+    row = cursor.fetchone()
+    if not row:
+        cursor.close()
+        return ballot.INVALID_TOKEN
+    if row[f"used_for_{category}"]:
+        cursor.close()
+        return ballot.DUPLICATE
+    conn.start_transaction()
+    table = ballot.FINAL_CANDIDATE_TABLES.get(category)
+    if table:
+        cursor.execute(f"SELECT id FROM {table} WHERE id = %s", (candidate_id,))
+        if not cursor.fetchone():
+            conn.rollback()
+            cursor.close()
+            return ballot.UNKNOWN_CANDIDATE
+    cursor.execute(
+        "INSERT INTO final_votes (token, category, candidate_id) VALUES (%s, %s, %s)",
+        (token, category, candidate_id if table else None)
+    )
+    if table:
+        cursor.execute(
+            f"UPDATE final_tokens SET used_for_{category} = 1, candidate_{category} = %s, "
+            f"used_by_{category} = %s, used_at_{category} = NOW() WHERE token = %s",
+            (candidate_id, user_uid, token)
+        )
+    else:
+        cursor.execute(
+            "UPDATE final_tokens SET used_for_reward = 1, used_by_reward = %s, used_at_reward = NOW() WHERE token = %s",
+            (user_uid, token)
+        )
+    conn.commit()
+    cursor.close()
+    return ballot.RECORDED
+
+
+def candidates(pool):
+    """One candidate id per final category that has any (reward needs none)"""
+    found = {"reward": None}
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        for category, table in ballot.FINAL_CANDIDATE_TABLES.items():
+            cursor.execute(f"SELECT MIN(id) FROM {table}")
+            candidate_id = cursor.fetchone()[0]
+            if candidate_id is not None:
+                found[category] = candidate_id
+        cursor.close()
+    return found
+
+
+def create_tokens(pool, tokens):
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany("INSERT INTO final_tokens (token, reward_value) VALUES (%s, 'bench')", [(t,) for t in tokens])
+        cursor.close()
+
+
+def landed(pool, prefix):
+    """{(token, category): final_votes rows}"""
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT token, category, COUNT(*) FROM final_votes WHERE token LIKE %s GROUP BY token, category",
+            (prefix + "%",)
+        )
+        rows = {(token, category): n for token, category, n in cursor.fetchall()}
+        cursor.close()
+    return rows
+
+
+def cleanup(pool, prefix):
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM final_votes WHERE token LIKE %s", (prefix + "%",))
+        cursor.execute("DELETE FROM final_tokens WHERE token LIKE %s", (prefix + "%",))
+        cursor.close()
+
+
+def storm(pool, flow, jobs, workers):
+    counter = []
+    wins = {}
+
+    def one(job):
+        token, category, candidate_id, user_uid = job
+        with pool.connection() as conn:
+            outcome = flow(CountingConnection(conn, counter), token, category, candidate_id, user_uid)
+        return (token, category), outcome
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for key, outcome in executor.map(one, jobs):
+            wins.setdefault(key, 0)
+            if outcome == ballot.RECORDED:
+                wins[key] += 1
+    return wins, len(counter), time.perf_counter() - start
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=20)
+    parser.add_argument("--attempts", type=int, default=50, help="parallel redemptions per token and category")
+    add_arguments(parser)
+    args = parser.parse_args()
+    if args.standin:
+        use_standin(args.rtt_ms)
+
+    pool = db_pool.ConnectionPool(size=args.connections, timeout=60, **db_pool.connect_kwargs())
+    pool.warm()
+    categories = candidates(pool)
+
+    failed = False
+    for name, flow in (("legacy", legacy_redeem), ("cas", ballot.redeem_final)):
+        prefix = f"rr-{name}-{uuid.uuid4().hex[:8]}-"
+        tokens = [f"{prefix}{i}" for i in range(args.tokens)]
+        jobs = [
+            (token, category, candidate_id, f"{prefix}user-{n}")
+            for n in range(args.attempts)
+            for token in tokens
+            for category, candidate_id in categories.items()
+        ]
+        try:
+            create_tokens(pool, tokens)
+            wins, trips, elapsed = storm(pool, flow, jobs, args.connections)
+            rows = landed(pool, prefix)
+        finally:
+            cleanup(pool, prefix)
+
+        one_win = all(n == 1 for n in wins.values())
+        one_row = all(rows.get(key) == 1 for key in wins)
+        print(f"{name:>7}: {len(jobs)} redemptions over {len(wins)} (token, category) pairs in {elapsed:.2f}s, "
+              f"{trips / len(jobs):.2f} round trips/redemption")
+        print(f"         one success each: {one_win}; one ballot row each: {one_row}; "
+              f"max successes for a pair: {max(wins.values())}")
+        if name == "cas" and not (one_win and one_row):
+            failed = True
+
+    pool.close()
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Read/write splitting (replicas.py) against a primary and two replicas.
+
+Three SQLite files play the primary and two read replicas behind the
+MySQL stand-in (bench/standin.py). A copier thread per replica plays
+replication, copying the primary over it every `--lag` seconds. The run
+checks:
+
+    routing        with both replicas current, tally reads split across
+                   both of them and none go to the primary
+    read-your-own  right after a vote, with replication paused, the
+                   voter's /api/results read goes to the primary and
+                   counts the vote
+    failover       with replica-2 no longer replicating (so it falls
+                   behind) and replica-1 down, reads go to the primary
+    recovery       once replica-1 is back, reads go there again
+
+    python -m bench.replicas --lag 2 --max-lag 3
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from bench import standin
+
+
+def copy(src_path, dst_path):
+    src, dst = sqlite3.connect(src_path), sqlite3.connect(dst_path)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+
+
+class Copier:
+    """Replication to one replica: a copy of the primary every `every` seconds"""
+
+    def __init__(self, primary, replica, every):
+        self.primary, self.replica, self.every = primary, replica, every
+        self._stop = None
+        self._thread = None
+
+    def start(self):
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._stop,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self, stop):
+        while not stop.wait(self.every):
+            copy(self.primary, self.replica)
+
+
+def counts(replica_set):
+    """Read routing counters: totals by outcome, plus reads per replica"""
+    return {**replica_set.stats_counts, **{r.name: r.reads for r in replica_set.replicas}}
+
+
+def diff(before, after):
+    return {key: after[key] - before[key] for key in before}
+
+
+def reads(replica_set, n):
+    import repository
+    before = counts(replica_set)
+    for _ in range(n):
+        repository.tally()
+    return diff(before, counts(replica_set))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lag", type=float, default=2, help="seconds between copies to replica-1")
+    parser.add_argument("--max-lag", type=float, default=3, help="REPLICA_MAX_LAG")
+    parser.add_argument("--reads", type=int, default=200)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="replicas-")
+    primary, replica_1, replica_2 = (os.path.join(workdir, f"{name}.db") for name in ("primary", "replica-1", "replica-2"))
+    standin.install(primary, hosts={"replica-1": replica_1, "replica-2": replica_2})
+    os.environ.update(
+        STORAGE_BACKEND="mysql", DB_HOST="primary", DB_REPLICAS="replica-1,mysql://replica-2:3307",
+        REPLICA_MAX_LAG=str(args.max_lag), REPLICA_CHECK_SECONDS="0.2",
+        SECRET_KEY="bench", RATE_LIMIT="0", PAGE_CACHE="0",
+    )
+    import app as app_module
+    import catalog
+    import migrations
+    import replicas
+
+    migrations.migrate()
+    copy(primary, replica_1)
+    copy(primary, replica_2)
+    snapshot = catalog.refresh()
+    king = snapshot.lists["king"][0]
+
+    replica_set = replicas.get()
+    replica_set.start_background_check()
+    first, second = (r.name for r in replica_set.replicas)
+    copiers = [Copier(primary, replica_1, args.lag), Copier(primary, replica_2, args.lag)]
+    for copier in copiers:
+        copier.start()
+    time.sleep(args.max_lag + 1)
+
+    ok = True
+    status = {name: s["lag"] for name, s in replica_set.stats()["replicas"].items()}
+    routed = reads(replica_set, args.reads)
+    print(f"routing: lag {status}; {args.reads} reads -> {routed}")
+    ok &= routed[first] > 0 and routed[second] > 0 and routed["primary"] == 0
+
+    # Vote, then read the results at once as the voter and as someone else.
+    # Replication is paused, so no replica can have the vote yet
+    for copier in copiers:
+        copier.stop()
+    voter, other = app_module.app.test_client(), app_module.app.test_client()
+    with voter.session_transaction() as session:
+        session["user_id"] = "bench-voter"
+    response = voter.post("/vote", data={"candidate_id": king.id, "candidate_type": "king"})
+    assert response.json["success"], response.json
+
+    def votes_for(client):
+        before = counts(replica_set)
+        entries = client.get("/api/results/king").json["entries"]
+        return next(e["votes"] for e in entries if e["id"] == king.id), diff(before, counts(replica_set))
+
+    seen_by_voter, voter_reads = votes_for(voter)
+    seen_by_other, _ = votes_for(other)
+    print(f"read-your-own: right after the vote the voter sees {seen_by_voter} (reads {voter_reads}), "
+          f"a visitor sees {seen_by_other}")
+    ok &= seen_by_voter == 1 and voter_reads["primary"] >= 1
+    ok &= voter_reads[first] == 0 and voter_reads[second] == 0
+
+    # Only replica-1 replicates from here on; once replica-2 has fallen
+    # behind, take replica-1 down too
+    copiers[0].start()
+    time.sleep(args.max_lag + 0.5)
+    standin.set_down("replica-1")
+    time.sleep(0.5)
+    routed = reads(replica_set, args.reads)
+    print(f"failover: replica-1 down, replica-2 stale; {args.reads} reads -> {routed}")
+    ok &= routed["replica"] == 0 and routed["primary"] == args.reads
+
+    standin.set_down("replica-1", False)
+    time.sleep(args.lag + 0.5)
+    routed = reads(replica_set, args.reads)
+    print(f"recovery: replica-1 back; {args.reads} reads -> {routed}")
+    ok &= routed[first] > 0 and routed[second] == 0
+    copiers[0].stop()
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Tally reads with viewers refreshing /results vs watching /results/stream.
+
+Phase one has every viewer reload `/results` every `--refresh` seconds.
+Phase two connects the same number of viewers to the live stream while a
+writer casts a ballot every second, and reports how long each change took
+to reach all of them. Both phases count `tally.counts()` calls, which is
+the database work behind the page.
+
+Needs a scratch database with some kings; ballots use `stream-` uids and
+are deleted at the end.
+
+    python -m bench.results_stream --viewers 200 --seconds 10
+"""
+import argparse
+import statistics
+import threading
+import time
+import uuid
+
+import ballot
+import catalog
+import results_stream
+import storage
+import tally
+from app import app
+
+_reads = [0]
+_counts = tally.counts
+
+
+def counting_counts(conn, source="votes"):
+    _reads[0] += 1
+    return _counts(conn, source)
+
+
+def refresh_phase(viewers, seconds, refresh):
+    _reads[0] = 0
+    deadline = time.monotonic() + seconds
+
+    def viewer(offset):
+        client = app.test_client()
+        time.sleep(offset)
+        while time.monotonic() < deadline:
+            client.get("/results")
+            time.sleep(refresh)
+
+    threads = [threading.Thread(target=viewer, args=(refresh * i / viewers,)) for i in range(viewers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return _reads[0]
+
+
+def stream_phase(viewers, seconds, candidate_id, prefix):
+    _reads[0] = 0
+    cast_at = {}
+    latencies = []
+    lock = threading.Lock()
+
+    def viewer():
+        # Every viewer gets a stream here; the per-worker cap is for real request threads
+        for event in results_stream.stream(max_seconds=seconds, limit=None):
+            if not event.startswith("event: delta"):
+                continue
+            # The writer stamps each vote; the event carrying its new count arrives later
+            now = time.monotonic()
+            version = int(event.split("id: ", 1)[1].split("\n", 1)[0])
+            with lock:
+                sent = cast_at.get(version)
+                if sent is not None:
+                    latencies.append(now - sent)
+
+    def writer():
+        n = 0
+        while n < seconds - 2:
+            time.sleep(1)
+            with storage.connection() as conn:
+                ballot.cast_vote(conn, f"{prefix}{n}", "king", candidate_id)
+            with lock:
+                cast_at[results_stream._broadcaster.version + 1] = time.monotonic()
+            n += 1
+
+    threads = [threading.Thread(target=viewer) for _ in range(viewers)]
+    threads.append(threading.Thread(target=writer))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return _reads[0], latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--viewers", type=int, default=200)
+    parser.add_argument("--seconds", type=int, default=10)
+    parser.add_argument("--refresh", type=float, default=5.0, help="seconds between reloads in phase one")
+    args = parser.parse_args()
+
+    kings = catalog.refresh().lists["king"]
+    if not kings:
+        raise SystemExit("No kings in the database")
+    tally.counts = counting_counts
+    prefix = f"stream-{uuid.uuid4().hex[:8]}-"
+
+    try:
+        refresh_reads = refresh_phase(args.viewers, args.seconds, args.refresh)
+        stream_reads, latencies = stream_phase(args.viewers, args.seconds, kings[0].id, prefix)
+    finally:
+        tally.counts = _counts
+        with storage.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM votes WHERE user_uid LIKE %s", (prefix + "%",))
+            cursor.close()
+
+    print(f"{args.viewers} viewers for {args.seconds}s")
+    print(f"{'reload every ' + str(args.refresh) + 's':<24}{refresh_reads:>8} tally reads ({refresh_reads / args.seconds:.1f}/s)")
+    print(f"{'live stream':<24}{stream_reads:>8} tally reads ({stream_reads / args.seconds:.1f}/s)")
+    if latencies:
+        latencies.sort()
+        p95 = latencies[int(len(latencies) * 0.95) - 1] if len(latencies) >= 20 else latencies[-1]
+        print(f"vote -> viewer latency: median {statistics.median(latencies) * 1000:.0f}ms, "
+              f"p95 {p95 * 1000:.0f}ms over {len(latencies)} deliveries")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""A local stand-in for the MySQL server, backed by SQLite.
+
+`connect()` returns an object with the parts of the mysql.connector
+connection API this app uses (cursors, dictionary cursors,
+start_transaction/commit/rollback, in_transaction, ping). The MySQL
+dialect in the app's statements is rewritten to SQLite on the fly:
+AUTO_INCREMENT, ENUM, INSERT IGNORE, ON DUPLICATE KEY UPDATE, NOW(),
+INTERVAL, FOR UPDATE and GET_LOCK/RELEASE_LOCK.
+
+Text columns compare case-insensitively, as with MySQL's default collation.
+Connections and cursors are the SQLite backend's (sqlite_adapter.py) with
+the translation and the faults below added, so SQLite errors map to
+mysql.connector's the same way there: a unique or primary key violation
+is an IntegrityError with errno 1062, and ballot.py behaves as it does
+against the real server.
+
+Every statement, commit and rollback can be delayed by `rtt_ms` to model
+the round trip to a remote database (Aiven is tens of ms away).
+
+    import bench.standin
+    bench.standin.install("/tmp/bench.db", rtt_ms=30)   # patches mysql.connector.connect
+
+`hosts` gives other DB hosts (read replicas) files of their own, and
+`set_down(host)` makes one refuse connections. `set_stalled(host)` makes
+one stop answering instead: connects and statements hang until their
+`connection_timeout` / `read_timeout` runs out (forever without one) and
+then fail the way mysql.connector does.
+"""
+import re
+import sqlite3
+import threading
+import time
+
+import mysql.connector
+from mysql.connector import errors as mysql_errors
+
+import sqlite_adapter
+
+_settings = {"path": None, "rtt_ms": 0.0, "hosts": {}, "down": set(), "stalled": set()}
+_init_lock = threading.Lock()
+
+
+def _translate_create(sql):
+    sql = re.sub(r"\bINT AUTO_INCREMENT PRIMARY KEY\b", "INTEGER PRIMARY KEY AUTOINCREMENT", sql, flags=re.I)
+    sql = re.sub(r"\bENUM\([^)]*\)", "TEXT", sql, flags=re.I)
+    sql = re.sub(r"\bVARCHAR\(\d+\)", "TEXT COLLATE NOCASE", sql, flags=re.I)
+    sql = re.sub(r"\bON UPDATE CURRENT_TIMESTAMP\b", "", sql, flags=re.I)
+    sql = re.sub(r"\bUNIQUE KEY \w+ \(", "UNIQUE (", sql, flags=re.I)
+    # Plain secondary indexes become separate CREATE INDEX statements
+    indexes = re.findall(r",\s*KEY (\w+) \(([^)]*)\)", sql, flags=re.I)
+    sql = re.sub(r",\s*KEY \w+ \([^)]*\)", "", sql, flags=re.I)
+    table = re.search(r"CREATE TABLE IF NOT EXISTS (\w+)", sql, flags=re.I).group(1)
+    return [sql] + [f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({cols})" for name, cols in indexes]
+
+
+def translate(sql):
+    """MySQL statement -> list of SQLite statements"""
+    stripped = sql.strip()
+    if re.match(r"CREATE TABLE", stripped, re.I):
+        return [s.replace("%s", "?") for s in _translate_create(stripped)]
+
+    if re.match(r"CREATE INDEX", stripped, re.I):
+        return [re.sub(r"^CREATE INDEX", "CREATE INDEX IF NOT EXISTS", stripped, flags=re.I)]
+
+    if re.match(r"SELECT (GET|RELEASE)_LOCK\(", stripped, re.I):
+        # One process at a time already holds SQLite's write lock
+        return ["SELECT 1"]
+    stripped = re.sub(r"\bINSERT IGNORE\b", "INSERT OR IGNORE", stripped, flags=re.I)
+    stripped = re.sub(r"\bFOR UPDATE( SKIP LOCKED| NOWAIT)?\b", "", stripped, flags=re.I)
+    stripped = re.sub(r"NOW\(\)\s*-\s*INTERVAL\s+%s\s+SECOND", "datetime('now', '-' || %s || ' seconds')", stripped, flags=re.I)
+    stripped = re.sub(r"\bNOW\(\)", "CURRENT_TIMESTAMP", stripped, flags=re.I)
+
+    dup = re.search(r"\bON DUPLICATE KEY UPDATE\b(.*)$", stripped, flags=re.I | re.S)
+    if dup:
+        assignments = dup.group(1).strip()
+        head = stripped[:dup.start()]
+        if re.fullmatch(r"(\w+) = \1", assignments):
+            stripped = head + "ON CONFLICT DO NOTHING"
+        else:
+            assignments = re.sub(r"VALUES\((\w+)\)", r"excluded.\1", assignments, flags=re.I)
+            stripped = head + "ON CONFLICT DO UPDATE SET " + assignments
+    return [stripped.replace("%s", "?")]
+
+
+def _sleep_rtt():
+    if _settings["rtt_ms"]:
+        time.sleep(_settings["rtt_ms"] / 1000)
+
+
+def _wait_while_stalled(host, timeout):
+    """Block while `host` is stalled; True if `timeout` ran out first"""
+    deadline = None if not timeout else time.monotonic() + timeout
+    while host in _settings["stalled"]:
+        if deadline is not None and time.monotonic() >= deadline:
+            return True
+        time.sleep(0.02)
+    return False
+
+
+class Cursor(sqlite_adapter.SQLiteCursor):
+    """storage's SQLite cursor, with MySQL statements translated and the server's faults applied"""
+
+    def _statements(self, sql):
+        return translate(sql)
+
+    def execute(self, sql, params=()):
+        _sleep_rtt()
+        self._conn._check_up()
+        self._conn._check_stalled()
+        super().execute(sql, params)
+
+    def executemany(self, sql, seq_params):
+        _sleep_rtt()
+        self._conn._check_up()
+        self._conn._check_stalled()
+        super().executemany(sql, seq_params)
+
+
+class Connection(sqlite_adapter.SQLiteConnection):
+    cursor_class = Cursor
+
+    def __init__(self, path, host=None, read_timeout=None):
+        super().__init__(path, busy_timeout_ms=30000)
+        self.host = host
+        self.read_timeout = read_timeout
+
+    def _check_up(self):
+        if self.closed:
+            raise mysql_errors.OperationalError(msg="MySQL Connection not available", errno=2055)
+        if self.host in _settings["down"]:
+            raise mysql_errors.OperationalError(msg="Lost connection to MySQL server during query", errno=2013)
+
+    def _check_stalled(self):
+        if _wait_while_stalled(self.host, self.read_timeout):
+            # As mysql.connector does after a read timeout
+            self.close()
+            raise mysql_errors.ReadTimeoutError(msg="The Read Operation timed out", errno=3024)
+
+    def start_transaction(self, **kwargs):
+        _sleep_rtt()
+        self._check_up()
+        self._check_stalled()
+        # BEGIN IMMEDIATE takes the write lock up front, like InnoDB row
+        # locks would, so two transactions never deadlock upgrading a read lock
+        super().start_transaction(**kwargs)
+
+    def commit(self):
+        _sleep_rtt()
+        self._check_up()
+        super().commit()
+
+    def rollback(self):
+        _sleep_rtt()
+        self._check_up()
+        super().rollback()
+
+    def ping(self, reconnect=False, **kwargs):
+        _sleep_rtt()
+        self._check_up()
+        self._check_stalled()
+
+    def is_connected(self):
+        return True
+
+
+def connect(**kwargs):
+    """Drop-in for mysql.connector.connect; only `host` and the timeouts are looked at"""
+    host = kwargs.get("host")
+    if host in _settings["down"]:
+        raise mysql_errors.OperationalError(msg=f"Can't connect to MySQL server on '{host}'", errno=2003)
+    if _wait_while_stalled(host, kwargs.get("connection_timeout")):
+        raise mysql_errors.OperationalError(
+            msg="Lost connection to MySQL server at 'waiting for initial communication packet'", errno=2013)
+    return Connection(_settings["hosts"].get(host, _settings["path"]), host, kwargs.get("read_timeout"))
+
+
+def install(path, rtt_ms=0.0, hosts=None):
+    """Send every mysql.connector.connect() in this process to the SQLite file.
+
+    `hosts` maps DB hosts to files of their own, e.g. read replicas.
+    """
+    _settings.update(path=path, rtt_ms=rtt_ms, hosts=dict(hosts or {}), down=set(), stalled=set())
+    with _init_lock:
+        for file in {path, *_settings["hosts"].values()}:
+            db = sqlite3.connect(file)
+            db.execute("PRAGMA journal_mode = WAL")
+            db.close()
+    mysql.connector.connect = connect
+
+
+def set_down(host, down=True):
+    """Make `host` refuse connections and fail queries (or work again)"""
+    (_settings["down"].add if down else _settings["down"].discard)(host)
+
+
+def set_stalled(host, stalled=True):
+    """Make `host` stop answering without closing anything (or answer again)"""
+    (_settings["stalled"].add if stalled else _settings["stalled"].discard)(host)
@@ -0,0 +1,129 @@
+"""Cold start costs: importing the app, the schema check, and gunicorn's first response.
+
+Everything runs against a scratch SQLite database (STORAGE_BACKEND=sqlite),
+so no MySQL server or Firebase project is needed.
+
+    import app        median wall time of `import app` in a fresh
+                      interpreter, and whether firebase_admin got imported
+    schema            creating every table and seeding the candidates the
+                      way init_database() used to on every boot, vs
+                      migrations.migrate() on a database that is current
+    gunicorn          seconds from launch to the first 200 from /candidates
+                      (catalog read included), with and without
+                      GUNICORN_PRELOAD
+
+    python -m bench.startup --runs 5 --workers 4
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from bench.concurrency import free_port
+
+IMPORT_PROBE = (
+    "import sys, time\n"
+    "start = time.perf_counter()\n"
+    "import app\n"
+    "print(time.perf_counter() - start, 'firebase_admin' in sys.modules)\n"
+)
+
+
+def bench_env(db_path, **extra):
+    return dict(
+        os.environ,
+        SECRET_KEY=os.getenv("SECRET_KEY", "bench"),
+        STORAGE_BACKEND="sqlite",
+        SQLITE_PATH=db_path,
+        **extra,
+    )
+
+
+def time_import(db_path, runs):
+    seconds, firebase = [], False
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_PROBE], env=bench_env(db_path),
+            capture_output=True, text=True, check=True,
+        ).stdout.split()
+        seconds.append(float(output[-2]))
+        firebase = firebase or output[-1] == "True"
+    return statistics.median(seconds), firebase
+
+
+def time_schema(db_path, runs):
+    import migrations
+    import storage
+
+    storage.use(storage.SQLiteBackend(db_path))
+    with storage.connection() as conn:
+        start = time.perf_counter()
+        migrations.migrate(conn)
+        first = time.perf_counter() - start
+
+        full, current = [], []
+        for _ in range(runs):
+            cursor = conn.cursor()
+            start = time.perf_counter()
+            migrations.create_schema(cursor, storage.get_backend())
+            migrations.seed_candidates(cursor, storage.get_backend())
+            full.append(time.perf_counter() - start)
+            cursor.close()
+
+            start = time.perf_counter()
+            assert migrations.migrate(conn) == 0
+            current.append(time.perf_counter() - start)
+    return first, statistics.median(full), statistics.median(current)
+
+
+def time_first_response(db_path, preload, path="/candidates", workers=2):
+    port = free_port()
+    env = bench_env(
+        db_path, PORT=str(port), GUNICORN_WORKERS=str(workers), GUNICORN_PRELOAD="1" if preload else "0",
+        METRICS_DIR=tempfile.mkdtemp(prefix="startup-metrics-"),
+    )
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--log-level", "warning", "app:app"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            try:
+                if requests.get(f"http://127.0.0.1:{port}{path}", timeout=5).status_code == 200:
+                    return time.perf_counter() - start
+            except requests.RequestException:
+                pass
+            time.sleep(0.02)
+        raise SystemExit("gunicorn did not come up")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+    db_path = os.path.join(tempfile.mkdtemp(prefix="startup-"), "startup.db")
+
+    first, full, current = time_schema(db_path, args.runs)
+    seconds, firebase = time_import(db_path, args.runs)
+    print(f"import app               {seconds * 1000:>8.0f}ms  (firebase_admin imported: {'yes' if firebase else 'no'})")
+    print(f"schema: first migrate()  {first * 1000:>8.1f}ms")
+    print(f"schema: full init        {full * 1000:>8.1f}ms  (what every boot used to run)")
+    print(f"schema: migrate, current {current * 1000:>8.1f}ms")
+    for preload in (False, True):
+        times = [time_first_response(db_path, preload, workers=args.workers) for _ in range(args.runs)]
+        print(f"gunicorn first response  {statistics.median(times) * 1000:>8.0f}ms  ({args.workers} workers, GUNICORN_PRELOAD={int(preload)})")
+
+
+if __name__ == "__main__":
+    main()
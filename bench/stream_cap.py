@@ -0,0 +1,139 @@
+"""Live results viewers vs ballots in one gthread worker.
+
+Each open `/results/stream` holds one of the worker's request threads for
+up to RESULTS_STREAM_MAX_SECONDS. The run plays one worker with a fixed
+pool of `--threads` request threads: `--viewers` open the stream and keep
+reading it for `--seconds`, while `--voters` cast ballots through the same
+threads. It runs twice, with RESULTS_STREAM_MAX_SUBSCRIBERS at `--cap` and
+with no cap, and checks that with the cap:
+
+    viewers past the cap get 503 with a Retry-After at once
+    /vote keeps answering fast while the cap is saturated
+
+Without the cap, enough viewers take every thread and ballots wait for
+streams to close. The database is the stand-in (bench/standin.py).
+
+    python -m bench.stream_cap --threads 32 --viewers 40 --seconds 6
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench import loadtest, standin
+
+
+class Client(loadtest.Client):
+    """A loadtest client whose requests wait for one of the worker's request threads"""
+
+    def __init__(self, server, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.server = server
+
+    def request(self, route, method, url, **kwargs):
+        start = time.perf_counter()
+        response = self.server.submit(self.http.open, url, method=method, **kwargs).result()
+        self.recorder.add(route, response.status_code, time.perf_counter() - start)
+        return response
+
+
+def run_scenario(args):
+    path = os.path.join(tempfile.mkdtemp(prefix="stream-cap-"), "vote.db")
+    os.environ.update(STORAGE_BACKEND="mysql", SECRET_KEY="bench", RATE_LIMIT="0", SHED_MAX_INFLIGHT="1000000",
+                      PAGE_CACHE="1", RESULTS_STREAM_MAX_SECONDS=str(args.seconds),
+                      RESULTS_STREAM_MAX_SUBSCRIBERS=str(args.cap))
+    standin.install(path)
+
+    import app as app_module
+    import catalog
+    import results_stream
+    import token_verify
+
+    issuer = token_verify.LocalIssuer(loadtest.PROJECT_ID)
+    token_verify.configure(loadtest.PROJECT_ID, key_source=issuer.key_source()).keys.refresh()
+    tokens = loadtest.seed(app_module, args.csv)
+    snapshot = catalog.refresh()
+
+    server = ThreadPoolExecutor(args.threads)
+    streams = loadtest.Recorder()
+    ballots = loadtest.Recorder()
+    refused_without_retry = []
+
+    def watch():
+        client = app_module.app.test_client()
+        start = time.perf_counter()
+        response = client.get("/results/stream", buffered=False)
+        if response.status_code == 503 and not response.headers.get("Retry-After"):
+            refused_without_retry.append(response)
+        streams.add("GET /results/stream", response.status_code, time.perf_counter() - start)
+        for _ in response.response:
+            pass
+        response.close()
+
+    voters = []
+    for i in range(args.voters):
+        client = Client(server, app_module.app, issuer, snapshot, tokens, ballots, f"stream-voter-{i}")
+        client.login()
+        voters.append(client)
+    ballots.latencies.clear()
+    ballots.statuses.clear()
+
+    viewers = [server.submit(watch) for _ in range(args.viewers)]
+    time.sleep(0.5)
+    started = time.monotonic()
+
+    def drive(client):
+        while time.monotonic() - started < args.seconds / 2:
+            client.vote()
+
+    threads = [threading.Thread(target=drive, args=(client,)) for client in voters]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for future in viewers:
+        future.result()
+    server.shutdown()
+    elapsed = time.monotonic() - started
+
+    cap = args.cap or "no cap"
+    print(f"streams: {cap}; {args.threads} request threads, {args.viewers} viewers, {args.voters} voters")
+    loadtest.print_table({**streams.summary(elapsed), **ballots.summary(elapsed)}, elapsed)
+    print(f"refused streams: {results_stream.stats()['refused']}")
+
+    if not args.cap:
+        return True
+    stream_counts = streams.statuses["GET /results/stream"]
+    vote_summary = ballots.summary(elapsed).get("POST /vote")
+    ok = stream_counts.get(2, 0) == min(args.cap, args.viewers)
+    ok &= stream_counts.get(5, 0) == max(args.viewers - args.cap, 0) and not refused_without_retry
+    ok &= vote_summary is not None and vote_summary["5xx"] == 0 and vote_summary["p95_ms"] < 1000
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cap", type=int, help="RESULTS_STREAM_MAX_SUBSCRIBERS for one run (0: none); default both")
+    parser.add_argument("--threads", type=int, default=32, help="request threads (GUNICORN_THREADS)")
+    parser.add_argument("--viewers", type=int, default=40)
+    parser.add_argument("--voters", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=6, help="how long each stream stays open")
+    parser.add_argument("--csv", default="Token350.csv")
+    args = parser.parse_args()
+
+    if args.cap is not None:
+        raise SystemExit(0 if run_scenario(args) else 1)
+    # One process per run: the stream cap is read at import
+    failed = False
+    for cap in (0, int(os.getenv("RESULTS_STREAM_MAX_SUBSCRIBERS", 8))):
+        failed |= subprocess.call([sys.executable, "-m", "bench.stream_cap", "--cap", str(cap), *sys.argv[1:]]) != 0
+        print()
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Request deadlines and a circuit breaker around each database pool.
+
+A slow or unreachable MySQL server used to hold every request thread in
+connect() or a query until gunicorn killed the worker, and then nothing
+was served, not even pages that need no database. Two guards keep a
+worker responsive instead:
+
+Deadlines. Each request gets REQUEST_DEADLINE_SECONDS (default 10, under
+gunicorn's 30s timeout) from `init_app`. Waiting for a pooled connection
+and opening a new one both stop at the deadline, and a request past it
+gets no connection at all. Each query is capped separately by
+DB_QUERY_TIMEOUT (see db_pool.py). The C extension of mysql.connector
+fixes a connection's read timeout when it opens, so a query can't be cut
+off at the request deadline exactly.
+
+Breaker. Each pool has a Breaker. After BREAKER_FAILURES connection
+failures in a row (refused, timed out, or broken mid-query) it opens.
+For BREAKER_OPEN_SECONDS (default 10) every checkout then fails at once
+with `Open` and nothing waits on the server. After that one checkout is
+let through as a probe: if it works the breaker closes, and if not it
+stays open for another period. Query errors such as a duplicate key mean
+the server answered, so they count as successes. A PoolTimeout (every
+connection in this worker's pool busy) doesn't count either way: the
+server may be fine, just serving this worker's other requests.
+
+While the primary's breaker is open the app runs read-only. Catalog
+pages come from the last good snapshot, results from the last counts the
+worker saw, and ballot routes answer 503 with a Retry-After (see
+app.unavailable). Under VOTE_INGEST=queued, votes still go to the local
+log. Every refusal is an `Unavailable`, so routes handle both guards the
+same way.
+"""
+import os
+import threading
+import time
+
+
+class Unavailable(Exception):
+    """The database can't be used for this request right now"""
+
+    retry_after = 1
+
+
+class Open(Unavailable):
+    """Refused by an open circuit breaker"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+class DeadlineExceeded(Unavailable):
+    """The request ran out of time before it could use the database"""
+
+
+# Deadlines
+
+_current = threading.local()
+
+
+def set_deadline(seconds):
+    """Give this thread's work `seconds` from now (None: no deadline)"""
+    _current.deadline = None if seconds is None else time.monotonic() + seconds
+
+
+def clear_deadline():
+    _current.deadline = None
+
+
+def remaining():
+    """Seconds left before this thread's deadline, or None without one"""
+    deadline = getattr(_current, "deadline", None)
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def check_deadline(what="the database"):
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"Request deadline passed before it could use {what}")
+    return left
+
+
+def request_deadline():
+    seconds = float(os.getenv("REQUEST_DEADLINE_SECONDS", 10))
+    return seconds if seconds > 0 else None
+
+
+def init_app(app):
+    """Give every request of `app` a deadline for its database work"""
+
+    @app.before_request
+    def _start_deadline():
+        set_deadline(request_deadline())
+
+    @app.teardown_request
+    def _end_deadline(exc):
+        clear_deadline()
+
+
+# Circuit breaker
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class Breaker:
+    def __init__(self, name, failures=None, open_seconds=None):
+        self.name = name
+        self.failures = failures or int(os.getenv("BREAKER_FAILURES", 5))
+        self.open_seconds = open_seconds or float(os.getenv("BREAKER_OPEN_SECONDS", 10))
+        self.state = CLOSED
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.stats_counts = {"opened": 0, "refused": 0, "failures": 0}
+
+    def before(self):
+        """Raise Open unless a call may go to the server now (a probe when half open)"""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            wait = self._opened_at + self.open_seconds - time.monotonic()
+            if wait <= 0 and not self._probing:
+                self.state = HALF_OPEN
+                self._probing = True
+                return
+            self.stats_counts["refused"] += 1
+        raise Open(f"Database {self.name} is unavailable; not trying again for a moment", max(wait, 1))
+
+    def success(self):
+        with self._lock:
+            self._consecutive = 0
+            self._probing = False
+            if self.state != CLOSED:
+                print(f"Database {self.name} is back; closing the circuit breaker")
+                self.state = CLOSED
+
+    def failure(self, error=None):
+        with self._lock:
+            self.stats_counts["failures"] += 1
+            self._consecutive += 1
+            self._probing = False
+            if self.state == HALF_OPEN or (self.state == CLOSED and self._consecutive >= self.failures):
+                if self.state == CLOSED:
+                    self.stats_counts["opened"] += 1
+                    print(f"Database {self.name} failed {self._consecutive} times in a row, "
+                          f"opening the circuit breaker for {self.open_seconds:g}s: {error}")
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+
+    def cancel(self):
+        """A probe ended without finding out whether the server works (e.g. past its deadline)"""
+        with self._lock:
+            if self._probing:
+                self._probing = False
+                # Still open; the next call probes again
+                self.state = OPEN
+
+    @property
+    def is_open(self):
+        """True while calls are being refused (open, or half open with a probe out)"""
+        return self.state != CLOSED
+
+    def stats(self):
+        return {"state": self.state, "consecutive_failures": self._consecutive, **self.stats_counts}
@@ -0,0 +1,112 @@
+"""Build resized and WebP/AVIF variants of the site's photos.
+
+Run this once before deploying (it needs Pillow):
+
+    python build_images.py            # writes derivatives/ and its manifest.json
+    python build_images.py --force    # rebuild even if the variants are up to date
+    python build_images.py --no-avif  # WebP only; AVIF encoding is slow
+
+Every .jpg/.png under the image folders gets a copy at each width in WIDTHS
+that is smaller than the original, in its own format plus WebP (and AVIF
+when this Pillow build supports it). images.py serves them.
+"""
+import argparse
+import json
+import os
+import sys
+
+from assets import ROOT
+from images import DERIVATIVES_DIR, MANIFEST_PATH, SOURCE_DIRS
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+WIDTHS = (320, 640, 960, 1600)
+MAX_WIDTH = WIDTHS[-1]
+SOURCE_EXTENSIONS = {".jpg": "jpeg", ".jpeg": "jpeg", ".png": "png"}
+QUALITY = {"jpeg": 80, "webp": 78, "avif": 55}
+
+
+def _save(image, path, fmt):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if fmt == "jpeg":
+        image.convert("RGB").save(path, "JPEG", quality=QUALITY["jpeg"], optimize=True, progressive=True)
+    elif fmt == "png":
+        image.save(path, "PNG", optimize=True)
+    elif fmt == "webp":
+        image.save(path, "WEBP", quality=QUALITY["webp"], method=6)
+    elif fmt == "avif":
+        image.save(path, "AVIF", quality=QUALITY["avif"])
+
+
+def build_one(key, source, formats, force=False):
+    """Write the variants for one original and return its manifest entry"""
+    fmt = SOURCE_EXTENSIONS[os.path.splitext(source)[1].lower()]
+    stem = os.path.splitext(key)[0]
+    source_mtime = os.stat(source).st_mtime
+
+    with Image.open(source) as original:
+        original = ImageOps.exif_transpose(original)
+        width, height = original.size
+        variants = []
+        for variant_fmt in (fmt,) + formats:
+            # Modern formats also get a full-width copy; the original covers its own format
+            widths = [w for w in WIDTHS if w < width]
+            if variant_fmt != fmt:
+                widths.append(min(width, MAX_WIDTH))
+            for w in sorted(set(widths)):
+                ext = "jpg" if variant_fmt == "jpeg" else variant_fmt
+                rel = f"{stem}-{w}.{ext}"
+                path = os.path.join(DERIVATIVES_DIR, rel)
+                if force or not os.path.exists(path) or os.stat(path).st_mtime < source_mtime:
+                    resized = original if w == width else original.resize((w, round(height * w / width)), Image.LANCZOS)
+                    _save(resized, path, variant_fmt)
+                variants.append({"w": w, "format": variant_fmt, "file": rel, "bytes": os.path.getsize(path)})
+
+    return {"format": fmt, "width": width, "bytes": os.path.getsize(source), "variants": variants}
+
+
+def build(force=False, avif=True):
+    formats = ("webp",)
+    if avif and features.check("avif"):
+        formats += ("avif",)
+    elif avif:
+        print("This Pillow build has no AVIF support; writing WebP only")
+
+    manifest = {}
+    for prefix, directory in SOURCE_DIRS.items():
+        directory = os.path.join(ROOT, directory)
+        for root, _, files in os.walk(directory):
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() not in SOURCE_EXTENSIONS:
+                    continue
+                source = os.path.join(root, name)
+                key = prefix + "/" + os.path.relpath(source, directory).replace(os.sep, "/")
+                try:
+                    manifest[key] = build_one(key, source, formats, force)
+                except OSError as e:
+                    print(f"Skipping {source}: {e}")
+
+    with open(MANIFEST_PATH, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True, ensure_ascii=False)
+    return manifest
+
+
+def main():
+    if Image is None:
+        sys.exit("Pillow is required: pip install Pillow")
+    parser = argparse.ArgumentParser(description="Build image variants under derivatives/")
+    parser.add_argument("--force", action="store_true", help="rebuild every variant")
+    parser.add_argument("--no-avif", action="store_true", help="skip AVIF (much faster to encode)")
+    args = parser.parse_args()
+
+    manifest = build(args.force, avif=not args.no_avif)
+    originals = sum(entry["bytes"] for entry in manifest.values())
+    derived = sum(v["bytes"] for entry in manifest.values() for v in entry["variants"])
+    print(f"{len(manifest)} images, {originals / 1e6:.1f} MB of originals, {derived / 1e6:.1f} MB of variants")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""In-process cache of the candidate catalog.
+
+Kings, queens, lanterns and the finalists are loaded once per worker into
+immutable records, with a slug index for `/viewmore`. Nothing in the app
+writes these tables, so the snapshot is only reloaded on a TTL: once it is
+older than CATALOG_TTL seconds (default 300) the next request starts a
+background reload, and requests keep using the previous snapshot while
+that happens. An edit made by hand shows up within CATALOG_TTL, or at once
+after a restart.
+
+Each snapshot carries a `version` digest of its contents. Caches built
+from the catalog (the finalists manifest, the leaderboard) compare it to
+rebuild only when a reload actually changed something.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import namedtuple
+
+import metrics
+import storage
+
+Candidate = namedtuple("Candidate", "id type name batch bio description image_path slug")
+
+TABLES = {
+    "king": "kings",
+    "queen": "queens",
+    "lantern": "lanterns",
+    "final_king": "final_kings",
+    "final_queen": "final_queens",
+}
+
+# /viewmore resolves names among these, in this order
+VIEWMORE_TYPES = ("king", "queen")
+
+TTL = float(os.getenv("CATALOG_TTL", 300))
+
+
+def slugify(name):
+    """'Aung Min Khant' and 'aung_min_khant' both become 'aung_min_khant'"""
+    return "_".join(name.replace("_", " ").split()).lower()
+
+
+class Snapshot:
+    """One immutable load of the catalog"""
+
+    def __init__(self, lists, loaded_at):
+        self.lists = lists
+        self.loaded_at = loaded_at
+        self.by_name = {t: tuple(sorted(rows, key=lambda c: c.name)) for t, rows in lists.items()}
+        self.by_id = {(c.type, c.id): c for rows in lists.values() for c in rows}
+        self.by_slug = {}
+        for candidate_type in reversed(VIEWMORE_TYPES):
+            for c in lists.get(candidate_type, ()):
+                self.by_slug[c.slug] = c
+        digest = hashlib.sha1(repr(sorted(lists.items())).encode("utf-8"))
+        self.version = digest.hexdigest()[:12]
+
+    def find(self, candidate_type, candidate_id):
+        try:
+            return self.by_id.get((candidate_type, int(candidate_id)))
+        except (TypeError, ValueError):
+            return None
+
+    def find_slug(self, slug):
+        """Exact slug lookup, falling back to the old partial name match"""
+        key = slugify(slug)
+        candidate = self.by_slug.get(key)
+        if candidate is None and key:
+            for candidate_type in VIEWMORE_TYPES:
+                for c in self.by_name.get(candidate_type, ()):
+                    if key in c.slug:
+                        return c
+        return candidate
+
+
+def _record(candidate_type, row):
+    name = row["name"]
+    return Candidate(
+        id=row["id"],
+        type=candidate_type,
+        name=name,
+        batch=row.get("batch"),
+        bio=row.get("bio"),
+        description=row.get("description"),
+        image_path=row.get("image_path"),
+        slug=slugify(name),
+    )
+
+
+def load(conn):
+    """Read every catalog table into a new Snapshot"""
+    cursor = conn.cursor(dictionary=True)
+    lists = {}
+    try:
+        for candidate_type, table in TABLES.items():
+            with metrics.query(f"catalog.{table}"):
+                cursor.execute(f"SELECT * FROM {table} ORDER BY id")
+                rows = cursor.fetchall()
+            lists[candidate_type] = tuple(_record(candidate_type, row) for row in rows)
+    finally:
+        cursor.close()
+    return Snapshot(lists, time.monotonic())
+
+
+class Catalog:
+    def __init__(self, ttl=TTL):
+        self.ttl = ttl
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._retry_at = 0.0
+
+    def get(self):
+        """Return the current snapshot, loading it the first time"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = self._load()
+                return self._snapshot
+        now = time.monotonic()
+        if now - snapshot.loaded_at > self.ttl and now >= self._retry_at:
+            self._refresh_in_background()
+        return snapshot
+
+    def _load(self):
+        with storage.read_connection() as conn:
+            return load(conn)
+
+    def refresh(self):
+        """Reload now and swap the new snapshot in"""
+        snapshot = self._load()
+        self._snapshot = snapshot
+        return snapshot
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._background_refresh, name="catalog-refresh", daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"Catalog refresh failed, keeping the previous snapshot: {e}")
+            self._retry_at = time.monotonic() + min(self.ttl, 30)
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+_catalog = Catalog()
+
+
+def get():
+    return _catalog.get()
+
+
+def refresh():
+    return _catalog.refresh()
@@ -0,0 +1,293 @@
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import mysql.connector
+from mysql.connector import errors as mysql_errors
+
+import breaker
+import metrics
+
+# The connection itself is gone or unusable (not just this statement):
+# it is discarded instead of going back to the pool, and counts against
+# the pool's circuit breaker
+CONNECTION_ERRORS = (
+    mysql_errors.OperationalError,
+    mysql_errors.InterfaceError,
+    mysql_errors.ConnectionTimeoutError,
+    mysql_errors.ReadTimeoutError,
+    mysql_errors.WriteTimeoutError,
+)
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def connect_kwargs():
+    """Connection settings for the MySQL server, read from the environment"""
+    return dict(
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        database=os.getenv("DB_NAME"),
+        ssl_ca="ca.pem",  # if Aiven requires SSL cert
+        # A server that doesn't answer at all fails the connect instead of hanging
+        connection_timeout=_env_int("DB_CONNECT_TIMEOUT", 3),
+    )
+
+
+class PoolTimeout(breaker.Unavailable):
+    """Raised when no connection could be checked out within the timeout"""
+
+
+class _Entry:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+
+
+class ConnectionPool:
+    """A fixed-size pool of open MySQL connections for one worker process.
+
+    Connections are opened lazily up to `size`, handed out through the
+    `connection()` context manager and always returned, even when the
+    route raises. Idle connections are pinged before reuse and replaced
+    once they are older than `recycle` seconds.
+
+    Checkouts stop at the calling request's deadline and go through the
+    pool's circuit breaker (see breaker.py). MySQL connections also get
+    `query_timeout` as their read and write timeout.
+    """
+
+    def __init__(self, size=5, timeout=5.0, recycle=1800, ping_after=30.0, query_timeout=None, connect=None,
+                 name="primary", **kwargs):
+        self.size = size
+        # Anything with mysql.connector.connect's signature (see storage.py)
+        self.connect = connect
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self.query_timeout = query_timeout
+        self.kwargs = kwargs
+        self.breaker = breaker.Breaker(name)
+        self._idle = deque()
+        self._open = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time": 0.0,
+            "timeouts": 0,
+            "connects": 0,
+            "recycled": 0,
+            "broken": 0,
+        }
+
+    def _connect(self):
+        kwargs = self.kwargs
+        if self.connect is None:
+            # Only mysql.connector takes these (the SQLite connection doesn't)
+            kwargs = dict(kwargs)
+            if self.query_timeout:
+                kwargs.update(read_timeout=self.query_timeout, write_timeout=self.query_timeout)
+            left = breaker.check_deadline()
+            if left is not None and kwargs.get("connection_timeout"):
+                kwargs["connection_timeout"] = max(1, min(kwargs["connection_timeout"], math.ceil(left)))
+        conn = (self.connect or mysql.connector.connect)(autocommit=True, **kwargs)
+        with self._cond:
+            self._stats["connects"] += 1
+        return _Entry(conn)
+
+    def _discard(self, entry):
+        try:
+            entry.conn.close()
+        except Exception:
+            pass
+
+    def warm(self, count=None):
+        """Open idle connections ahead of the first request"""
+        count = self.size if count is None else min(count, self.size)
+        opened = 0
+        while True:
+            with self._cond:
+                if self._open + len(self._idle) >= count or self._open >= self.size:
+                    break
+                self._open += 1
+            try:
+                entry = self._connect()
+            except Exception:
+                with self._cond:
+                    self._open -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._open -= 1
+                self._idle.append(entry)
+                self._cond.notify()
+            opened += 1
+        return opened
+
+    def _healthy(self, entry):
+        now = time.monotonic()
+        if now - entry.created_at > self.recycle:
+            with self._cond:
+                self._stats["recycled"] += 1
+            return False
+        if now - entry.last_used > self.ping_after:
+            try:
+                entry.conn.ping(reconnect=False)
+            except Exception:
+                with self._cond:
+                    self._stats["broken"] += 1
+                return False
+        return True
+
+    def checkout(self):
+        start = time.monotonic()
+        left = breaker.check_deadline()
+        timeout = self.timeout if left is None else min(self.timeout, left)
+        deadline = start + timeout
+        waited = False
+        with self._cond:
+            while not self._idle and self._open + len(self._idle) >= self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(f"No database connection available within {timeout:.1f}s")
+                waited = True
+                self._cond.wait(remaining)
+            entry = self._idle.pop() if self._idle else None
+            self._open += 1
+            self._stats["checkouts"] += 1
+            if waited:
+                self._stats["waits"] += 1
+                self._stats["wait_time"] += time.monotonic() - start
+
+        try:
+            if entry is not None and not self._healthy(entry):
+                self._discard(entry)
+                entry = None
+            if entry is None:
+                entry = self._connect()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+        return entry
+
+    def checkin(self, entry, broken=False):
+        if not broken:
+            try:
+                if entry.conn.in_transaction:
+                    entry.conn.rollback()
+            except Exception:
+                broken = True
+        if broken:
+            self._discard(entry)
+        else:
+            entry.last_used = time.monotonic()
+        with self._cond:
+            self._open -= 1
+            if broken:
+                self._stats["broken"] += 1
+            else:
+                self._idle.append(entry)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; it is rolled back if needed and returned on exit.
+
+        Raises breaker.Open while the pool's breaker is open, and
+        PoolTimeout or breaker.DeadlineExceeded when no connection is free in time.
+        """
+        self.breaker.before()
+        start = time.perf_counter()
+        try:
+            entry = self.checkout()
+        except (breaker.DeadlineExceeded, PoolTimeout):
+            # This request ran out of time, or this worker's connections are
+            # all busy: neither says anything about the server
+            self.breaker.cancel()
+            raise
+        except Exception as e:
+            # Opening a connection failed
+            self.breaker.failure(e)
+            raise
+        metrics.observe_acquire(time.perf_counter() - start)
+        broken = None
+        try:
+            yield entry.conn
+        except CONNECTION_ERRORS as e:
+            broken = e
+            raise
+        finally:
+            self.checkin(entry, broken=broken is not None)
+            # Anything else (a duplicate key, say) means the server answered
+            if broken is not None:
+                self.breaker.failure(broken)
+            else:
+                self.breaker.success()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(size=self.size, in_use=self._open, idle=len(self._idle))
+        stats["breaker"] = self.breaker.stats()
+        stats["wait_time"] = round(stats["wait_time"], 6)
+        return stats
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+        for entry in idle:
+            self._discard(entry)
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def pool_settings():
+    """Pool sizing and timeouts from the DB_POOL_* environment variables"""
+    return dict(
+        size=_env_int("DB_POOL_SIZE", 5),
+        timeout=_env_float("DB_POOL_TIMEOUT", 5.0),
+        recycle=_env_int("DB_POOL_RECYCLE", 1800),
+        ping_after=_env_float("DB_POOL_PING_AFTER", 30.0),
+        query_timeout=_env_int("DB_QUERY_TIMEOUT", 10),
+    )
+
+
+def get_pool():
+    """Return this process's pool, creating a fresh one after a fork"""
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                _pool = ConnectionPool(**pool_settings(), **connect_kwargs())
+                _pool_pid = pid
+    return _pool
+
@@ -0,0 +1,225 @@
+"""Streaming audit export of `votes`, `final_votes` and `final_tokens`.
+
+Rows are read in keyset pages (`WHERE id > last id ORDER BY id LIMIT
+EXPORT_PAGE_SIZE`), each through an unbuffered cursor in chunks of
+FETCH_SIZE, and written out as CSV or NDJSON as they arrive. However large
+the table, memory holds one chunk, and every statement is a short
+index-range read instead of one long scan. Each row carries its `id`, so
+an interrupted export resumes with `after=<last id>`.
+
+The export runs on its own connection, not the request pool, so a long
+download never takes a connection away from voters; with DB_REPLICAS set
+it reads from a replica.
+
+    python export.py votes --category king --since 2025-10-05 > king_votes.csv
+    python export.py final_tokens --format ndjson --category reward --out rewards.ndjson
+    curl -H "Authorization: Bearer $EXPORT_TOKEN" "https://.../admin/export/final_votes?format=csv&candidate=3"
+
+Filters (all optional):
+    category    votes: candidate_type; final_votes: category;
+                final_tokens: tokens used for that category
+    candidate   candidate id (final_tokens: needs category)
+    since/until created_at range, or used_at_<category> for final_tokens
+                ('YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS', until is exclusive)
+    after       only rows with a larger id (resume point)
+    limit       stop after this many rows
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+from datetime import datetime
+
+import ballot
+import metrics
+import storage
+
+PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", 10000))
+FETCH_SIZE = 1000
+FORMATS = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+
+COLUMNS = {
+    "votes": ("id", "user_uid", "candidate_type", "candidate_id", "created_at"),
+    "final_votes": ("id", "token", "category", "candidate_id", "created_at"),
+    "final_tokens": (
+        "id", "token",
+        "used_for_king", "candidate_king", "used_by_king", "used_at_king",
+        "used_for_queen", "candidate_queen", "used_by_queen", "used_at_queen",
+        "used_for_lantern", "candidate_lantern", "used_by_lantern", "used_at_lantern",
+        "used_for_reward", "used_by_reward", "used_at_reward", "reward_value",
+    ),
+}
+
+# table -> the column a category filter applies to
+CATEGORY_COLUMNS = {"votes": "candidate_type", "final_votes": "category"}
+CATEGORIES = {
+    "votes": tuple(ballot.CANDIDATE_TABLES),
+    "final_votes": ballot.FINAL_CATEGORIES,
+    "final_tokens": ballot.FINAL_CATEGORIES,
+}
+
+
+def _timestamp(value, name):
+    try:
+        return datetime.fromisoformat(value.replace("T", " ")).strftime("%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        raise ValueError(f"{name} must look like 2025-10-05 or 2025-10-05 18:30:00, not {value!r}")
+
+
+def build_filters(table, category=None, candidate=None, since=None, until=None):
+    """SQL conditions and params for the filters (raises ValueError on bad input)"""
+    if table not in COLUMNS:
+        raise ValueError(f"Unknown table {table!r}; use one of {', '.join(COLUMNS)}")
+    if category and category not in CATEGORIES[table]:
+        raise ValueError(f"Unknown category {category!r} for {table}; use one of {', '.join(CATEGORIES[table])}")
+    if candidate is not None and not str(candidate).isdigit():
+        raise ValueError(f"candidate must be a candidate id, not {candidate!r}")
+    conditions, params = [], []
+
+    if table == "final_tokens":
+        if (candidate is not None or since or until) and not category:
+            raise ValueError("final_tokens needs a category to filter by candidate or time")
+        if category:
+            conditions.append(f"used_for_{category} = 1")
+        if candidate is not None:
+            if category == "reward":
+                raise ValueError("Reward claims have no candidate")
+            conditions.append(f"candidate_{category} = %s")
+            params.append(int(candidate))
+        time_column = f"used_at_{category}"
+    else:
+        if category:
+            conditions.append(f"{CATEGORY_COLUMNS[table]} = %s")
+            params.append(category)
+        if candidate is not None:
+            conditions.append("candidate_id = %s")
+            params.append(int(candidate))
+        time_column = "created_at"
+
+    if since:
+        conditions.append(f"{time_column} >= %s")
+        params.append(_timestamp(since, "since"))
+    if until:
+        conditions.append(f"{time_column} < %s")
+        params.append(_timestamp(until, "until"))
+    return conditions, params
+
+
+def rows(table, after=0, limit=None, page_size=PAGE_SIZE, **filters):
+    """Yield row tuples in id order, one keyset page at a time"""
+    conditions, params = build_filters(table, **filters)
+    where = " AND ".join(["id > %s"] + conditions)
+    sql = f"SELECT {', '.join(COLUMNS[table])} FROM {table} WHERE {where} ORDER BY id LIMIT %s"
+    last_id = int(after or 0)
+    remaining = limit
+    conn = storage.read_connect()
+    conn.autocommit = True
+    try:
+        while remaining is None or remaining > 0:
+            size = page_size if remaining is None else min(page_size, remaining)
+            cursor = conn.cursor()
+            try:
+                with metrics.query(f"export.{table}"):
+                    cursor.execute(sql, [last_id] + params + [size])
+                count = 0
+                while True:
+                    chunk = cursor.fetchmany(FETCH_SIZE)
+                    if not chunk:
+                        break
+                    for row in chunk:
+                        yield row
+                    count += len(chunk)
+                    last_id = chunk[-1][0]
+            finally:
+                _close(cursor)
+            if remaining is not None:
+                remaining -= count
+            if count < size:
+                break
+    finally:
+        _close(conn)
+
+
+def _close(resource):
+    # A client that hangs up mid-page leaves unread rows behind, which
+    # mysql.connector complains about on close; the connection is dropped anyway
+    try:
+        resource.close()
+    except Exception:
+        pass
+
+
+def _plain(value):
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return value
+
+
+def render(table, row_iter, fmt="csv", chunk_rows=FETCH_SIZE):
+    """Yield the export as text chunks of up to `chunk_rows` rows"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}; use csv or ndjson")
+    columns = COLUMNS[table]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if fmt == "csv":
+        writer.writerow(columns)
+    pending = 0
+    for row in row_iter:
+        if fmt == "csv":
+            writer.writerow(["" if value is None else _plain(value) for value in row])
+        else:
+            buffer.write(json.dumps(dict(zip(columns, map(_plain, row))), ensure_ascii=False) + "\n")
+        pending += 1
+        if pending >= chunk_rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export(table, fmt="csv", after=0, limit=None, **filters):
+    """Validate the request and return a generator of output chunks"""
+    build_filters(table, **filters)
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}; use csv or ndjson")
+    return render(table, rows(table, after=after, limit=limit, **filters), fmt)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("table", choices=sorted(COLUMNS))
+    parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+    parser.add_argument("--category")
+    parser.add_argument("--candidate", type=int)
+    parser.add_argument("--since")
+    parser.add_argument("--until")
+    parser.add_argument("--after", type=int, default=0, help="resume after this id")
+    parser.add_argument("--limit", type=int)
+    parser.add_argument("--out", help="file to write (default: stdout)")
+    args = parser.parse_args()
+
+    try:
+        chunks = export(
+            args.table, args.format, after=args.after, limit=args.limit,
+            category=args.category, candidate=args.candidate, since=args.since, until=args.until,
+        )
+    except ValueError as e:
+        raise SystemExit(str(e))
+    out = open(args.out, "w", encoding="utf-8", newline="") if args.out else sys.stdout
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if args.out:
+            out.close()
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    main()
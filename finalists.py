@@ -0,0 +1,87 @@
+"""The finalists manifest behind `/final`.
+
+One document with everything final.html shows and votes on: each
+finalist's database id, name, batch and bio from `final_kings` /
+`final_queens` (via the catalog), and the hashed URLs of their photos in
+templates/img/King_Viewmore and Queen_Viewmore (`Name(1).jpg`,
+`Name(2).jpg`, ...; the candidate's `image_path` when there are none).
+
+It is built once per catalog snapshot and inlined into the page, so the
+browser needs no extra request and no matching by name. `/api/finalists`
+serves the same document with its version as ETag.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import namedtuple
+
+import assets
+import catalog
+
+# catalog type -> (manifest key, photo directory under templates/)
+SECTIONS = {
+    "final_king": ("kings", "img/King_Viewmore"),
+    "final_queen": ("queens", "img/Queen_Viewmore"),
+}
+
+# Vertical crop focus of the card photos, in percent from the top
+FOCUS_Y = 15
+
+PHOTO_NAME = re.compile(r"^(?P<name>.+?)\s*\((?P<n>\d+)\)\.(?:jpe?g|png|webp)$", re.IGNORECASE)
+
+Manifest = namedtuple("Manifest", "catalog_version version data json")
+
+_manifest = None
+_lock = threading.Lock()
+
+
+def _photos(directory):
+    """slug -> photo paths under `directory`, in (1), (2), ... order"""
+    found = {}
+    try:
+        names = os.listdir(os.path.join(assets.ROOT, "templates", directory))
+    except OSError:
+        return found
+    for filename in names:
+        match = PHOTO_NAME.match(filename)
+        if match:
+            found.setdefault(catalog.slugify(match["name"]), []).append((int(match["n"]), f"{directory}/{filename}"))
+    return {slug: [path for _, path in sorted(paths)] for slug, paths in found.items()}
+
+
+def build(snapshot):
+    data = {}
+    for candidate_type, (key, directory) in SECTIONS.items():
+        photos = _photos(directory)
+        entries = []
+        for c in snapshot.lists.get(candidate_type, ()):
+            paths = photos.get(c.slug) or ([c.image_path] if c.image_path else [])
+            urls = [assets.url(path) for path in paths]
+            entries.append({
+                "id": c.id,
+                "name": c.name,
+                "batch": c.batch or "",
+                "bio": c.bio or "",
+                "image": urls[0] if urls else None,
+                "images": urls,
+                "focusY": FOCUS_Y,
+            })
+        data[key] = entries
+    body = json.dumps(data, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+    version = hashlib.sha256(body.encode("utf-8")).hexdigest()[:16]
+    return Manifest(snapshot.version, version, data, body)
+
+
+def get():
+    """The manifest for the current catalog snapshot (rebuilt when it changes)"""
+    global _manifest
+    snapshot = catalog.get()
+    manifest = _manifest
+    if manifest is None or manifest.catalog_version != snapshot.version:
+        with _lock:
+            manifest = _manifest
+            if manifest is None or manifest.catalog_version != snapshot.version:
+                manifest = _manifest = build(snapshot)
+    return manifest
@@ -0,0 +1,36 @@
+"""Firebase project settings, without the Admin SDK.
+
+Importing firebase_admin pulls in google-auth and its transport stack,
+which used to be a large share of the app's import time, and nothing
+needs it: ID tokens are checked locally by token_verify.py, which only
+needs the project ID.
+
+    firebase_client.project_id()   # FIREBASE_PROJECT_ID, else the service account's
+"""
+import json
+import os
+
+_credentials = None
+
+
+def credentials_dict():
+    """The service account from FIREBASE_CREDENTIALS_JSON (parsed once)"""
+    global _credentials
+    if _credentials is None:
+        cred_json = os.getenv("FIREBASE_CREDENTIALS_JSON")
+        if not cred_json:
+            raise ValueError("FIREBASE_CREDENTIALS_JSON environment variable is not set!")
+        _credentials = json.loads(cred_json)
+    return _credentials
+
+
+def project_id():
+    """The Firebase project ID tokens must be issued for, or None if unconfigured"""
+    if os.getenv("FIREBASE_PROJECT_ID"):
+        return os.getenv("FIREBASE_PROJECT_ID")
+    try:
+        return credentials_dict().get("project_id")
+    except ValueError as e:
+        print(f"Firebase project ID unavailable: {e}")
+        return None
+
@@ -0,0 +1,120 @@
+# Gunicorn picks this file up automatically from the working directory.
+#
+# Every request spends most of its time waiting on the remote MySQL server,
+# so each worker serves requests from a thread pool (gthread) instead of one
+# at a time. Live results (/results/stream) also hold a thread per viewer.
+# Tune with:
+#   WEB_CONCURRENCY / GUNICORN_WORKERS  worker processes (default 2)
+#   GUNICORN_THREADS                    threads per worker (default 32)
+#   DB_POOL_SIZE                        MySQL connections per worker (default 10);
+#                                       keep workers x DB_POOL_SIZE under the
+#                                       server's max_connections
+#   GUNICORN_PRELOAD                    import the app and warm caches once in the
+#                                       master, before forking (default 1)
+#   SHED_MAX_INFLIGHT                   ballot/token requests a worker takes on at
+#                                       once before answering 503 (default 2 x DB_POOL_SIZE);
+#                                       per worker, so the host takes workers x this
+#   RESULTS_STREAM_MAX_SUBSCRIBERS      live results streams a worker holds open at
+#                                       once (default 8); keep it well under GUNICORN_THREADS
+import os
+
+workers = int(os.getenv("GUNICORN_WORKERS", os.getenv("WEB_CONCURRENCY", 2)))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.getenv("GUNICORN_THREADS", 32))
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+# Workers fork from a master that has already imported the app and loaded
+# the catalog, token index and signing keys (see when_ready), so they
+# start serving at once and share those pages copy-on-write
+preload_app = os.getenv("GUNICORN_PRELOAD", "1").lower() not in ("0", "false", "no")
+
+# Behind Render's proxy: reuse its connections, and give a stuck request
+# long enough to hit its deadline (REQUEST_DEADLINE_SECONDS, see
+# breaker.py) before the worker is recycled
+keepalive = 5
+timeout = 30
+graceful_timeout = 30
+# Heartbeat file on tmpfs so a slow disk can't make workers look dead
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+# A connection per request thread is wasteful (streams don't use one), but
+# the default of 5 would make most threads queue for the database
+os.environ.setdefault("DB_POOL_SIZE", "10")
+
+# Workers share latency metrics through snapshot files here (see metrics.py)
+os.environ.setdefault("METRICS_DIR", os.path.join(worker_tmp_dir or "/tmp", "voting-metrics"))
+# ...and rate limit buckets here (see ratelimit.py)
+os.environ.setdefault("RATE_LIMIT_PATH", os.path.join(worker_tmp_dir or "/tmp", "voting-ratelimit.db"))
+
+
+def on_starting(server):
+    import metrics
+    metrics.clear()
+
+
+def when_ready(server):
+    # Runs in the master before any worker is forked. Threads and sockets
+    # don't survive a fork, so only data is loaded here; each worker opens
+    # its own connections and background threads in post_worker_init.
+    import assets
+    import catalog
+    import migrations
+    import storage
+    import token_index
+    import token_verify
+    try:
+        applied = migrations.migrate()
+        if applied:
+            print(f"Applied {applied} schema migrations")
+    except Exception as e:
+        print(f"Schema migration failed: {e}")
+    for name, load in (
+        ("Catalog", catalog.refresh),
+        ("Token index", token_index.reload),
+        ("Signing key", token_verify.load_keys),
+        ("Asset manifest", assets.load),
+    ):
+        try:
+            load()
+        except Exception as e:
+            print(f"{name} preload failed: {e}")
+    # The master's connections must not be shared with the workers
+    storage.close()
+
+
+def post_worker_init(worker):
+    # Open the worker's database connections before it accepts requests
+    import catalog
+    import ingest
+    import metrics
+    import reconcile
+    import replicas
+    import storage
+    import tally
+    import token_index
+    import token_verify
+    storage.warm()
+    token_verify.preload()
+    try:
+        # Already loaded if the master preloaded it
+        catalog.get()
+    except Exception as e:
+        print(f"Catalog warm-up failed: {e}")
+    tally.start_background_fold()
+    token_index.start_background_sync()
+    ingest.start_background_commit()
+    reconcile.start_background_reconcile()
+    replicas.start_background_check()
+    metrics.start_background_flush()
+
+
+def worker_exit(server, worker):
+    # Keep this worker's totals in /metrics after it is gone
+    import ingest
+    import metrics
+    metrics.flush()
+    if ingest.enabled():
+        # Whatever is left stays in the log for the next committer
+        try:
+            ingest.drain(timeout=5)
+        except Exception as e:
+            print(f"Ingest drain on exit failed: {e}")
@@ -0,0 +1,106 @@
+"""Serve resized / WebP / AVIF variants of the site's photos.
+
+`build_images.py` writes the variants and a manifest under `derivatives/`.
+The image routes call `send_image()`, which picks the best variant for the
+request's `Accept` header and `?w=` width, and falls back to the original
+file when there is no manifest entry. Templates use `srcset_attrs()` to
+offer the widths to the browser.
+"""
+import json
+import os
+
+from flask import request, send_from_directory
+from markupsafe import Markup
+
+import assets
+
+DERIVATIVES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "derivatives")
+MANIFEST_PATH = os.path.join(DERIVATIVES_DIR, "manifest.json")
+
+# URL prefix -> directory holding the originals
+SOURCE_DIRS = {
+    "img": "templates/img",
+    "Kings": "templates/Kings",
+    "Queen": "templates/Queen",
+    "Lantern": "templates/Lantern",
+}
+
+# Best first; a format is used only if the browser advertises it
+MODERN_FORMATS = (("avif", "image/avif"), ("webp", "image/webp"))
+
+_manifest = {}
+
+
+def load_manifest(path=MANIFEST_PATH):
+    global _manifest
+    try:
+        with open(path, encoding="utf-8") as f:
+            _manifest = json.load(f)
+    except FileNotFoundError:
+        _manifest = {}
+    except ValueError as e:
+        print(f"Ignoring unreadable image manifest {path}: {e}")
+        _manifest = {}
+    return _manifest
+
+
+def manifest():
+    return _manifest
+
+
+def pick_variant(entry, accept_mimetypes, width=None):
+    """Choose a variant dict from a manifest entry, or None for the original"""
+    formats = [fmt for fmt, mimetype in MODERN_FORMATS if accept_mimetypes[mimetype] > 0]
+    formats.append(entry["format"])
+
+    for fmt in formats:
+        variants = sorted((v for v in entry["variants"] if v["format"] == fmt), key=lambda v: v["w"])
+        if not variants:
+            continue
+        if width is None:
+            # No hint from srcset: the largest variant (still capped by the build)
+            if fmt == entry["format"]:
+                return None
+            return variants[-1]
+        for variant in variants:
+            if variant["w"] >= width:
+                return variant
+        return variants[-1] if fmt != entry["format"] else None
+    return None
+
+
+def send_image(key, directory, filename):
+    """Send `key` (e.g. 'Kings/Bo Bo Linn.jpg') as the best available variant"""
+    entry = _manifest.get(key)
+    if entry is None:
+        return send_from_directory(directory, filename)
+
+    width = request.args.get("w", type=int)
+    variant = pick_variant(entry, request.accept_mimetypes, width)
+    if variant is None:
+        response = send_from_directory(directory, filename)
+    else:
+        response = send_from_directory(DERIVATIVES_DIR, variant["file"])
+    response.vary.add("Accept")
+    return response
+
+
+def srcset_attrs(path, sizes="100vw"):
+    """`srcset`/`sizes` attributes for an image path such as 'Kings/X.png'.
+
+    Returns an empty string when the image has no derivatives, so the plain
+    `src` keeps working.
+    """
+    key = path.lstrip("/")
+    entry = _manifest.get(key)
+    if not entry:
+        return ""
+    widths = sorted({v["w"] for v in entry["variants"]})
+    if not widths:
+        return ""
+    url = assets.url(key)
+    srcset = ", ".join(f"{url}?w={w} {w}w" for w in widths)
+    return Markup(' srcset="{}" sizes="{}"').format(srcset, sizes)
+
+
+load_manifest()
@@ -0,0 +1,275 @@
+"""Queued vote ingestion: a local write-ahead log drained in batches.
+
+With VOTE_INGEST=queued, `/vote` and `/vote_lantern` don't write to the
+database while the voter waits. The ballot is checked against what this
+host already knows (the catalog and the log itself), appended to a SQLite log file on local disk with
+synchronous=FULL, and acknowledged once that commit is fsynced. A
+committer thread then drains the log into `votes` in batches of up to
+INGEST_BATCH_SIZE, one multi-row INSERT each.
+
+`/final_vote` stays synchronous. Whether a token is still unspent is only
+known for sure by the database (the token index can be a minute behind),
+and a voter told "recorded" must not find out later that the token was
+already gone.
+
+    VOTE_INGEST=sync          write through to the database (the default)
+    VOTE_INGEST=queued        append to INGEST_PATH (default ingest.db) and drain it
+    INGEST_MAX_PENDING=5000   undrained entries before new ballots are refused
+    INGEST_BATCH_SIZE=500     entries per database commit
+    INGEST_FLUSH_MS=50        how often the committer looks for new entries
+
+The log keeps one entry per (voter, category), so a second vote is turned away from the log without a database round
+trip, by any worker on the host. A vote the database already holds from
+before the log existed is dropped by the committer (the first vote
+stands, exactly as with VOTE_INGEST=sync); its entry is still marked
+committed, and only the `duplicates` count in stats() shows it.
+
+Every worker runs a committer thread, but only the one holding the lease
+in the log drains it; if that worker dies, another takes over when the
+lease expires and replays whatever was left pending. Entries are marked
+done only after the database commit, and replaying one is harmless
+(duplicate votes are skipped), so a crash between the two loses nothing
+and records nothing twice. With no server running, `python ingest.py`
+drains the log by hand.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+import ballot
+import catalog
+import metrics
+import storage
+
+LEASE_SECONDS = 10
+RETRY_SECONDS = 2
+
+# Entries start out 'pending'; the committer sets this once they are written
+COMMITTED = "committed"
+
+
+class Backlogged(Exception):
+    """The log already holds INGEST_MAX_PENDING undrained entries"""
+
+    retry_after = 5
+
+
+def mode():
+    # Read when asked, so a .env loaded after import still counts
+    return os.getenv("VOTE_INGEST", "sync").strip().lower()
+
+
+def enabled():
+    return mode() == "queued"
+
+
+class IngestLog:
+    def __init__(self, path=None, max_pending=None, batch_size=None, flush_seconds=None):
+        self.path = path or os.getenv("INGEST_PATH", "ingest.db")
+        self.max_pending = max_pending or int(os.getenv("INGEST_MAX_PENDING", 5000))
+        self.batch_size = batch_size or int(os.getenv("INGEST_BATCH_SIZE", 500))
+        self.flush_seconds = flush_seconds or float(os.getenv("INGEST_FLUSH_MS", 50)) / 1000
+        self.stats_counts = {"appended": 0, "duplicates": 0, "backlogged": 0, "committed": 0, "batches": 0}
+        self._db = None
+        self._db_pid = None
+        self._lock = threading.Lock()
+        self._lease_until = 0.0
+        self._committer_lock = threading.Lock()
+        self._committer = None
+        self._committer_pid = None
+
+    def _conn(self):
+        """This process's connection to the log (reopened after a fork)"""
+        if self._db is None or self._db_pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode = WAL")
+            # Acknowledged means on disk: fsync the WAL on every commit
+            db.execute("PRAGMA synchronous = FULL")
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    user_uid TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    candidate_id INTEGER,
+                    state TEXT NOT NULL DEFAULT 'pending',
+                    created_at REAL NOT NULL
+                );
+                CREATE UNIQUE INDEX IF NOT EXISTS one_vote ON entries (user_uid, category) WHERE kind = 'vote';
+                CREATE INDEX IF NOT EXISTS pending_entries ON entries (seq) WHERE state = 'pending';
+                CREATE TABLE IF NOT EXISTS lease (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    owner INTEGER,
+                    expires_at REAL NOT NULL DEFAULT 0
+                );
+                INSERT OR IGNORE INTO lease (id) VALUES (1);
+            """)
+            self._db, self._db_pid = db, os.getpid()
+        return self._db
+
+    # Appending
+
+    def append(self, kind, user_uid, category, candidate_id):
+        """Durably log one ballot; RECORDED or DUPLICATE, or raise Backlogged"""
+        with self._lock, metrics.query("ingest.append"):
+            db = self._conn()
+            try:
+                # The backlog check and the insert are one statement, so
+                # concurrent appends can't overshoot the limit
+                inserted = db.execute(
+                    """
+                    INSERT INTO entries (kind, user_uid, category, candidate_id, created_at)
+                    SELECT ?, ?, ?, ?, ?
+                    WHERE (SELECT COUNT(*) FROM entries WHERE state = 'pending') < ?
+                    """,
+                    (kind, user_uid, category, candidate_id, time.time(), self.max_pending)
+                ).rowcount
+            except sqlite3.IntegrityError:
+                self.stats_counts["duplicates"] += 1
+                return ballot.DUPLICATE
+            if not inserted:
+                self.stats_counts["backlogged"] += 1
+                raise Backlogged(f"{self.max_pending} ballots are waiting to be written")
+            self.stats_counts["appended"] += 1
+        return ballot.RECORDED
+
+    def cast_vote(self, user_uid, candidate_type, candidate_id):
+        """Queued equivalent of ballot.cast_vote()"""
+        if candidate_type not in ballot.CANDIDATE_TABLES:
+            raise ValueError(f"Invalid candidate type: {candidate_type}")
+        candidate = catalog.get().find(candidate_type, candidate_id)
+        if candidate is None:
+            return ballot.UNKNOWN_CANDIDATE
+        return self.append("vote", user_uid, candidate_type, candidate.id)
+
+    # Draining
+
+    def _hold_lease(self, db):
+        """True if this process may drain the log, renewing its lease as needed"""
+        now = time.time()
+        if now < self._lease_until - LEASE_SECONDS / 2:
+            return True
+        taken = db.execute(
+            "UPDATE lease SET owner = ?, expires_at = ? WHERE id = 1 AND (owner = ? OR expires_at < ?)",
+            (os.getpid(), now + LEASE_SECONDS, os.getpid(), now)
+        ).rowcount == 1
+        self._lease_until = now + LEASE_SECONDS if taken else 0.0
+        return taken
+
+    def commit_batch(self):
+        """Write up to batch_size pending entries to the database; returns how many"""
+        with self._lock:
+            db = self._conn()
+            if not self._hold_lease(db):
+                return 0
+            rows = db.execute(
+                "SELECT seq, user_uid, category, candidate_id FROM entries "
+                "WHERE state = 'pending' ORDER BY seq LIMIT ?",
+                (self.batch_size,)
+            ).fetchall()
+        if not rows:
+            return 0
+        with storage.connection() as conn:
+            inserted = ballot.cast_votes(conn, [(uid, category, cid) for _, uid, category, cid in rows])
+        self.stats_counts["duplicates"] += len(rows) - inserted
+        with self._lock, metrics.query("ingest.mark"):
+            db = self._conn()
+            # One fsync for the whole batch
+            db.execute("BEGIN")
+            try:
+                db.executemany("UPDATE entries SET state = ? WHERE seq = ?", [(COMMITTED, seq) for seq, *_ in rows])
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        self.stats_counts["committed"] += len(rows)
+        self.stats_counts["batches"] += 1
+        return len(rows)
+
+    def drain(self, timeout=None):
+        """Commit batches until nothing is pending (or `timeout` seconds pass)"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        total = 0
+        while deadline is None or time.monotonic() < deadline:
+            committed = self.commit_batch()
+            if not committed:
+                break
+            total += committed
+        return total
+
+    def _commit_forever(self):
+        while True:
+            try:
+                while self.commit_batch() == self.batch_size:
+                    pass
+            except Exception as e:
+                print(f"Ingest commit failed, will retry: {e}")
+                time.sleep(RETRY_SECONDS)
+            # The lease holder polls often enough to keep ack-to-commit short
+            # (a burst fills the batch meanwhile); the others only watch for
+            # the lease to fall free
+            time.sleep(self.flush_seconds if self._lease_until else LEASE_SECONDS / 2)
+
+    def start_background_commit(self):
+        """Drain the log from a daemon thread in this process (idempotent)"""
+        if self._committer is not None and self._committer_pid == os.getpid():
+            return self._committer
+        with self._committer_lock:
+            if self._committer is None or self._committer_pid != os.getpid():
+                self._committer = threading.Thread(target=self._commit_forever, name="ingest-commit", daemon=True)
+                self._committer_pid = os.getpid()
+                self._lease_until = 0.0
+                self._committer.start()
+        return self._committer
+
+    def stats(self):
+        with self._lock:
+            db = self._conn()
+            pending = db.execute("SELECT COUNT(*) FROM entries WHERE state = 'pending'").fetchone()[0]
+            owner, expires_at = db.execute("SELECT owner, expires_at FROM lease WHERE id = 1").fetchone()
+        return {
+            "mode": mode(),
+            "pending": pending,
+            "committer": owner if expires_at > time.time() else None,
+            **self.stats_counts,
+        }
+
+
+_log = None
+_log_lock = threading.Lock()
+
+
+def get_log():
+    global _log
+    if _log is None:
+        with _log_lock:
+            if _log is None:
+                _log = IngestLog()
+    return _log
+
+
+def cast_vote(user_uid, candidate_type, candidate_id):
+    return get_log().cast_vote(user_uid, candidate_type, candidate_id)
+
+
+def start_background_commit():
+    """Start this worker's committer when VOTE_INGEST=queued (replays anything left pending)"""
+    if enabled():
+        return get_log().start_background_commit()
+
+
+def drain(timeout=None):
+    return get_log().drain(timeout)
+
+
+def stats():
+    return get_log().stats() if enabled() else {"mode": mode()}
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    log = get_log()
+    print(f"Drained {log.drain()} ballots from {log.path}")
+    print(log.stats())
@@ -0,0 +1,193 @@
+"""Ranked results for `/api/results`.
+
+Rankings live in memory per category and are refreshed at most every
+`REFRESH_SECONDS`: the new tallies are diffed against the last ones and only
+categories whose counts moved are re-ranked. When the live results stream
+is running its poller's counts are reused instead of reading the database.
+
+Each category's version is its total ballot count, which only goes up and
+is the same in every worker, so a client can send `?since=<version>` to any
+worker and get back just the entries that changed after that.
+"""
+import os
+import threading
+import time
+
+import catalog
+import repository
+import results_stream
+
+REFRESH_SECONDS = float(os.getenv("LEADERBOARD_REFRESH_SECONDS", 1.0))
+
+# category -> (tally source, tally category, catalog list)
+CATEGORIES = {
+    "king": ("votes", "king", "king"),
+    "queen": ("votes", "queen", "queen"),
+    "lantern": ("votes", "lantern", "lantern"),
+    "final_king": ("final_votes", "king", "final_king"),
+    "final_queen": ("final_votes", "queen", "final_queen"),
+}
+
+
+class Ranking:
+    """One category's standings"""
+
+    def __init__(self, category):
+        self.category = category
+        self.counts = {}
+        self.entries = []
+        self.total = 0
+        self.version = 0
+        self.catalog_version = None
+
+    def update(self, counts, candidates, catalog_version):
+        """Re-rank if the counts or the candidate list changed; returns True if so"""
+        if counts == self.counts and catalog_version == self.catalog_version:
+            return False
+        total = sum(counts.values())
+        if total < self.total and catalog_version == self.catalog_version:
+            # Ballots are never removed: this read came from a replica
+            # further behind than the last one
+            return False
+
+        previous = {entry["id"]: entry for entry in self.entries}
+        ordered = sorted(candidates, key=lambda c: (-counts.get(c.id, 0), c.name))
+
+        entries = []
+        for position, candidate in enumerate(ordered):
+            votes = counts.get(candidate.id, 0)
+            # Ties share a rank (1, 1, 3)
+            if entries and entries[-1]["votes"] == votes:
+                rank = entries[-1]["rank"]
+            else:
+                rank = position + 1
+            old = previous.get(candidate.id)
+            entry = {
+                "rank": rank,
+                # Places gained (negative: lost) when this entry last moved
+                "rank_change": old["rank"] - rank if old else 0,
+                "id": candidate.id,
+                "name": candidate.name,
+                "batch": candidate.batch,
+                "votes": votes,
+                "pct": round(100 * votes / total, 1) if total else 0.0,
+                "changed_at": total,
+            }
+            if old and (old["votes"], old["rank"]) == (votes, rank):
+                entry["rank_change"] = old["rank_change"]
+                entry["changed_at"] = old["changed_at"]
+            entries.append(entry)
+
+        self.counts = dict(counts)
+        self.entries = entries
+        self.total = total
+        self.version = total
+        self.catalog_version = catalog_version
+        return True
+
+    def view(self, limit=None, since=None):
+        entries = self.entries if limit is None else self.entries[:limit]
+        if since is not None:
+            entries = [entry for entry in entries if entry["changed_at"] > since]
+        return {
+            "category": self.category,
+            "version": self.version,
+            "total": self.total,
+            "changed": since is None or bool(entries),
+            "entries": [{k: v for k, v in entry.items() if k != "changed_at"} for entry in entries],
+        }
+
+
+class Leaderboard:
+    def __init__(self, refresh_seconds=REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self.rankings = {category: Ranking(category) for category in CATEGORIES}
+        self.refreshed_at = None
+        self.reranks = 0
+        # Every write made before this time.time() is in the standings
+        self.fresh_as_of = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+
+    def _read_counts(self, fresh_since=None):
+        live = None if fresh_since else results_stream.latest(max_age=self.refresh_seconds)
+        if live is not None:
+            return {
+                source: {category: {int(i): n for i, n in ids.items()} for category, ids in categories.items()}
+                for source, categories in live.items()
+            }
+        return repository.tally(*sorted({source for source, _, _ in CATEGORIES.values()}), fresh_since=fresh_since)
+
+    def refresh(self, fresh_since=None):
+        """Read the current tallies and re-rank the categories that moved"""
+        snapshot = catalog.get()
+        counts = self._read_counts(fresh_since)
+        with self._lock:
+            for category, (source, tally_category, list_name) in CATEGORIES.items():
+                changed = self.rankings[category].update(
+                    counts.get(source, {}).get(tally_category, {}),
+                    snapshot.lists[list_name],
+                    snapshot.version,
+                )
+                self.reranks += changed
+            self.refreshed_at = time.monotonic()
+            if fresh_since:
+                self.fresh_as_of = max(self.fresh_as_of, fresh_since)
+
+    def _maybe_refresh(self, fresh_since=None):
+        refreshed_at = self.refreshed_at
+        if fresh_since and fresh_since > self.fresh_as_of:
+            # The caller's own vote has to show: refresh now, after any refresh under way
+            with self._refreshing:
+                try:
+                    if fresh_since > self.fresh_as_of:
+                        self.refresh(fresh_since)
+                except Exception as e:
+                    if refreshed_at is None:
+                        raise
+                    print(f"Leaderboard refresh failed: {e}")
+            return
+        if refreshed_at is not None and time.monotonic() - refreshed_at < self.refresh_seconds:
+            return
+        # One request refreshes; the rest serve the current standings
+        if not self._refreshing.acquire(blocking=refreshed_at is None):
+            return
+        try:
+            if self.refreshed_at == refreshed_at:
+                self.refresh()
+        except Exception as e:
+            if refreshed_at is None:
+                raise
+            # Keep serving the last standings until the database is back,
+            # trying again once per refresh interval rather than per request
+            self.refreshed_at = time.monotonic()
+            print(f"Leaderboard refresh failed: {e}")
+        finally:
+            self._refreshing.release()
+
+    def get(self, category, limit=None, since=None, fresh_since=None):
+        """Standings for one category as a JSON-ready dict; KeyError if unknown.
+
+        `fresh_since` is the time of the caller's last vote, which the
+        standings then include.
+        """
+        ranking = self.rankings[category]
+        self._maybe_refresh(fresh_since)
+        with self._lock:
+            return ranking.view(limit, since)
+
+    def get_all(self, limit=None, since=None, fresh_since=None):
+        self._maybe_refresh(fresh_since)
+        with self._lock:
+            return {category: ranking.view(limit, since) for category, ranking in self.rankings.items()}
+
+
+_leaderboard = Leaderboard()
+
+
+def get(category, limit=None, since=None, fresh_since=None):
+    return _leaderboard.get(category, limit, since, fresh_since)
+
+
+def get_all(limit=None, since=None, fresh_since=None):
+    return _leaderboard.get_all(limit, since, fresh_since)
@@ -0,0 +1,338 @@
+"""Latency metrics for requests, queries, pool checkouts and template renders.
+
+Each worker keeps histograms in memory and writes a snapshot to
+METRICS_DIR (one JSON file per pid) every METRICS_FLUSH_SECONDS. `/metrics`
+merges every worker's file into one Prometheus text exposition, so a
+scrape sees the whole server whichever worker answers it. Without
+METRICS_DIR (the Flask dev server) only this process is reported.
+
+Queries are timed where they run, under a short label:
+
+    with metrics.query("vote.insert"):
+        cursor.execute(...)
+
+Requests slower than METRICS_SLOW_REQUEST_MS and queries slower than
+METRICS_SLOW_QUERY_MS are printed, requests with their DB / pool / render
+/ token check breakdown.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS_DIR = os.getenv("METRICS_DIR")
+FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", 5))
+SLOW_REQUEST_SECONDS = float(os.getenv("METRICS_SLOW_REQUEST_MS", 1000)) / 1000
+SLOW_QUERY_SECONDS = float(os.getenv("METRICS_SLOW_QUERY_MS", 200)) / 1000
+
+
+class Histogram:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * len(BUCKETS) + [0.0, 0]
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += seconds
+            series[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(values), list(series)] for values, series in self._series.items()]
+
+
+class Gauge:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def add(self, amount, *label_values):
+        with self._lock:
+            self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(values), value] for values, value in self._series.items()]
+
+
+class Counter(Gauge):
+    """Like a Gauge, but a dead worker's count still counts"""
+
+
+HTTP_REQUESTS = Histogram(
+    "voting_http_request_duration_seconds", "Time to build the response, by route, method and status",
+    ("route", "method", "status"))
+IN_FLIGHT = Gauge("voting_http_requests_in_flight", "Requests being handled right now, by route", ("route",))
+DB_QUERIES = Histogram("voting_db_query_duration_seconds", "Database statements by query label", ("query",))
+DB_ACQUIRE = Histogram("voting_db_acquire_duration_seconds", "Time to check a connection out of the pool")
+RENDERS = Histogram("voting_template_render_duration_seconds", "Jinja render time by template", ("template",))
+TOKEN_CHECKS = Histogram("voting_token_verify_duration_seconds", "ID token verification time")
+SHED = Counter("voting_requests_shed_total", "Requests turned away before any work, by route and reason", ("route", "reason"))
+
+HISTOGRAMS = (HTTP_REQUESTS, DB_QUERIES, DB_ACQUIRE, RENDERS, TOKEN_CHECKS)
+GAUGES = (IN_FLIGHT,)
+COUNTERS = (SHED,)
+
+# Per-request breakdown for the slow request log; gthread runs each request
+# on one thread from start to finish
+_current = threading.local()
+
+
+def _charge(part, seconds):
+    breakdown = getattr(_current, "breakdown", None)
+    if breakdown is not None:
+        breakdown[part] = breakdown.get(part, 0.0) + seconds
+        if part == "db":
+            breakdown["queries"] = breakdown.get("queries", 0) + 1
+
+
+@contextmanager
+def query(label):
+    """Time one database statement (or a short group of them) under `label`"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        DB_QUERIES.observe(elapsed, label)
+        _charge("db", elapsed)
+        if elapsed >= SLOW_QUERY_SECONDS:
+            print(f"Slow query {label}: {elapsed * 1000:.0f}ms")
+
+
+def observe_acquire(seconds):
+    DB_ACQUIRE.observe(seconds)
+    _charge("acquire", seconds)
+
+
+@contextmanager
+def token_check():
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        TOKEN_CHECKS.observe(elapsed)
+        _charge("verify", elapsed)
+
+
+# Cross-worker aggregation
+
+def _snapshot():
+    return {
+        "pid": os.getpid(),
+        "histograms": {h.name: h.snapshot() for h in HISTOGRAMS},
+        "gauges": {g.name: g.snapshot() for g in GAUGES},
+        "counters": {c.name: c.snapshot() for c in COUNTERS},
+    }
+
+
+def flush():
+    """Write this worker's snapshot to METRICS_DIR"""
+    if not METRICS_DIR:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as file:
+        json.dump(_snapshot(), file)
+    os.replace(tmp, path)
+
+
+def clear():
+    """Remove snapshots from a previous server run (called by the gunicorn master)"""
+    if not METRICS_DIR or not os.path.isdir(METRICS_DIR):
+        return
+    for name in os.listdir(METRICS_DIR):
+        if name.endswith(".json") or name.endswith(".tmp"):
+            os.remove(os.path.join(METRICS_DIR, name))
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _snapshots():
+    if not METRICS_DIR:
+        return [_snapshot()]
+    flush()
+    snapshots = []
+    for name in os.listdir(METRICS_DIR):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, name), encoding="utf-8") as file:
+                snapshots.append(json.load(file))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def _merge(snapshots):
+    histograms = {h.name: {} for h in HISTOGRAMS}
+    gauges = {g.name: {} for g in GAUGES}
+    counters = {c.name: {} for c in COUNTERS}
+    for snapshot in snapshots:
+        # A dead worker's totals still count; its in-flight requests don't
+        live = snapshot["pid"] == os.getpid() or _alive(snapshot["pid"])
+        for name, series_list in snapshot["histograms"].items():
+            merged = histograms.setdefault(name, {})
+            for values, series in series_list:
+                into = merged.setdefault(tuple(values), [0] * len(series))
+                for i, n in enumerate(series):
+                    into[i] += n
+        for name, series_list in snapshot.get("counters", {}).items():
+            merged = counters.setdefault(name, {})
+            for values, value in series_list:
+                merged[tuple(values)] = merged.get(tuple(values), 0) + value
+        if live:
+            for name, series_list in snapshot["gauges"].items():
+                merged = gauges.setdefault(name, {})
+                for values, value in series_list:
+                    merged[tuple(values)] = merged.get(tuple(values), 0) + value
+    return histograms, gauges, counters
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def _labels(names, values, le=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def render():
+    """Prometheus text exposition for every worker"""
+    histograms, gauges, counters = _merge(_snapshots())
+    lines = []
+    for h in HISTOGRAMS:
+        lines.append(f"# HELP {h.name} {h.help}")
+        lines.append(f"# TYPE {h.name} histogram")
+        for values, series in sorted(histograms.get(h.name, {}).items()):
+            cumulative = 0
+            for bound, n in zip(BUCKETS, series):
+                cumulative += n
+                lines.append(f"{h.name}_bucket{_labels(h.labels, values, bound)} {cumulative}")
+            lines.append(f"{h.name}_bucket{_labels(h.labels, values, '+Inf')} {series[-1]}")
+            lines.append(f"{h.name}_sum{_labels(h.labels, values)} {series[-2]:.6f}")
+            lines.append(f"{h.name}_count{_labels(h.labels, values)} {series[-1]}")
+    for g in GAUGES:
+        lines.append(f"# HELP {g.name} {g.help}")
+        lines.append(f"# TYPE {g.name} gauge")
+        for values, value in sorted(gauges.get(g.name, {}).items()):
+            lines.append(f"{g.name}{_labels(g.labels, values)} {value}")
+    for c in COUNTERS:
+        lines.append(f"# HELP {c.name} {c.help}")
+        lines.append(f"# TYPE {c.name} counter")
+        for values, value in sorted(counters.get(c.name, {}).items()):
+            lines.append(f"{c.name}{_labels(c.labels, values)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+_flusher = None
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def _flush_forever(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            flush()
+        except Exception as e:
+            print(f"Metrics flush failed: {e}")
+
+
+def start_background_flush(interval=FLUSH_SECONDS):
+    """Write this worker's snapshot every `interval` seconds (idempotent)"""
+    global _flusher, _flusher_pid
+    if not METRICS_DIR or (_flusher is not None and _flusher_pid == os.getpid()):
+        return _flusher
+    with _flusher_lock:
+        if _flusher is None or _flusher_pid != os.getpid():
+            _flusher = threading.Thread(target=_flush_forever, args=(interval,), name="metrics-flush", daemon=True)
+            _flusher_pid = os.getpid()
+            _flusher.start()
+    return _flusher
+
+
+# Flask wiring
+
+def init_app(app):
+    """Time every request and template render of `app`"""
+    from flask import before_render_template, request, template_rendered
+
+    @app.before_request
+    def _start_request():
+        start_background_flush()
+        _current.breakdown = {}
+        _current.renders = []
+        _current.start = time.perf_counter()
+        _current.route = request.url_rule.rule if request.url_rule else "unmatched"
+        IN_FLIGHT.add(1, _current.route)
+
+    @app.after_request
+    def _finish_request(response):
+        start = getattr(_current, "start", None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        HTTP_REQUESTS.observe(elapsed, _current.route, request.method, str(response.status_code))
+        if elapsed >= SLOW_REQUEST_SECONDS:
+            b = _current.breakdown
+            print(
+                f"Slow request {request.method} {request.path} -> {response.status_code} in {elapsed * 1000:.0f}ms "
+                f"(db {b.get('db', 0) * 1000:.0f}ms over {b.get('queries', 0)} queries, "
+                f"pool wait {b.get('acquire', 0) * 1000:.0f}ms, render {b.get('render', 0) * 1000:.0f}ms, "
+                f"token check {b.get('verify', 0) * 1000:.0f}ms)"
+            )
+        return response
+
+    @app.teardown_request
+    def _end_request(exc):
+        start = getattr(_current, "start", None)
+        if start is None:
+            return
+        IN_FLIGHT.add(-1, _current.route)
+        _current.start = None
+        _current.breakdown = None
+
+    def _before_render(sender, template, context, **extra):
+        renders = getattr(_current, "renders", None)
+        if renders is not None:
+            renders.append(time.perf_counter())
+
+    def _after_render(sender, template, context, **extra):
+        renders = getattr(_current, "renders", None)
+        if renders:
+            elapsed = time.perf_counter() - renders.pop()
+            RENDERS.observe(elapsed, template.name or "string")
+            _charge("render", elapsed)
+
+    before_render_template.connect(_before_render, app, weak=False)
+    template_rendered.connect(_after_render, app, weak=False)
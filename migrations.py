@@ -0,0 +1,348 @@
+"""Versioned schema migrations.
+
+The schema_version table records every migration applied, so a boot
+against a current database costs one `SELECT MAX(version)` and nothing
+else. Pending migrations run in order under a named lock, so two
+processes starting together don't both apply them. Each one's version row
+is committed with its data changes, but MySQL commits DDL as it goes, so
+a migration that fails partway can leave some of its tables behind. Every
+migration therefore only creates what doesn't exist yet and only inserts
+what isn't there, and simply runs again on the next start:
+
+    python migrations.py            # apply anything pending
+    python migrations.py --status   # show applied and pending versions
+
+To change the schema, append a migration to MIGRATIONS; never edit one
+that has shipped. Each migration spells out its own DDL rather than
+calling into the modules that use the tables, so changing those modules
+can't change what an old migration creates. Databases created by the old `init_database()` have no
+schema_version table: migration 1 only uses CREATE TABLE IF NOT EXISTS
+and migration 2 only seeds empty tables, so they are adopted as-is.
+"""
+import sys
+import time
+
+from mysql.connector import errors as mysql_errors
+
+import storage
+
+LOCK_NAME = "voting_schema_migrations"
+
+KINGS = [
+    ("Aung Min Khant", "HND-65", "Bio", "Kings/Aung Min Khant.png"),
+    ("Aung Khant Paing", "HND-65", "Vote Me", "Kings/Aung Khant Paing.png"),
+    ("Aung Thaw Hein", "HND-60", "Vote Me", "Kings/Aung Thaw Hein.png"),
+    ("Bo Bo Linn", "HND-65", "Vote Me", "Kings/Bo Bo Linn.jpg"),
+    ("Han Htoo Naung", "HND-60", "A yin lu htet po myan say ya ml", "Kings/Han Htoo Naung.jpg"),
+    ("Hein Lin Thaw", "HND-60", "လူမရှိလို့ ဝင်ပြိုင်တာ မရှိတဲ့ a shyak တွေလည်း ကုန်ပါပြီ", "Kings/Hein Lin Thaw.png"),
+    ("Htoo Aung Linn", "HND-69", "✨Ready to wear the crown 👑", "Kings/Htoo Aung Linn.png"),
+    ("Kaung Zaw Hein", "HND-57", "I Developed This Website, Vote ME or Get BANNED!", "Kings/Kaung Zaw Hein.jpg"),
+    ("Lin Latt Maung", "HND-52", "Love is crowned with cuteness 👑", "Kings/Lin Latt Maung.png"),
+    ("Lin Sat Naing", "HND-68", "Vote Me", "Kings/Lin Sat Naing.png"),
+    ("Min Thu Ta", "HND-65", "Vote Me", "Kings/Min Thu Ta.png"),
+    ("Naing Aung Khant", "HND-59", "Vote Me", "Kings/Naing Aung Khant.jpg"),
+    ("Nyan Lynn Htun", "HND-60", "Vote Me", "Kings/Nyan Lynn Htun.png"),
+    ("Tun Lin Aung", "HND-68", "Hated, Dated, Still Celebrated.", "Kings/Tun Lin Aung.png"),
+    ("Tun Win Aung", "HND-64", "Vote Me", "Kings/Tun Win Aung.png"),
+    ("Zin Htut Naing", "HND-65", "Vote Me", "Kings/Zin Htut Naing.png")
+]
+
+QUEENS = [
+    ("Aye Thu Aung", "HND-60", "Vote Me", "Queen/Aye Thu Aung.png"),
+    ("Ban Htoi Mai", "L3 Batch42", "Vote Me", "Queen/Ban Htoi Mai.png"),
+    ("Hla Wutt Hmone Oo", "HND-69", "Shinning Bright ✨", "Queen/Hla Wutt Hmone Oo.png"),
+    ("Hnin Oo Shwe Yie", "Level 3 B 41", "Vote Me", "Queen/Hnin Oo Shwe Yie.png"),
+    ("Hnin Thiri", "HND-68", "Taste like your sweetest dreams💭 💕", "Queen/Hnin Thiri.png"),
+    ("Hsu Wati Hnin", "HND-59", "Vote Me", "Queen/Hsu Wati Hnin.png"),
+    ("May Thu Lwin", "HND-8 Business", "💕 \"Brains, beauty, and a heart that shines 🌸\" 💕", "Queen/May Thu Lwin.png"),
+    ("Pan Myat Nadi", "Pre IGCse batch6", "Vote Me", "Queen/Ma Pan Myat Nadi.png"),
+    ("Pwint Phyu Soe", "HND-65", "Through pain, sadness, and loss, never give up 💕 Keep striving for your life’s best. I am cheering you on every step 🍀", "Queen/Pwint Phyu Soe.jpg"),
+    ("Shwe Phyo Wai", "HND-59", "Vote Me", "Queen/Shwe Phyo Wai.png"),
+    ("Thanzin Cho", "HND-69", "Progress, not perfection", "Queen/Thanzin Cho.png"),
+    ("Thet Htar Shwe Zin", "GUF-91", "A queen not only wears a crown but represents her people.", "Queen/Thet Htar Shwe Zin.png"),
+    ("Thet Myat Noe", "HND-64", "Your vibe attracts your tribe.", "Queen/Thet Myat Noe.png"),
+    ("Thiri Naing", "Level-3 Batch-38", "Vote Me", "Queen/Thiri Naing.png"),
+    ("Thoon Waddy", "HND-9 Business", "Vote Me", "Queen/Thoon Waddy.png"),
+    ("Thuu Thuu Han Wai", "HND-65", "Brown tones & soft vibes", "Queen/Thuu Thuu Han Wai.png"),
+    ("Zwe Sandar Htet", "HND-57", "Born to be a princess, destined to be a queen.", "Queen/Zwe Sandar Htet.png")
+]
+
+LANTERNS = [
+    ("Aurelia light", "GED-1", "a handmade soft pink lantern, inspired by the gentle beauty of the sea. Its ribbons and lights create a dreamy glow, symbolizing hope and creativity for the Thadingyut festival.", "Lantern/ged-1.jpg"),
+    ("ကြာပန်းမီးပုံလေး", "GUF-91", "ကျွန်မတို့သုငယ်ချက်းသုံးယောက်ကဘုရားကိုကပ်လှူချင်သောဆန္ဒကိုဦးတည်ကာတီထွင်ခဲ့ကြခြင်းဖြစ်ပါတယ်။", "Lantern/guf-91.jpg"),
+    ("'Water Lantern'", "GUF-92", "'May our Lantern Flow in the river with the light of hopes and carry our dream'", "Lantern/guf-92.jpg"),
+    ("'Fairybells of Moonlight' Lantern", "HND-6,7", "လမင်းရဲ့အလင်းကို ခေါင်းလောင်းပန်းလေးတစ်ပွင့်ထဲထည့်ထားသကဲ့သို့ ဖန်းတီးပေးထားပါတယ်ရှင့်", "Lantern/hnd-6,7.jpg"),
+    ("Lantern of Thadingyut", "HND-60", "မြန်မာ့ဓ‌လေ့နဲ့ သီတင်းကျွတ်‌နွေးထွေးမှုကို ပေါင်းစပ်ဖန်တီးထားတဲ့ မြန်မာ့သီတင်းကျွတ်မီးပုံးလး ပါရှင့်", "Lantern/hnd-60.jpg"),
+    ("ပဒုမ္မာဒီပ", "HND-65", "ကြာပန်းအလင်းက သန့်ရှင်းစင်ကြယ်တဲ့ အလင်းတရားကို သတိပေးနေတယ် လို့ ကိုယ်စားပြုပါတယ်", "Lantern/hnd-65.jpg"),
+    ("HND-69", "HND-69", "မီးပုံးလေးကို မီးဖွင့်ဖို့မမေ့ပါနဲ့ မှောင်နေတာလေးက မင်းမရှိတဲ့ ဘဝနဲ့တူလို့ပါ ကိုရယ်", "Lantern/hnd-69.jpg"),
+    ("Floral", "LV3-B39", "Floral Elegance for every occasion", "Lantern/lv3-b39.jpg"),
+    ("The Beauty of nature", "LV3-B42", "နွံထဲကနေတိုးထွက်ပြီးပွင့်ဖူးရတာတောင် ညစ်ပေကျံမနေဘဲ အလှပဆုံးပွင့်လန်းကြတာကြောင့်ဖြစ်ပါတယ်ရှင့်", "Lantern/lv3-b42.jpg"),
+    ("luminous lantern", "PreIG-B5", "နှစ်ပါးပေါင်းသွားတဲ့ မီးပုံးအလင်းတွေက လူ့စိတ်ထဲမှာရှိတဲ့ အမှောင်တိမ်တွေကို ဖယ်ရှားပေးသလို သီတင်းကျွတ်ညကို မေတ္တာနဲ့ ငြိမ်းချမ်းမှုအလင်းဖြင့် အလှဆင်ပေးနေပါတယ်", "Lantern/preIG-b5.jpg")
+]
+
+
+def create_schema(cursor, backend):
+    """Every table the app uses"""
+    # Kings table
+    backend.create_table(cursor, "kings", f"""
+        id {backend.auto_id},
+        name VARCHAR(100) NOT NULL,
+        batch VARCHAR(50),
+        bio TEXT,
+        image_path VARCHAR(200),
+        vote_count INT DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    """)
+
+    # Queens table
+    backend.create_table(cursor, "queens", f"""
+        id {backend.auto_id},
+        name VARCHAR(100) NOT NULL,
+        batch VARCHAR(50),
+        bio TEXT,
+        image_path VARCHAR(200),
+        vote_count INT DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    """)
+
+    # Votes table
+    backend.create_table(cursor, "votes", f"""
+        id {backend.auto_id},
+        user_uid VARCHAR(128) NOT NULL,
+        candidate_type {backend.enum('king', 'queen', 'lantern')} NOT NULL,
+        candidate_id INT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    """, unique=[("unique_vote", "user_uid, candidate_type")])
+
+    # Lanterns table
+    backend.create_table(cursor, "lanterns", f"""
+        id {backend.auto_id},
+        name VARCHAR(100) NOT NULL,
+        batch VARCHAR(50),
+        description TEXT,
+        image_path VARCHAR(200),
+        vote_count INT DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    """)
+
+    # Final round tables
+    backend.create_table(cursor, "final_kings", f"""
+        id {backend.auto_id},
+        name VARCHAR(100) NOT NULL,
+        batch VARCHAR(50),
+        bio TEXT,
+        image_path VARCHAR(200),
+        vote_count INT DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    """)
+
+    backend.create_table(cursor, "final_queens", f"""
+        id {backend.auto_id},
+        name VARCHAR(100) NOT NULL,
+        batch VARCHAR(50),
+        bio TEXT,
+        image_path VARCHAR(200),
+        vote_count INT DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    """)
+
+    # Final round tokens (see templates/notes.txt)
+    backend.create_table(cursor, "final_tokens", f"""
+        id {backend.auto_id},
+        token VARCHAR(64){backend.nocase} NOT NULL UNIQUE,
+        used_for_king TINYINT(1) DEFAULT 0,
+        candidate_king INT,
+        used_by_king VARCHAR(128),
+        used_at_king TIMESTAMP NULL,
+        used_for_queen TINYINT(1) DEFAULT 0,
+        candidate_queen INT,
+        used_by_queen VARCHAR(128),
+        used_at_queen TIMESTAMP NULL,
+        used_for_lantern TINYINT(1) DEFAULT 0,
+        candidate_lantern INT,
+        used_by_lantern VARCHAR(128),
+        used_at_lantern TIMESTAMP NULL,
+        used_for_reward TINYINT(1) DEFAULT 0,
+        used_by_reward VARCHAR(128),
+        used_at_reward TIMESTAMP NULL,
+        reward_value VARCHAR(20)
+    """)
+
+    backend.create_table(cursor, "final_votes", f"""
+        id {backend.auto_id},
+        token VARCHAR(64){backend.nocase} NOT NULL,
+        category {backend.enum('king', 'queen', 'lantern', 'reward')} NOT NULL,
+        candidate_id INT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    """, keys=[("idx_final_votes_token", "token")])
+
+    # Rolled-up vote totals (tally.py)
+    backend.create_table(cursor, "vote_tallies", """
+        source VARCHAR(20) NOT NULL,
+        category VARCHAR(20) NOT NULL,
+        candidate_id INT NOT NULL,
+        total INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (source, category, candidate_id)
+    """)
+    backend.create_table(cursor, "tally_watermarks", f"""
+        source VARCHAR(20) PRIMARY KEY,
+        last_id INT NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP{backend.on_update_now}
+    """)
+    cursor.execute(f"{backend.insert_ignore} INTO tally_watermarks (source) VALUES ('votes'), ('final_votes')")
+
+
+def seed_candidates(cursor, backend):
+    """The event's candidates, in any candidate table that is still empty"""
+    for table, about, rows in (("kings", "bio", KINGS), ("queens", "bio", QUEENS), ("lanterns", "description", LANTERNS)):
+        cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        if cursor.fetchone()[0] == 0:
+            cursor.executemany(f"""
+                INSERT INTO {table} (name, batch, {about}, image_path)
+                VALUES (%s, %s, %s, %s)
+            """, rows)
+
+
+# The final round's finalists (final.html listed them by hand before
+# finalists.py read them from the database)
+FINAL_KINGS = ("Bo Bo Linn", "Htoo Aung Linn", "Lin Latt Maung", "Naing Aung Khant", "Tun Lin Aung")
+FINAL_QUEENS = ("Hnin Oo Shwe Yie", "Hnin Thiri", "May Thu Lwin", "Thanzin Cho", "Thet Htar Shwe Zin")
+
+
+def seed_finalists(cursor, backend):
+    """The event's finalists, in final_kings / final_queens if still empty"""
+    for table, rows, names in (("final_kings", KINGS, FINAL_KINGS), ("final_queens", QUEENS, FINAL_QUEENS)):
+        cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        if cursor.fetchone()[0] == 0:
+            cursor.executemany(f"""
+                INSERT INTO {table} (name, batch, bio, image_path)
+                VALUES (%s, %s, %s, %s)
+            """, [row for row in rows if row[0] in names])
+
+
+def create_reconcile_tables(cursor, backend):
+    """Running totals and watermarks for reconcile.py"""
+    backend.create_table(cursor, "reconcile_counts", """
+        source VARCHAR(20) NOT NULL,
+        category VARCHAR(20) NOT NULL,
+        candidate_id INT NOT NULL,
+        total INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (source, category, candidate_id)
+    """)
+    backend.create_table(cursor, "reconcile_watermarks", """
+        source VARCHAR(20) PRIMARY KEY,
+        last_id INT NOT NULL DEFAULT 0,
+        checked_at TIMESTAMP NULL
+    """)
+    cursor.execute(f"{backend.insert_ignore} INTO reconcile_watermarks (source) VALUES ('votes'), ('final_votes')")
+
+
+def create_heartbeat_table(cursor, backend):
+    """Replication lag probe for replicas.py"""
+    backend.create_table(cursor, "replica_heartbeat", """
+        id INT PRIMARY KEY,
+        beat DOUBLE NOT NULL DEFAULT 0
+    """)
+    cursor.execute(f"{backend.insert_ignore} INTO replica_heartbeat (id) VALUES (1)")
+
+
+def create_claim_watermark(cursor, backend):
+    """Let reconcile.py check only the final-round claims made since its last pass"""
+    for category in ("king", "queen", "lantern", "reward"):
+        backend.create_index(cursor, "final_tokens", f"idx_final_tokens_used_at_{category}", f"used_at_{category}")
+    cursor.execute(f"{backend.insert_ignore} INTO reconcile_watermarks (source) VALUES ('final_tokens')")
+
+
+# (version, name, apply(cursor, backend)); append only
+MIGRATIONS = [
+    (1, "initial schema", create_schema),
+    (2, "seed candidates", seed_candidates),
+    (3, "reconcile state", create_reconcile_tables),
+    (4, "replica heartbeat", create_heartbeat_table),
+    (5, "token claim watermark", create_claim_watermark),
+    (6, "seed finalists", seed_finalists),
+]
+
+
+def latest_version():
+    return MIGRATIONS[-1][0]
+
+
+def _create_version_table(cursor, backend):
+    backend.create_table(cursor, "schema_version", """
+        version INT PRIMARY KEY,
+        name VARCHAR(100) NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    """)
+
+
+def current_version(cursor):
+    """Highest applied version (0 if none), or None before schema_version exists"""
+    try:
+        cursor.execute("SELECT MAX(version) FROM schema_version")
+    except mysql_errors.DatabaseError:
+        return None
+    return cursor.fetchone()[0] or 0
+
+
+def migrate(conn=None):
+    """Apply pending migrations; returns how many ran (0 when already current)"""
+    if conn is None:
+        with storage.connection() as conn:
+            return migrate(conn)
+    backend = storage.get_backend()
+    cursor = conn.cursor()
+    try:
+        version = current_version(cursor)
+        if version is not None and version >= latest_version():
+            return 0
+        applied = 0
+        with backend.exclusive(conn, LOCK_NAME):
+            if version is None:
+                _create_version_table(cursor, backend)
+            for number, name, apply in MIGRATIONS:
+                start = time.perf_counter()
+                conn.start_transaction()
+                try:
+                    # Another process may have applied it while we waited
+                    if current_version(cursor) >= number:
+                        conn.rollback()
+                        continue
+                    apply(cursor, backend)
+                    cursor.execute("INSERT INTO schema_version (version, name) VALUES (%s, %s)", (number, name))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                applied += 1
+                print(f"Applied migration {number} ({name}) in {(time.perf_counter() - start) * 1000:.0f}ms")
+        return applied
+    finally:
+        cursor.close()
+
+
+def status(conn=None):
+    """[(version, name, applied_at or None)] for every migration"""
+    if conn is None:
+        with storage.connection() as conn:
+            return status(conn)
+    cursor = conn.cursor()
+    try:
+        applied = {}
+        if current_version(cursor) is not None:
+            cursor.execute("SELECT version, applied_at FROM schema_version")
+            applied = dict(cursor.fetchall())
+    finally:
+        cursor.close()
+    return [(number, name, applied.get(number)) for number, name, _ in MIGRATIONS]
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    if "--status" in sys.argv[1:]:
+        for number, name, applied_at in status():
+            print(f"{number:>4}  {name:<30} {applied_at or 'pending'}")
+    else:
+        applied = migrate()
+        print(f"Applied {applied} migrations; schema is at version {latest_version()}")
@@ -0,0 +1,108 @@
+"""Rendered-page cache for routes whose HTML doesn't change per request.
+
+Each page is rendered once, stored with a gzipped copy and a strong ETag,
+and served from memory until its template file changes on disk. Clients
+that send a matching `If-None-Match` get a 304 with no body.
+
+Pages that show a few session values (e.g. the welcome line on the home
+page) name them in `vary`; one copy is kept per distinct set of values.
+Pages built from data that can change (e.g. the finalists manifest on
+`/final`) pass it as `context` along with its `version`, and are rendered
+again when the version changes.
+"""
+import gzip
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response, render_template, request, session
+
+
+class _Page:
+    __slots__ = ("body", "gzipped", "etag")
+
+    def __init__(self, body):
+        self.body = body
+        self.gzipped = gzip.compress(body, compresslevel=9, mtime=0)
+        self.etag = hashlib.sha256(body).hexdigest()[:20]
+
+
+class PageCache:
+    def __init__(self, app=None, max_entries=512, check_interval=1.0):
+        self.enabled = os.getenv("PAGE_CACHE", "1") != "0"
+        self.max_entries = max_entries
+        self.check_interval = check_interval
+        self._pages = OrderedDict()
+        self._mtimes = {}
+        self._lock = threading.Lock()
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.template_folder = os.path.join(app.root_path, app.template_folder)
+
+    def _check_template(self, template):
+        """Drop cached copies of `template` if the file changed since last look"""
+        now = time.monotonic()
+        seen = self._mtimes.get(template)
+        if seen is not None and now - seen[1] < self.check_interval:
+            return
+        try:
+            mtime = os.stat(os.path.join(self.template_folder, template)).st_mtime_ns
+        except OSError:
+            mtime = None
+        with self._lock:
+            if seen is not None and seen[0] != mtime:
+                for key in [key for key in self._pages if key[0] == template]:
+                    del self._pages[key]
+                # Flask only reloads templates in debug mode
+                if self.app.jinja_env.cache is not None:
+                    self.app.jinja_env.cache.clear()
+            self._mtimes[template] = (mtime, now)
+
+    def _page(self, template, vary, version=None, context=None):
+        key = (template, version) + tuple(session.get(name) for name in vary)
+        self._check_template(template)
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+                return page
+        page = _Page(render_template(template, **(context or {})).encode("utf-8"))
+        with self._lock:
+            self._pages[key] = page
+            while len(self._pages) > self.max_entries:
+                self._pages.popitem(last=False)
+        return page
+
+    def response(self, template, vary=(), private=False, version=None, context=None):
+        """Serve `template` from the cache (rendering it on first use)"""
+        if not self.enabled:
+            return render_template(template, **(context or {}))
+
+        page = self._page(template, vary, version, context)
+        use_gzip = request.accept_encodings["gzip"] > 0
+        etag = page.etag + ("-gz" if use_gzip else "")
+
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(page.gzipped if use_gzip else page.body, mimetype="text/html")
+            if use_gzip:
+                response.headers["Content-Encoding"] = "gzip"
+
+        response.set_etag(etag)
+        scope = "private" if private or vary else "public"
+        response.headers["Cache-Control"] = f"{scope}, max-age=0, must-revalidate"
+        response.vary.add("Accept-Encoding")
+        if vary or private:
+            response.vary.add("Cookie")
+        return response
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
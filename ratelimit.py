@@ -0,0 +1,251 @@
+"""Per-client rate limits and load shedding for the ballot and token routes.
+
+Each guarded route has a token bucket per signed-in uid, and optionally
+one per client IP. A request takes a token from each of its buckets, or
+from none of them: it is turned away with 429 and a Retry-After of when
+the next token is due, without spending the budget it did have.
+
+The IP budgets are off by default. At the venue every phone is behind the
+same NAT address, and over a thousand voters claiming their final-round
+tokens within minutes would look like one client. Turn one on only for a
+route that isn't used from a shared network, or with a budget sized for
+the whole venue.
+
+Buckets live in a small SQLite file on tmpfs (RATE_LIMIT_PATH, set by
+gunicorn.conf.py), so every worker on the host draws from the same ones;
+without it, as under the Flask dev server, each process keeps its own.
+
+Past the rate limits, each worker admits at most SHED_MAX_INFLIGHT guarded
+requests at once (default twice the DB pool size). The cap is per worker
+process, not per host: with 2 workers the host takes twice as many.
+Beyond that a request would only queue for a database connection, so it
+gets a 503 at once instead. Both checks run before the route touches the
+database, and everything turned away is counted in
+`voting_requests_shed_total`.
+
+Budgets are "capacity/seconds": a client can burst `capacity` requests,
+then gets capacity per `seconds`. Override per route, user budget then
+the optional IP budget, as RATE_LIMIT_<ROUTE>:
+
+    RATE_LIMIT_FINAL_VOTE="8/60"              # per user only, as by default
+    RATE_LIMIT_REWARD_CLAIM="5/60,3000/60"    # and at most 3000 a minute per IP
+    RATE_LIMIT=0                              # no rate limits (load shedding stays on)
+"""
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+
+# route -> (per-user budget, per-IP budget or None for none)
+BUDGETS = {
+    "vote": ("6/60", None),
+    "vote_lantern": ("6/60", None),
+    "final_vote": ("8/60", None),
+    "reward_claim": ("5/60", None),
+}
+
+# Buckets idle this long are full again and can be forgotten
+IDLE_SECONDS = 3600
+OVERLOAD_RETRY_SECONDS = 1
+
+
+class Shed(Exception):
+    """A request turned away before doing any work"""
+
+    status = 503
+    reason = "overload"
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+class RateLimited(Shed):
+    status = 429
+
+    def __init__(self, message, retry_after, reason):
+        super().__init__(message, retry_after)
+        self.reason = reason
+
+
+def enabled():
+    return os.getenv("RATE_LIMIT", "1").lower() not in ("0", "false", "no")
+
+
+def _parse(budget):
+    if budget is None or budget.strip().lower() in ("", "0", "off", "none"):
+        return None
+    capacity, seconds = budget.split("/")
+    return float(capacity), float(capacity) / float(seconds)
+
+
+def budgets(route):
+    """((user capacity, refill per second), (IP capacity, refill per second) or None) for `route`"""
+    spec = os.getenv(f"RATE_LIMIT_{route.upper()}")
+    user, ip = (spec.split(",") + [None])[:2] if spec else BUDGETS[route]
+    return _parse(user), _parse(ip)
+
+
+class BucketStore:
+    """Token buckets in a SQLite file shared by the workers (or in memory)"""
+
+    def __init__(self, path=None):
+        self.path = path if path is not None else os.getenv("RATE_LIMIT_PATH", "")
+        self._db = None
+        self._db_pid = None
+        self._memory = {}
+        self._lock = threading.Lock()
+        self._takes = 0
+
+    def _conn(self):
+        if self._db is None or self._db_pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=0.5, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode = WAL")
+            # Losing buckets in a crash only forgives a few requests
+            db.execute("PRAGMA synchronous = OFF")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL
+                ) WITHOUT ROWID
+            """)
+            self._db, self._db_pid = db, os.getpid()
+        return self._db
+
+    def take(self, key, capacity, rate, now=None):
+        """Take a token from `key`'s bucket: 0 if granted, else seconds until one is due"""
+        return self.take_all([(key, capacity, rate)], now)[0]
+
+    def take_all(self, buckets, now=None):
+        """Take a token from every (key, capacity, rate) bucket, or from none.
+
+        Returns the wait per bucket: all 0 if granted, otherwise nothing was
+        taken and each short bucket has the seconds until its next token.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            if not self.path:
+                return self._take_memory(buckets, now)
+            db = self._conn()
+            # One write transaction, so concurrent workers can't both spend
+            # the last token, and a denial leaves every bucket as it was
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                levels = []
+                for key, capacity, rate in buckets:
+                    row = db.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+                    levels.append(min(capacity, row[0] + (now - row[1]) * rate) if row else capacity)
+                waits = [0 if tokens >= 1 else (1 - tokens) / rate for tokens, (_, _, rate) in zip(levels, buckets)]
+                if not any(waits):
+                    db.executemany(
+                        "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                        [(key, tokens - 1, now) for tokens, (key, _, _) in zip(levels, buckets)]
+                    )
+                self._takes += 1
+                if self._takes % 1000 == 0:
+                    db.execute("DELETE FROM buckets WHERE updated < ?", (now - IDLE_SECONDS,))
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        return waits
+
+    def _take_memory(self, buckets, now):
+        levels = []
+        for key, capacity, rate in buckets:
+            tokens, updated = self._memory.get(key, (capacity, now))
+            levels.append(min(capacity, tokens + (now - updated) * rate))
+        waits = [0 if tokens >= 1 else (1 - tokens) / rate for tokens, (_, _, rate) in zip(levels, buckets)]
+        if not any(waits):
+            for tokens, (key, _, _) in zip(levels, buckets):
+                self._memory[key] = (tokens - 1, now)
+            if len(self._memory) > 100000:
+                self._memory = {k: v for k, v in self._memory.items() if v[1] > now - IDLE_SECONDS}
+        return waits
+
+
+class Limiter:
+    def __init__(self, store=None, max_inflight=None):
+        self.store = store or BucketStore()
+        self._max_inflight = max_inflight
+        self._inflight = 0
+        self._lock = threading.Lock()
+        self.stats_counts = {"admitted": 0, "rate_user": 0, "rate_ip": 0, "overload": 0, "limiter_errors": 0}
+
+    @property
+    def max_inflight(self):
+        if self._max_inflight is None:
+            import storage
+            configured = int(os.getenv("SHED_MAX_INFLIGHT", 0))
+            self._max_inflight = configured or 2 * storage.get_backend().get_pool().size
+        return self._max_inflight
+
+    def _shed(self, route, error):
+        self.stats_counts[error.reason] += 1
+        metrics.SHED.add(1, route, error.reason)
+        raise error
+
+    def check(self, route, uid, ip):
+        """Raise RateLimited if `uid` or `ip` is over `route`'s budget; spends from both or neither"""
+        if not enabled():
+            return
+        user_budget, ip_budget = budgets(route)
+        buckets, reasons = [], []
+        if uid and user_budget:
+            buckets.append((f"{route}:u:{uid}", *user_budget))
+            reasons.append(("rate_user", "Too many attempts. Please slow down."))
+        if ip and ip_budget:
+            buckets.append((f"{route}:ip:{ip}", *ip_budget))
+            reasons.append(("rate_ip", "Too many attempts from your network. Please slow down."))
+        if not buckets:
+            return
+        try:
+            waits = self.store.take_all(buckets)
+        except sqlite3.Error as e:
+            # A busy or broken bucket file must not take voting down with it
+            self.stats_counts["limiter_errors"] += 1
+            print(f"Rate limiter unavailable, letting request through: {e}")
+            return
+        for wait, (reason, message) in zip(waits, reasons):
+            if wait:
+                self._shed(route, RateLimited(message, wait, reason))
+
+    def admit(self, route):
+        """Claim an in-flight slot or raise Shed; pair with release()"""
+        with self._lock:
+            if self._inflight >= self.max_inflight:
+                full = True
+            else:
+                full = False
+                self._inflight += 1
+                self.stats_counts["admitted"] += 1
+        if full:
+            self._shed(route, Shed("Voting is very busy right now. Please try again in a moment.", OVERLOAD_RETRY_SECONDS))
+
+    def release(self):
+        with self._lock:
+            self._inflight -= 1
+
+    def stats(self):
+        return {"inflight": self._inflight, "max_inflight": self.max_inflight, "rate_limits": enabled(),
+                **self.stats_counts}
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = Limiter()
+    return _limiter
+
+
+def stats():
+    return get_limiter().stats()
@@ -0,0 +1,345 @@
+"""Reconcile the derived vote counters with the ballot rows.
+
+Three things are derived from the ballots and can drift from them: the
+rolled-up `vote_tallies` (tally.py), the `vote_count` column that the fold
+mirrors into kings/queens/lanterns/final_kings/final_queens (which older
+code also bumped directly), and the `used_for_*`/`candidate_*` columns of
+`final_tokens`, which should match `final_votes` one for one.
+
+Each pass keeps its own running totals in `reconcile_counts`, adding only
+the ballot rows past its watermark (one grouped SELECT per source table),
+and stops at the tally's watermark so both describe exactly the same
+rows. Then, inside one transaction, it reads each derived counter in a
+single grouped statement and diffs:
+
+    tally        reconcile_counts vs vote_tallies, per (source, category, candidate)
+    vote_count   reconcile_counts vs the candidate tables' vote_count
+    tokens       the final_votes rows the pass added, and the final_tokens
+                 claims made since the last pass (by used_at_*, with their
+                 own watermark), each against the other side, one for one
+
+With repair on, drifted tallies are rewritten from reconcile_counts and
+vote_count re-mirrored from them, in the same transaction. Token
+mismatches are only reported (with the tokens involved): which side is
+right needs a person.
+
+Workers run a pass every RECONCILE_INTERVAL seconds (default 60); only
+one worker's pass runs per interval. RECONCILE_REPAIR=1 lets those passes
+repair.
+
+    python reconcile.py            # report drift now
+    python reconcile.py --repair   # and fix tallies / vote_count
+    python reconcile.py --full     # recount from the first ballot
+"""
+import argparse
+import os
+import threading
+import time
+from collections import namedtuple
+
+import ballot
+import metrics
+import storage
+import tally
+
+INTERVAL = float(os.getenv("RECONCILE_INTERVAL", 60))
+REPAIR = os.getenv("RECONCILE_REPAIR", "0").lower() in ("1", "true", "yes")
+# Tokens listed per mismatched category in a report, for each direction
+DETAIL_LIMIT = 20
+# Ballots without a candidate (reward claims) are counted under this id
+NO_CANDIDATE = 0
+# One reconcile_watermarks row per ballot table, and one for token claims
+WATERMARKS = (*tally.SOURCES, "final_tokens")
+
+Drift = namedtuple("Drift", "check where category candidate_id expected actual")
+
+
+class Report:
+    def __init__(self):
+        self.checked_through = {}
+        self.drift = []
+        self.token_details = {}
+        self.repaired = False
+        self.skipped = False
+
+    def add(self, check, where, category, candidate_id, expected, actual):
+        self.drift.append(Drift(check, where, category, candidate_id, expected, actual))
+
+    def summary(self):
+        if self.skipped:
+            return "Reconcile skipped: another worker ran it within the interval"
+        through = ", ".join(f"{source} through id {last_id}" for source, last_id in self.checked_through.items())
+        if not self.drift:
+            return f"Reconcile: no drift ({through})"
+        lines = [f"Reconcile: {len(self.drift)} discrepancies ({through}){'; repaired' if self.repaired else ''}"]
+        for d in self.drift:
+            candidate = "-" if d.candidate_id == NO_CANDIDATE else d.candidate_id
+            lines.append(f"  {d.check:<10} {d.where:<13} {d.category:<8} candidate {candidate}: "
+                         f"expected {d.expected}, found {d.actual}")
+        for category, tokens in self.token_details.items():
+            lines.append(f"  {'tokens':<10} {category}: {', '.join(tokens)}")
+        return "\n".join(lines)
+
+
+def _advance(cursor, source, last_id, upper):
+    """Add ballot rows in (last_id, upper] to reconcile_counts in one grouped pass"""
+    column = tally.SOURCES[source]
+    with metrics.query(f"reconcile.{source}"):
+        cursor.execute(
+            f"""
+            SELECT {column}, COALESCE(candidate_id, {NO_CANDIDATE}), COUNT(*) FROM {source}
+            WHERE id > %s AND id <= %s
+            GROUP BY {column}, COALESCE(candidate_id, {NO_CANDIDATE})
+            """,
+            (last_id, upper)
+        )
+        groups = [(source, category, candidate_id, n) for category, candidate_id, n in cursor.fetchall()]
+    if groups:
+        cursor.executemany(
+            f"""
+            INSERT INTO reconcile_counts (source, category, candidate_id, total)
+            VALUES (%s, %s, %s, %s)
+            {storage.get_backend().add_on_conflict(("source", "category", "candidate_id"), "total")}
+            """,
+            groups
+        )
+    cursor.execute("UPDATE reconcile_watermarks SET last_id = %s, checked_at = CURRENT_TIMESTAMP WHERE source = %s",
+                   (upper, source))
+
+
+def _totals(cursor, sql, params=()):
+    cursor.execute(sql, params)
+    return {(category, candidate_id): int(n) for category, candidate_id, n in cursor.fetchall()}
+
+
+def _diff(report, check, where, expected, actual):
+    for key in sorted(set(expected) | set(actual), key=str):
+        if expected.get(key, 0) != actual.get(key, 0):
+            report.add(check, where, key[0], key[1], expected.get(key, 0), actual.get(key, 0))
+
+
+def _check_vote_counts(cursor, report, counts):
+    """vote_count of every candidate table vs the totals mirrored into it"""
+    expected = {}
+    for (source, category), table in tally.CANDIDATE_TABLES.items():
+        for (c, candidate_id), n in counts[source].items():
+            if c == category:
+                expected[(table, candidate_id)] = expected.get((table, candidate_id), 0) + n
+    tables = sorted(set(tally.CANDIDATE_TABLES.values()))
+    with metrics.query("reconcile.vote_count"):
+        actual = _totals(cursor, " UNION ALL ".join(
+            f"SELECT '{table}', id, COALESCE(vote_count, 0) FROM {table}" for table in tables
+        ))
+    drifted = set()
+    for key in sorted(set(expected) | set(actual), key=str):
+        if expected.get(key, 0) != actual.get(key, 0):
+            table, candidate_id = key
+            report.add("vote_count", table, "-", candidate_id, expected.get(key, 0), actual.get(key, 0))
+            drifted.add(table)
+    return drifted
+
+
+def _claim_check(category, since, select):
+    """Claims of `category` made in (since, settle time] that have no ballot row"""
+    lower = f"AND t.used_at_{category} > %s " if since is not None else ""
+    return f"""
+        SELECT {select} FROM final_tokens t
+        LEFT JOIN final_votes v ON v.token = t.token AND v.category = '{category}'
+        WHERE t.used_for_{category} = 1 {lower}
+          AND t.used_at_{category} <= {storage.get_backend().seconds_ago()} AND v.id IS NULL
+    """, ((since,) if since is not None else ()) + (tally.SETTLE_SECONDS,)
+
+
+def _ballot_check(select):
+    """final_votes rows in (%s, %s] without a matching claim, or with another row for the same claim"""
+    claimed = " ".join(
+        f"WHEN '{category}' THEN t.used_for_{category} = 1 AND t.candidate_{category} = v.candidate_id"
+        for category in ballot.FINAL_CANDIDATE_TABLES
+    )
+    return f"""
+        SELECT {select} FROM final_votes v
+        LEFT JOIN final_tokens t ON t.token = v.token
+        WHERE v.id > %s AND v.id <= %s AND (
+            COALESCE(CASE v.category {claimed} WHEN 'reward' THEN t.used_for_reward = 1 END, 0) = 0
+            OR EXISTS (SELECT 1 FROM final_votes w WHERE w.token = v.token AND w.category = v.category AND w.id < v.id)
+        )
+    """
+
+
+def _check_tokens(cursor, report, last_id, upper, since):
+    """Claims recorded in final_tokens vs final_votes rows, for what changed since the last pass.
+
+    Ballot rows are checked over the same id range as _advance() and
+    claims over their used_at_* timestamps, from the last pass up to
+    TALLY_SETTLE_SECONDS ago (a younger claim may still be writing its
+    ballot). Each mismatch is reported once, in the pass that covers it.
+    """
+    unclaimed_sql = _ballot_check(f"v.category, COALESCE(v.candidate_id, {NO_CANDIDATE}), COUNT(*)")
+    claims = []
+    for category in ballot.FINAL_CATEGORIES:
+        candidate = NO_CANDIDATE if category == "reward" else f"COALESCE(t.candidate_{category}, {NO_CANDIDATE})"
+        claims.append(_claim_check(category, since, f"'{category}', {candidate}, COUNT(*)"))
+    with metrics.query("reconcile.final_tokens"):
+        unclaimed = _totals(
+            cursor, unclaimed_sql + f" GROUP BY v.category, COALESCE(v.candidate_id, {NO_CANDIDATE})", (last_id, upper)
+        )
+        unrecorded = _totals(
+            cursor, " UNION ALL ".join(f"{sql} GROUP BY 1, 2" for sql, _ in claims),
+            [value for _, params in claims for value in params]
+        )
+        cursor.execute(f"UPDATE reconcile_watermarks SET checked_at = {storage.get_backend().seconds_ago()} "
+                       "WHERE source = 'final_tokens'", (tally.SETTLE_SECONDS,))
+    for (category, candidate_id), n in sorted(unrecorded.items(), key=str):
+        report.add("tokens", "final_votes", category, candidate_id, n, 0)
+    for (category, candidate_id), n in sorted(unclaimed.items(), key=str):
+        report.add("tokens", "final_tokens", category, candidate_id, n, 0)
+
+    for category in sorted({key[0] for key in unrecorded} | {key[0] for key in unclaimed}):
+        # Which tokens: claimed without a ballot row, and the other way round.
+        # Two queries, so a long list one way can't hide the other
+        sql, params = _claim_check(category, since, "t.token")
+        cursor.execute(f"{sql} LIMIT {DETAIL_LIMIT}", params)
+        tokens = [row[0] for row in cursor.fetchall()]
+        cursor.execute(f"{_ballot_check('v.token')} AND v.category = %s LIMIT {DETAIL_LIMIT}",
+                       (last_id, upper, category))
+        tokens += [row[0] for row in cursor.fetchall()]
+        report.token_details[category] = tokens
+
+
+def _repair(cursor, counts, drifted_sources, drifted_tables):
+    for source in sorted(drifted_sources):
+        cursor.execute("DELETE FROM vote_tallies WHERE source = %s", (source,))
+        rows = [(source, category, candidate_id, n) for (category, candidate_id), n in counts[source].items()
+                if candidate_id != NO_CANDIDATE]
+        if rows:
+            cursor.executemany(
+                "INSERT INTO vote_tallies (source, category, candidate_id, total) VALUES (%s, %s, %s, %s)", rows
+            )
+    for table in sorted(drifted_tables):
+        cursor.execute(f"UPDATE {table} SET vote_count = 0")
+    touched = {key for key, table in tally.CANDIDATE_TABLES.items() if table in drifted_tables}
+    # vote_tallies now agrees with reconcile_counts, so mirror it as the fold does
+    tally.mirror_vote_counts(cursor, touched)
+
+
+def reconcile(conn=None, repair=REPAIR, interval=None, full=False):
+    """Run one pass and return its Report.
+
+    With `interval`, the pass is skipped if any worker ran one less than
+    that many seconds ago.
+    """
+    if conn is None:
+        with storage.connection() as conn:
+            return reconcile(conn, repair, interval, full)
+    backend = storage.get_backend()
+    report = Report()
+    cursor = conn.cursor()
+    conn.start_transaction()
+    try:
+        if full:
+            cursor.execute("DELETE FROM reconcile_counts")
+            cursor.execute("UPDATE reconcile_watermarks SET last_id = 0, checked_at = NULL")
+        # Lock our watermarks; a worker already reconciling makes us skip
+        cursor.execute(
+            f"SELECT source, last_id, checked_at FROM reconcile_watermarks ORDER BY source{backend.skip_locked}"
+        )
+        watermarks = {source: (last_id, checked_at) for source, last_id, checked_at in cursor.fetchall()}
+        if set(watermarks) != set(WATERMARKS):
+            report.skipped = True
+            conn.rollback()
+            return report
+        if interval:
+            cursor.execute(
+                f"SELECT COUNT(*) FROM reconcile_watermarks WHERE checked_at > {backend.seconds_ago()}",
+                (max(int(interval) - 1, 0),)
+            )
+            if cursor.fetchone()[0]:
+                report.skipped = True
+                conn.rollback()
+                return report
+
+        cursor.execute("SELECT source, last_id FROM tally_watermarks")
+        tally_marks = dict(cursor.fetchall())
+
+        counts = {}
+        checked_from = {}
+        drifted_sources = set()
+        for source in tally.SOURCES:
+            last_id = watermarks[source][0]
+            upper = tally_marks.get(source, 0)
+            if upper < last_id:
+                # The tallies were rebuilt behind us; start over for this source
+                cursor.execute("DELETE FROM reconcile_counts WHERE source = %s", (source,))
+                last_id = 0
+            _advance(cursor, source, last_id, upper)
+            checked_from[source] = last_id
+            report.checked_through[source] = upper
+
+            counts[source] = _totals(
+                cursor, "SELECT category, candidate_id, total FROM reconcile_counts WHERE source = %s", (source,)
+            )
+            with metrics.query("reconcile.tallies"):
+                tallies = _totals(
+                    cursor, "SELECT category, candidate_id, total FROM vote_tallies WHERE source = %s", (source,)
+                )
+            expected = {key: n for key, n in counts[source].items() if key[1] != NO_CANDIDATE}
+            before = len(report.drift)
+            _diff(report, "tally", source, expected, tallies)
+            if len(report.drift) > before:
+                drifted_sources.add(source)
+
+        drifted_tables = _check_vote_counts(cursor, report, counts)
+        _check_tokens(cursor, report, checked_from["final_votes"], report.checked_through["final_votes"],
+                      watermarks["final_tokens"][1])
+
+        if repair and (drifted_sources or drifted_tables):
+            _repair(cursor, counts, drifted_sources, drifted_tables)
+            report.repaired = True
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return report
+
+
+_reconciler = None
+_reconciler_pid = None
+_reconciler_lock = threading.Lock()
+
+
+def _reconcile_forever(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            report = reconcile(interval=interval)
+            if report.drift:
+                print(report.summary())
+        except Exception as e:
+            print(f"Reconcile failed: {e}")
+
+
+def start_background_reconcile(interval=INTERVAL):
+    """Reconcile every `interval` seconds from a daemon thread (idempotent; 0 disables)"""
+    global _reconciler, _reconciler_pid
+    if interval <= 0 or (_reconciler is not None and _reconciler_pid == os.getpid()):
+        return _reconciler
+    with _reconciler_lock:
+        if _reconciler is None or _reconciler_pid != os.getpid():
+            _reconciler = threading.Thread(target=_reconcile_forever, args=(interval,), name="reconcile", daemon=True)
+            _reconciler_pid = os.getpid()
+            _reconciler.start()
+    return _reconciler
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repair", action="store_true", help="rewrite drifted tallies and vote_count")
+    parser.add_argument("--full", action="store_true", help="recount every ballot instead of resuming")
+    args = parser.parse_args()
+    result = reconcile(repair=args.repair, full=args.full)
+    print(result.summary())
+    raise SystemExit(1 if result.drift and not result.repaired else 0)
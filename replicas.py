@@ -0,0 +1,270 @@
+"""Read replicas for the read-mostly queries (catalog loads, tallies, exports).
+
+With DB_REPLICAS set, `storage.read_connection()` borrows a connection
+from one of the replicas instead of the primary, round-robin over those
+that are up and caught up. Writes, and anything that must see them at
+once (token redemption, the tally fold, ingest, reconcile), keep using
+`storage.connection()`, i.e. the primary.
+
+    DB_REPLICAS="mysql://reader:pw@replica-1:3306/voting,replica-2:3307"
+                                  comma-separated DSNs; anything left out
+                                  (user, password, port, database) is the
+                                  primary's DB_* setting
+    REPLICA_MAX_LAG=5             seconds behind the primary before a
+                                  replica is skipped
+    REPLICA_CHECK_SECONDS=1       heartbeat and health check interval
+    REPLICA_POOL_SIZE             connections per replica (default DB_POOL_SIZE)
+
+Lag is measured with a heartbeat rather than SHOW REPLICA STATUS (which
+needs extra privileges): every worker's checker writes the current time
+into `replica_heartbeat` on the primary and reads it back from each
+replica. A replica whose heartbeat is older than REPLICA_MAX_LAG, or that
+can't be reached, is skipped until a later check finds it healthy; with
+none left, reads go to the primary.
+
+The heartbeat also gives read-your-writes. A route that has just written
+for a user records the time in the session, and reads for that user pass
+it as `fresh_since`: only a replica whose heartbeat is at least that
+recent (so it has replayed the write) may serve them, otherwise the
+primary does. Heartbeats are wall-clock times from the workers, so hosts
+need synchronized clocks (NTP), as they do for TLS anyway.
+
+Only the MySQL backend has replicas; on SQLite every read uses the one file.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import unquote, urlsplit
+
+import mysql.connector
+
+import breaker
+import db_pool
+
+MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", 5))
+CHECK_SECONDS = float(os.getenv("REPLICA_CHECK_SECONDS", 1))
+# A replica that can't hand out a connection this fast is busy; the read goes to the primary
+CHECKOUT_TIMEOUT = 1.0
+
+
+def parse_dsn(dsn, defaults):
+    """mysql.connector kwargs for one DB_REPLICAS entry, filled in from `defaults`"""
+    dsn = dsn.strip()
+    if "://" not in dsn:
+        dsn = "mysql://" + dsn
+    parts = urlsplit(dsn)
+    if not parts.hostname:
+        raise ValueError(f"Replica DSN {dsn!r} has no host")
+    kwargs = dict(defaults)
+    kwargs["host"] = parts.hostname
+    if parts.port:
+        kwargs["port"] = parts.port
+    if parts.username:
+        kwargs["user"] = unquote(parts.username)
+    if parts.password:
+        kwargs["password"] = unquote(parts.password)
+    if parts.path.strip("/"):
+        kwargs["database"] = parts.path.strip("/")
+    return kwargs
+
+
+def configured():
+    return [dsn for dsn in os.getenv("DB_REPLICAS", "").split(",") if dsn.strip()]
+
+
+class Replica:
+    def __init__(self, kwargs):
+        self.name = f"{kwargs['host']}:{kwargs.get('port') or 3306}"
+        self.kwargs = kwargs
+        self.healthy = False
+        self.beat = None
+        self.error = None
+        self.reads = 0
+        self._pool = None
+        self._pool_pid = None
+
+    def pool(self):
+        if self._pool is None or self._pool_pid != os.getpid():
+            settings = db_pool.pool_settings()
+            settings.update(size=int(os.getenv("REPLICA_POOL_SIZE", settings["size"])), timeout=CHECKOUT_TIMEOUT)
+            self._pool = db_pool.ConnectionPool(name=self.name, **settings, **self.kwargs)
+            self._pool_pid = os.getpid()
+        return self._pool
+
+    def lag(self, now=None):
+        if self.beat is None:
+            return None
+        return max(0.0, (now or time.time()) - self.beat)
+
+    def usable(self, fresh_since=None, now=None):
+        lag = self.lag(now)
+        if not self.healthy or lag is None or lag > MAX_LAG:
+            return False
+        return fresh_since is None or self.beat >= fresh_since
+
+    def status(self):
+        lag = self.lag()
+        return {
+            "healthy": self.healthy,
+            "lag": None if lag is None else round(lag, 3),
+            "error": self.error,
+            "reads": self.reads,
+            **self.pool().stats(),
+        }
+
+
+class ReplicaSet:
+    def __init__(self, dsns):
+        defaults = db_pool.connect_kwargs()
+        self.replicas = [Replica(parse_dsn(dsn, defaults)) for dsn in dsns]
+        self.stats_counts = {"replica": 0, "primary": 0, "stale": 0, "down": 0}
+        self._next = 0
+        self._lock = threading.Lock()
+        self._checker = None
+        self._checker_pid = None
+
+    # Health
+
+    def heartbeat(self):
+        """Write the current time to the primary's heartbeat row"""
+        import storage
+        with storage.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE replica_heartbeat SET beat = %s WHERE id = 1", (time.time(),))
+            cursor.close()
+
+    def check(self):
+        """Read each replica's heartbeat; mark it down if that fails"""
+        for replica in self.replicas:
+            try:
+                with replica.pool().connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute("SELECT beat FROM replica_heartbeat WHERE id = 1")
+                    row = cursor.fetchone()
+                    cursor.close()
+                replica.beat = row[0] if row else None
+                replica.healthy, replica.error = True, None
+            except Exception as e:
+                if replica.healthy:
+                    print(f"Replica {replica.name} is down, reading from the others: {e}")
+                replica.healthy, replica.error = False, str(e)
+                replica.pool().close()
+
+    def _check_forever(self, interval):
+        while True:
+            try:
+                self.heartbeat()
+            except Exception as e:
+                print(f"Replica heartbeat failed: {e}")
+            self.check()
+            time.sleep(interval)
+
+    def start_background_check(self, interval=CHECK_SECONDS):
+        """Heartbeat and check the replicas from a daemon thread (idempotent)"""
+        if self._checker is not None and self._checker_pid == os.getpid():
+            return self._checker
+        with self._lock:
+            if self._checker is None or self._checker_pid != os.getpid():
+                self._checker = threading.Thread(
+                    target=self._check_forever, args=(interval,), name="replica-check", daemon=True
+                )
+                self._checker_pid = os.getpid()
+                self._checker.start()
+        return self._checker
+
+    # Routing
+
+    def choose(self, fresh_since=None):
+        """The next usable replica, or None for the primary"""
+        now = time.time()
+        with self._lock:
+            for _ in range(len(self.replicas)):
+                replica = self.replicas[self._next % len(self.replicas)]
+                self._next += 1
+                if replica.usable(fresh_since, now):
+                    return replica
+        if any(r.healthy for r in self.replicas):
+            self.stats_counts["stale"] += 1
+        else:
+            self.stats_counts["down"] += 1
+        return None
+
+    @contextmanager
+    def connection(self, fresh_since=None):
+        """Borrow a connection from a usable replica, or else the primary"""
+        import storage
+        replica = self.choose(fresh_since)
+        if replica is not None:
+            borrowed = False
+            try:
+                with replica.pool().connection() as conn:
+                    borrowed = True
+                    self.stats_counts["replica"] += 1
+                    replica.reads += 1
+                    yield conn
+                return
+            except (db_pool.PoolTimeout, breaker.Open):
+                if borrowed:
+                    raise
+                # Busy, or its breaker is open: this read goes to the primary
+                self.stats_counts["primary"] += 1
+            except db_pool.CONNECTION_ERRORS as e:
+                # Unreachable: no more reads there until a check finds it healthy
+                replica.healthy, replica.error = False, str(e)
+                self.stats_counts["down"] += 1
+                if borrowed:
+                    raise
+        else:
+            self.stats_counts["primary"] += 1
+        with storage.connection() as conn:
+            yield conn
+
+    def connect(self, fresh_since=None):
+        """A standalone connection to a usable replica, or else the primary"""
+        import storage
+        replica = self.choose(fresh_since)
+        if replica is not None:
+            try:
+                return mysql.connector.connect(**replica.kwargs)
+            except mysql.connector.Error as e:
+                replica.healthy, replica.error = False, str(e)
+        return storage.connect()
+
+    def stats(self):
+        return {"replicas": {r.name: r.status() for r in self.replicas}, "reads": dict(self.stats_counts)}
+
+    def close(self):
+        for replica in self.replicas:
+            if replica._pool is not None:
+                replica._pool.close()
+
+
+_replicas = None
+_replicas_lock = threading.Lock()
+
+
+def get():
+    """This deployment's ReplicaSet, or None without DB_REPLICAS (or on SQLite)"""
+    global _replicas
+    if _replicas is None:
+        import storage
+        dsns = configured()
+        if not dsns or storage.get_backend().name != "mysql":
+            return None
+        with _replicas_lock:
+            if _replicas is None:
+                _replicas = ReplicaSet(dsns)
+    return _replicas
+
+
+def start_background_check():
+    replicas = get()
+    if replicas is not None:
+        return replicas.start_background_check()
+
+
+def stats():
+    replicas = get()
+    return replicas.stats() if replicas is not None else {}
+
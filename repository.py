@@ -0,0 +1,82 @@
+"""Data operations behind the routes, on whichever backend storage.py selected.
+
+Each function borrows a pooled connection for exactly as long as it needs
+one, so a route never holds a connection while it renders or waits on
+anything else.
+
+    list_candidates(kind, by_name=False)  -> tuple of catalog.Candidate, in id (or name) order
+    find_candidate(slug)                  -> catalog.Candidate or None
+    cast_vote(uid, kind, candidate_id)    -> ballot.RECORDED / DUPLICATE / UNKNOWN_CANDIDATE
+    redeem_token(token, category, candidate_id, uid)
+                                          -> ballot.RECORDED / INVALID_TOKEN / DUPLICATE / UNKNOWN_CANDIDATE
+    claim_reward(token, uid)              -> RewardClaim(outcome, used_by, reward_value)
+    tally(*sources, fresh_since=None)     -> {source: {category: {candidate_id: votes}}}
+
+With VOTE_INGEST=queued, cast_vote and redeem_token append to the local
+ingest log instead (see ingest.py) and may raise ingest.Backlogged.
+"""
+from collections import namedtuple
+
+import ballot
+import catalog
+import ingest
+import metrics
+import storage
+import tally as tallies
+
+RewardClaim = namedtuple("RewardClaim", ["outcome", "used_by", "reward_value"])
+
+
+def list_candidates(kind, by_name=False):
+    """Candidates of one kind ('king', 'queen', 'lantern', 'final_king', 'final_queen').
+
+    Served from the per-worker catalog, so this costs no query.
+    """
+    snapshot = catalog.get()
+    return snapshot.by_name[kind] if by_name else snapshot.lists[kind]
+
+
+def find_candidate(slug):
+    """The king or queen a /viewmore slug names (kings win a tie, as before)"""
+    return catalog.get().find_slug(slug)
+
+
+def cast_vote(user_uid, candidate_type, candidate_id):
+    if ingest.enabled():
+        return ingest.cast_vote(user_uid, candidate_type, candidate_id)
+    with storage.connection() as conn:
+        return ballot.cast_vote(conn, user_uid, candidate_type, candidate_id)
+
+
+def redeem_token(token, category, candidate_id, user_uid):
+    # Always synchronous, even with VOTE_INGEST=queued (see ingest.py)
+    with storage.connection() as conn:
+        return ballot.redeem_final(conn, token, category, candidate_id, user_uid)
+
+
+def claim_reward(token, user_uid):
+    """Spend `token`'s reward for `user_uid`, or report who already has it.
+
+    `used_by` is whoever holds the claim afterwards (this user on success);
+    both fields are None for an unknown token.
+    """
+    with storage.connection() as conn:
+        outcome = ballot.redeem_final(conn, token, "reward", None, user_uid)
+        if outcome == ballot.INVALID_TOKEN:
+            return RewardClaim(outcome, None, None)
+        cursor = conn.cursor(dictionary=True)
+        with metrics.query("final_tokens.reward"):
+            cursor.execute("SELECT used_by_reward, reward_value FROM final_tokens WHERE token = %s", (token,))
+            row = cursor.fetchone()
+        cursor.close()
+    return RewardClaim(outcome, row["used_by_reward"], row["reward_value"])
+
+
+def tally(*sources, fresh_since=None):
+    """Current totals for each source ('votes', 'final_votes'; default both).
+
+    Read from a replica when there is one; `fresh_since` (the time of the
+    caller's own last write) keeps that write in the result.
+    """
+    with storage.read_connection(fresh_since) as conn:
+        return {source: tallies.counts(conn, source) for source in sources or tuple(tallies.SOURCES)}
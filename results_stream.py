@@ -0,0 +1,214 @@
+"""Live vote counts for `/results/stream` (Server-Sent Events).
+
+One poller thread per worker reads the tallies every `POLL_INTERVAL`
+seconds and publishes a new version when anything changed. Each connected
+client waits on that version and is sent only the counts that differ from
+what it was last sent, so a slow client just gets a bigger delta later
+instead of a growing backlog. Database load is one `tally.counts()` pair
+per interval however many people are watching.
+
+The poller only runs while someone is subscribed.
+
+Each open stream holds one of the worker's request threads, so a worker
+takes at most `MAX_SUBSCRIBERS` viewers at once (RESULTS_STREAM_MAX_SUBSCRIBERS,
+default 8, well under gunicorn's 32 threads). Past that `stream` raises
+`Full`, the route answers 503, and live_results.js polls `/api/results`
+instead.
+"""
+import json
+import os
+import threading
+import time
+
+import catalog
+import repository
+
+POLL_INTERVAL = float(os.getenv("RESULTS_POLL_INTERVAL", 1.0))
+HEARTBEAT_SECONDS = float(os.getenv("RESULTS_HEARTBEAT_SECONDS", 15))
+# Streams are closed after this long and the browser reconnects, so a
+# worker thread is never held by one viewer forever
+MAX_STREAM_SECONDS = float(os.getenv("RESULTS_STREAM_MAX_SECONDS", 300))
+RETRY_MS = 3000
+# Open streams per worker; 0 for no limit
+MAX_SUBSCRIBERS = int(os.getenv("RESULTS_STREAM_MAX_SUBSCRIBERS", 8))
+
+# tally source -> {tally category: catalog list}
+NAME_LISTS = {
+    "votes": {"king": "king", "queen": "queen", "lantern": "lantern"},
+    "final_votes": {"king": "final_king", "queen": "final_queen", "lantern": "lantern"},
+}
+
+
+def _names():
+    """{source: {category: {id: name}}} so the page can match counts to cards"""
+    snapshot = catalog.get()
+    return {
+        source: {
+            category: {str(c.id): c.name for c in snapshot.lists[list_name]}
+            for category, list_name in lists.items()
+        }
+        for source, lists in NAME_LISTS.items()
+    }
+
+
+def _flatten(counts_by_source):
+    """{(source, category, id): count} with ids as strings for JSON"""
+    flat = {}
+    for source, categories in counts_by_source.items():
+        for category, counts in categories.items():
+            for candidate_id, n in counts.items():
+                flat[(source, category, str(candidate_id))] = n
+    return flat
+
+
+def _nest(flat):
+    nested = {}
+    for (source, category, candidate_id), n in flat.items():
+        nested.setdefault(source, {}).setdefault(category, {})[candidate_id] = n
+    return nested
+
+
+def _event(name, data, event_id=None):
+    lines = [f"event: {name}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append("data: " + json.dumps(data, separators=(",", ":"), ensure_ascii=False))
+    return "\n".join(lines) + "\n\n"
+
+
+class Full(Exception):
+    """This worker already has as many open streams as it takes"""
+
+    retry_after = RETRY_MS // 1000
+
+
+class Broadcaster:
+    def __init__(self, interval=POLL_INTERVAL):
+        self.interval = interval
+        self.version = 0
+        self.counts = {}
+        self.polled_at = None
+        self.subscribers = 0
+        self.refused = 0
+        self.polls = 0
+        self._cond = threading.Condition()
+        self._poller = None
+        self._pid = None
+
+    def _read(self):
+        return _flatten(repository.tally())
+
+    def poll_once(self):
+        """Read the tallies and publish a new version if they changed"""
+        counts = self._read()
+        with self._cond:
+            self.polls += 1
+            self.polled_at = time.monotonic()
+            # Ballots are never removed, so fewer of them means a replica
+            # further behind than the last read; keep the newer counts
+            if sum(counts.values()) < sum(self.counts.values()):
+                return
+            if counts != self.counts:
+                self.counts = counts
+                self.version += 1
+                self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self.subscribers:
+                    self._poller = None
+                    return
+            try:
+                self.poll_once()
+            except Exception as e:
+                print(f"Results poll failed: {e}")
+            time.sleep(self.interval)
+
+    def _ensure_poller(self):
+        # Called with the lock held; a forked worker needs its own thread
+        if self._poller is not None and self._pid == os.getpid():
+            return
+        self._poller = threading.Thread(target=self._run, name="results-poll", daemon=True)
+        self._pid = os.getpid()
+        self._poller.start()
+
+    def latest(self, max_age=None):
+        """Current counts nested by source, or None if there's no fresh poll"""
+        with self._cond:
+            if self.polled_at is None:
+                return None
+            if max_age is not None and time.monotonic() - self.polled_at > max_age:
+                return None
+            return _nest(self.counts)
+
+    def stream(self, max_seconds=MAX_STREAM_SECONDS, heartbeat=HEARTBEAT_SECONDS, limit=MAX_SUBSCRIBERS):
+        """Take a subscriber slot and return a generator of SSE text.
+
+        Raises Full at once, before any response starts, when `limit`
+        streams are already open (None or 0: no limit).
+        """
+        with self._cond:
+            if limit and self.subscribers >= limit:
+                self.refused += 1
+                raise Full(f"{self.subscribers} live results streams already open")
+            self.subscribers += 1
+            self._ensure_poller()
+        events = self._events(max_seconds, heartbeat)
+        # Run it into its try block, so closing even an unread stream frees the slot
+        next(events)
+        return events
+
+    def _events(self, max_seconds, heartbeat):
+        """A snapshot, then deltas as the counts change; gives the slot back when closed"""
+        try:
+            yield
+            yield f"retry: {RETRY_MS}\n\n"
+            deadline = time.monotonic() + max_seconds
+            with self._cond:
+                if self.polled_at is None:
+                    self._cond.wait(timeout=max(self.interval * 2, 1.0))
+                version, sent = self.version, dict(self.counts)
+            try:
+                names = _names()
+            except Exception as e:
+                print(f"Results stream has no candidate names: {e}")
+                names = {}
+            yield _event("snapshot", {"names": names, "counts": _nest(sent)}, version)
+
+            while time.monotonic() < deadline:
+                with self._cond:
+                    self._cond.wait_for(lambda: self.version != version,
+                                        timeout=min(heartbeat, max(deadline - time.monotonic(), 0)))
+                    changed = self.version != version
+                    version, current = self.version, self.counts
+                if not changed:
+                    yield ": keep-alive\n\n"
+                    continue
+                delta = {key: n for key, n in current.items() if sent.get(key) != n}
+                if delta:
+                    sent = dict(current)
+                    yield _event("delta", _nest(delta), version)
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+
+    def stats(self):
+        with self._cond:
+            return {"subscribers": self.subscribers, "refused": self.refused,
+                    "version": self.version, "polls": self.polls}
+
+
+_broadcaster = Broadcaster()
+
+
+def stream(**kwargs):
+    return _broadcaster.stream(**kwargs)
+
+
+def latest(max_age=None):
+    return _broadcaster.latest(max_age)
+
+
+def stats():
+    return _broadcaster.stats()
@@ -0,0 +1,131 @@
+"""sqlite3 behind the slice of the mysql.connector API the app uses.
+
+STORAGE_BACKEND=sqlite (storage.py) hands these out, and the MySQL
+stand-in the benchmarks use (bench/standin.py) subclasses them, so both
+map SQLite's errors to mysql.connector's the same way. This module only
+needs sqlite3 and mysql.connector: importing it reads no settings.
+"""
+import sqlite3
+
+from mysql.connector import errorcode
+from mysql.connector import errors as mysql_errors
+
+
+class SQLiteCursor:
+    def __init__(self, conn, dictionary=False):
+        self._conn = conn
+        self._cursor = conn._db.cursor()
+        self._dictionary = dictionary
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return {d[0]: v for d, v in zip(self._cursor.description, row)}
+
+    def _statements(self, sql):
+        """The SQLite statements to run for `sql`"""
+        return [sql.replace("%s", "?")]
+
+    def execute(self, sql, params=()):
+        statements = self._statements(sql)
+        try:
+            for statement in statements:
+                self._cursor.execute(statement, tuple(params or ()) if "?" in statement else ())
+        except sqlite3.Error as e:
+            raise database_error(e, statements[-1]) from e
+        self.rowcount = self._cursor.rowcount
+        self.lastrowid = self._cursor.lastrowid
+
+    def executemany(self, sql, seq_params):
+        (statement,) = self._statements(sql)
+        try:
+            self._cursor.executemany(statement, [tuple(p) for p in seq_params])
+        except sqlite3.Error as e:
+            raise database_error(e, statement) from e
+        self.rowcount = self._cursor.rowcount
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    def fetchmany(self, size=1):
+        return [self._row(row) for row in self._cursor.fetchmany(size)]
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self):
+        if not self._conn.closed:
+            self._cursor.close()
+
+
+def database_error(e, statement):
+    """The mysql.connector error MySQL would raise where sqlite3 raised `e`"""
+    message = str(e)
+    if isinstance(e, sqlite3.IntegrityError):
+        duplicate = "UNIQUE" in message or "PRIMARY KEY" in message
+        errno = errorcode.ER_DUP_ENTRY if duplicate else errorcode.ER_BAD_NULL_ERROR
+        return mysql_errors.IntegrityError(msg=message, errno=errno)
+    if isinstance(e, sqlite3.OperationalError) and ("no such" in message or "syntax error" in message):
+        # A bad statement, like MySQL's 1064 / 1146
+        return mysql_errors.ProgrammingError(msg=f"{message} in: {statement}")
+    # e.g. "database is locked" after busy_timeout; the connection is fine,
+    # so this must not look like a connection error to db_pool
+    return mysql_errors.DatabaseError(msg=message)
+
+
+class SQLiteConnection:
+    """A sqlite3 connection behind the slice of the mysql.connector API the app uses"""
+
+    cursor_class = SQLiteCursor
+
+    def __init__(self, path, autocommit=True, busy_timeout_ms=5000, synchronous="NORMAL"):
+        # isolation_level=None: every statement commits on its own unless
+        # start_transaction() opened a transaction, as with autocommit=True
+        self._db = sqlite3.connect(path, timeout=busy_timeout_ms / 1000, isolation_level=None, check_same_thread=False)
+        self._db.execute(f"PRAGMA busy_timeout = {int(busy_timeout_ms)}")
+        self._db.execute(f"PRAGMA synchronous = {synchronous}")
+        self.autocommit = autocommit
+        self.closed = False
+
+    def cursor(self, dictionary=False, **kwargs):
+        return self.cursor_class(self, dictionary=dictionary)
+
+    def start_transaction(self, **kwargs):
+        # Take the write lock up front so two writers queue on busy_timeout
+        # instead of failing when one upgrades from a read
+        self._db.execute("BEGIN IMMEDIATE")
+
+    @property
+    def in_transaction(self):
+        return not self.closed and self._db.in_transaction
+
+    def commit(self):
+        if self._db.in_transaction:
+            self._db.execute("COMMIT")
+
+    def rollback(self):
+        if self._db.in_transaction:
+            self._db.execute("ROLLBACK")
+
+    def ping(self, reconnect=False, **kwargs):
+        try:
+            self._db.execute("SELECT 1")
+        except sqlite3.Error as e:
+            raise mysql_errors.InterfaceError(msg=str(e)) from e
+
+    def is_connected(self):
+        try:
+            self.ping()
+        except mysql_errors.InterfaceError:
+            return False
+        return True
+
+    def close(self):
+        self.closed = True
+        self._db.close()
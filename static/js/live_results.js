@@ -0,0 +1,129 @@
+/**
+ * Live vote counts
+ * - Elements with data-live-source / data-live-category / data-live-name
+ *   show that candidate's count and update in place from /results/stream
+ * - The stream sends a snapshot (names + counts), then only changed counts
+ * - EventSource reconnects by itself when the server closes the stream
+ * - When the server turns the stream away (503: too many viewers on that
+ *   worker) the page polls /api/results instead and tries the stream again
+ *   later
+ */
+
+const POLL_MS = 5000;
+const STREAM_RETRY_MS = 60000;
+
+// /api/results category -> [tally source, category] used by the stream
+const RESULT_CATEGORIES = {
+  king: ['votes', 'king'],
+  queen: ['votes', 'queen'],
+  lantern: ['votes', 'lantern'],
+  final_king: ['final_votes', 'king'],
+  final_queen: ['final_votes', 'queen'],
+};
+
+document.addEventListener('DOMContentLoaded', initLiveResults);
+
+function initLiveResults() {
+  const targets = Array.from(document.querySelectorAll('[data-live-source]'));
+  if (!targets.length) return;
+  if (window.EventSource) {
+    openStream(targets);
+  } else {
+    pollResults(targets);
+  }
+}
+
+function openStream(targets) {
+  // "source/category/id" -> elements showing that candidate
+  let byId = {};
+  const source = new EventSource('/results/stream');
+
+  source.addEventListener('snapshot', (e) => {
+    const data = JSON.parse(e.data);
+    byId = indexTargets(targets, data.names || {});
+    applyCounts(byId, data.counts || {});
+  });
+
+  source.addEventListener('delta', (e) => {
+    applyCounts(byId, JSON.parse(e.data));
+  });
+
+  source.addEventListener('error', () => {
+    // CLOSED means the server refused the stream; otherwise EventSource is reconnecting
+    if (source.readyState !== EventSource.CLOSED) return;
+    const stopPolling = pollResults(targets);
+    setTimeout(() => {
+      stopPolling();
+      openStream(targets);
+    }, STREAM_RETRY_MS);
+  });
+}
+
+function pollResults(targets) {
+  let stopped = false;
+  let timer = null;
+
+  const poll = () => {
+    fetch('/api/results', { credentials: 'same-origin', cache: 'no-store' })
+      .then(r => (r.ok ? r.json() : null))
+      .then(data => {
+        if (!data || stopped) return;
+        const names = {};
+        const counts = {};
+        Object.keys(RESULT_CATEGORIES).forEach(category => {
+          const [src, cat] = RESULT_CATEGORIES[category];
+          ((data[category] || {}).entries || []).forEach(entry => {
+            ((names[src] = names[src] || {})[cat] = names[src][cat] || {})[entry.id] = entry.name;
+            ((counts[src] = counts[src] || {})[cat] = counts[src][cat] || {})[entry.id] = entry.votes;
+          });
+        });
+        applyCounts(indexTargets(targets, names), counts);
+      })
+      .catch(() => {})
+      .then(() => {
+        if (!stopped) timer = setTimeout(poll, POLL_MS);
+      });
+  };
+
+  poll();
+  return () => {
+    stopped = true;
+    clearTimeout(timer);
+  };
+}
+
+function indexTargets(targets, names) {
+  const index = {};
+  targets.forEach(el => {
+    const src = el.dataset.liveSource;
+    const category = el.dataset.liveCategory;
+    const ids = (names[src] || {})[category] || {};
+    Object.keys(ids).forEach(id => {
+      if (ids[id] !== el.dataset.liveName) return;
+      const key = src + '/' + category + '/' + id;
+      (index[key] = index[key] || []).push(el);
+    });
+  });
+  return index;
+}
+
+function applyCounts(index, counts) {
+  Object.keys(counts).forEach(src => {
+    Object.keys(counts[src]).forEach(category => {
+      const ids = counts[src][category];
+      Object.keys(ids).forEach(id => {
+        (index[src + '/' + category + '/' + id] || []).forEach(el => setCount(el, ids[id]));
+      });
+    });
+  });
+}
+
+function setCount(el, n) {
+  const valueEl = el.querySelector('[data-live-value]') || el;
+  if (valueEl.textContent === String(n)) return;
+  valueEl.textContent = n;
+  el.classList.remove('live-bump');
+  // Restart the highlight animation
+  void el.offsetWidth;
+  el.classList.add('live-bump');
+}
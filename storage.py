@@ -0,0 +1,247 @@
+"""Database backends: the remote MySQL server, or an embedded SQLite file.
+
+STORAGE_BACKEND picks one per deployment:
+
+    STORAGE_BACKEND=mysql     the DB_* server through db_pool (the default)
+    STORAGE_BACKEND=sqlite    SQLITE_PATH (default voting.db) in WAL mode,
+                              for a single host running every worker
+
+Both hand out connections with the mysql.connector API (`%s` parameters,
+`cursor(dictionary=True)`, start_transaction/commit/rollback,
+`in_transaction`, IntegrityError with errno 1062 on a duplicate key; the
+SQLite ones come from sqlite_adapter.py), so
+ballot.py, tally.py and friends run unchanged on either. The few
+statements that differ between the two dialects ask the backend for the
+right spelling (`get_backend().insert_ignore` and so on).
+
+Reads that can tolerate a few seconds of replication lag use
+`read_connection()`, which goes to a read replica when DB_REPLICAS is set
+(see replicas.py).
+
+Routes don't use this module directly; they go through repository.py.
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import mysql.connector
+from mysql.connector import errorcode
+
+import breaker
+import db_pool
+import replicas
+from sqlite_adapter import SQLiteConnection
+
+# The database can't be reached right now (as opposed to a statement
+# failing): the breaker refused, the request ran out of time, or the
+# connection broke (see breaker.py)
+UNAVAILABLE = (breaker.Unavailable, *db_pool.CONNECTION_ERRORS)
+
+
+class MySQLBackend:
+    name = "mysql"
+    auto_id = "INT AUTO_INCREMENT PRIMARY KEY"
+    insert_ignore = "INSERT IGNORE"
+    skip_locked = " FOR UPDATE SKIP LOCKED"
+    on_update_now = " ON UPDATE CURRENT_TIMESTAMP"
+    # MySQL's default collation already compares case-insensitively
+    nocase = ""
+
+    def enum(self, *values):
+        return "ENUM(" + ", ".join(f"'{v}'" for v in values) + ")"
+
+    def seconds_ago(self):
+        """SQL for 'now minus %s seconds'"""
+        return "NOW() - INTERVAL %s SECOND"
+
+    def add_on_conflict(self, keys, column):
+        """Upsert clause adding the new row's `column` to the existing one"""
+        return f"ON DUPLICATE KEY UPDATE {column} = {column} + VALUES({column})"
+
+    def ignore_on_conflict(self, keys):
+        """Upsert clause that keeps the existing row (unlike INSERT IGNORE, other errors still raise)"""
+        return f"ON DUPLICATE KEY UPDATE {keys[0]} = {keys[0]}"
+
+    def create_table(self, cursor, table, columns, unique=(), keys=()):
+        """CREATE TABLE IF NOT EXISTS; `unique`/`keys` are (name, 'col, col') pairs"""
+        parts = [columns.strip()]
+        parts += [f"UNIQUE KEY {name} ({cols})" for name, cols in unique]
+        parts += [f"KEY {name} ({cols})" for name, cols in keys]
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} (\n" + ",\n".join(parts) + "\n)")
+
+    def create_index(self, cursor, table, name, cols):
+        """CREATE INDEX, unless `table` already has one called `name`"""
+        try:
+            cursor.execute(f"CREATE INDEX {name} ON {table} ({cols})")
+        except mysql.connector.Error as e:
+            if e.errno != errorcode.ER_DUP_KEYNAME:
+                raise
+
+    @contextmanager
+    def exclusive(self, conn, name, timeout=60):
+        """Hold a server-wide named lock (GET_LOCK) on `conn` for the block"""
+        cursor = conn.cursor()
+        cursor.execute("SELECT GET_LOCK(%s, %s)", (name, timeout))
+        if cursor.fetchone()[0] != 1:
+            cursor.close()
+            raise TimeoutError(f"Timed out waiting for lock {name!r}")
+        try:
+            yield
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (name,))
+            cursor.fetchone()
+            cursor.close()
+
+    def connect(self):
+        """A standalone connection for one-off jobs (migrations.py, upload.py)"""
+        return mysql.connector.connect(**db_pool.connect_kwargs())
+
+    def get_pool(self):
+        return db_pool.get_pool()
+
+
+class SQLiteBackend(MySQLBackend):
+    name = "sqlite"
+    auto_id = "INTEGER PRIMARY KEY AUTOINCREMENT"
+    insert_ignore = "INSERT OR IGNORE"
+    # Writers are serialized by BEGIN IMMEDIATE already
+    skip_locked = ""
+    on_update_now = ""
+    nocase = " COLLATE NOCASE"
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv("SQLITE_PATH", "voting.db")
+        self.options = dict(
+            busy_timeout_ms=int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000)),
+            # NORMAL is crash-safe in WAL mode; a power cut can lose the last commits
+            synchronous=os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+        )
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+        db = sqlite3.connect(self.path)
+        try:
+            # Persistent for the file: readers never block the writer
+            db.execute("PRAGMA journal_mode = WAL")
+        finally:
+            db.close()
+
+    def enum(self, *values):
+        return "TEXT"
+
+    def seconds_ago(self):
+        return "datetime('now', '-' || %s || ' seconds')"
+
+    def add_on_conflict(self, keys, column):
+        return f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {column} = {column} + excluded.{column}"
+
+    def ignore_on_conflict(self, keys):
+        return f"ON CONFLICT ({', '.join(keys)}) DO NOTHING"
+
+    def create_table(self, cursor, table, columns, unique=(), keys=()):
+        parts = [columns.strip()]
+        parts += [f"UNIQUE ({cols})" for _, cols in unique]
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} (\n" + ",\n".join(parts) + "\n)")
+        for name, cols in keys:
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({cols})")
+
+    def create_index(self, cursor, table, name, cols):
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({cols})")
+
+    @contextmanager
+    def exclusive(self, conn, name, timeout=60):
+        # Nothing to take: writers already queue on BEGIN IMMEDIATE, so
+        # callers re-check their state inside start_transaction()
+        yield
+
+    def connect(self):
+        return SQLiteConnection(self.path, **self.options)
+
+    def get_pool(self):
+        """This process's pool, created fresh after a fork like db_pool's"""
+        pid = os.getpid()
+        if self._pool is None or self._pool_pid != pid:
+            with self._lock:
+                if self._pool is None or self._pool_pid != pid:
+                    self._pool = db_pool.ConnectionPool(
+                        connect=SQLiteConnection, path=self.path, **self.options, **db_pool.pool_settings()
+                    )
+                    self._pool_pid = pid
+        return self._pool
+
+
+BACKENDS = {
+    "mysql": MySQLBackend,
+    "sqlite": SQLiteBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                # Read when first needed, so a .env loaded after import still counts
+                name = os.getenv("STORAGE_BACKEND", "mysql").strip().lower()
+                if name not in BACKENDS:
+                    raise ValueError(f"Unknown STORAGE_BACKEND {name!r}; use one of {', '.join(BACKENDS)}")
+                _backend = BACKENDS[name]()
+    return _backend
+
+
+def use(backend):
+    """Switch this process to `backend` (a MySQLBackend/SQLiteBackend instance)"""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+    return backend
+
+
+def connection():
+    """Borrow a pooled connection from the configured backend"""
+    return get_backend().get_pool().connection()
+
+
+def read_connection(fresh_since=None):
+    """Borrow a connection for reads that may come from a replica (see replicas.py).
+
+    `fresh_since` (a time.time() value) asks for a replica that has caught
+    up to that moment, or else the primary.
+    """
+    replica_set = replicas.get()
+    if replica_set is None:
+        return connection()
+    return replica_set.connection(fresh_since)
+
+
+def connect():
+    """Open a standalone connection to the configured backend"""
+    return get_backend().connect()
+
+
+def read_connect():
+    """Open a standalone connection to a replica if there is one (long reads like exports)"""
+    replica_set = replicas.get()
+    if replica_set is None:
+        return connect()
+    return replica_set.connect()
+
+
+def close():
+    """Close this process's idle pooled connections (before forking workers)"""
+    get_backend().get_pool().close()
+
+
+def warm():
+    """Pre-open DB_POOL_WARM connections (defaults to the pool size)"""
+    backend = get_backend()
+    pool = backend.get_pool()
+    try:
+        opened = pool.warm(int(os.getenv("DB_POOL_WARM", pool.size)))
+        print(f"Database pool ({backend.name}) warmed with {opened} connections (pid {os.getpid()})")
+    except Exception as e:
+        print(f"Database pool warm-up failed: {e}")
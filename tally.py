@@ -0,0 +1,223 @@
+"""Incremental vote tallies.
+
+Ballot rows in `votes` and `final_votes` are the only thing the vote routes
+write. A folder periodically rolls new ballot rows (past a watermark) into
+per-candidate totals in `vote_tallies`, and `counts()` adds the not-yet-folded
+tail on top so reads are always current.
+
+    python tally.py          # fold everything that is ready, once
+"""
+import os
+import threading
+import time
+
+import metrics
+import storage
+
+# source table -> column holding the category
+SOURCES = {
+    "votes": "candidate_type",
+    "final_votes": "category",
+}
+
+# (source, category) -> candidate table whose vote_count mirrors the tally
+CANDIDATE_TABLES = {
+    ("votes", "king"): "kings",
+    ("votes", "queen"): "queens",
+    ("votes", "lantern"): "lanterns",
+    ("final_votes", "king"): "final_kings",
+    ("final_votes", "queen"): "final_queens",
+    ("final_votes", "lantern"): "lanterns",
+}
+
+# Rows younger than this are left for the next pass so a slow transaction
+# holding a lower auto-increment id can't be skipped by the watermark.
+SETTLE_SECONDS = int(os.getenv("TALLY_SETTLE_SECONDS", 5))
+BATCH_SIZE = int(os.getenv("TALLY_BATCH_SIZE", 5000))
+FOLD_INTERVAL = float(os.getenv("TALLY_FOLD_INTERVAL", 2.0))
+
+
+def fold_batch(conn, source, batch_size=BATCH_SIZE, settle=SETTLE_SECONDS):
+    """Fold up to `batch_size` ids past the watermark into vote_tallies.
+
+    Returns the number of ballot rows folded, or None if another worker
+    holds the watermark right now.
+    """
+    column = SOURCES[source]
+    backend = storage.get_backend()
+    cursor = conn.cursor()
+    conn.start_transaction()
+    try:
+        cursor.execute(
+            f"SELECT last_id FROM tally_watermarks WHERE source = %s{backend.skip_locked}",
+            (source,)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            conn.rollback()
+            return None
+        last_id = row[0]
+
+        # Stop just below the oldest row that hasn't settled yet
+        cursor.execute(
+            f"""
+            SELECT MAX(id) FROM (
+                SELECT id FROM {source}
+                WHERE id > %s AND id < COALESCE((
+                    SELECT MIN(id) FROM {source}
+                    WHERE id > %s AND created_at > {backend.seconds_ago()}
+                ), 2147483647)
+                ORDER BY id
+                LIMIT %s
+            ) b
+            """,
+            (last_id, last_id, settle, batch_size)
+        )
+        upper = cursor.fetchone()[0]
+        if upper is None:
+            conn.rollback()
+            return 0
+
+        cursor.execute(
+            f"""
+            SELECT {column}, candidate_id, COUNT(*) FROM {source}
+            WHERE id > %s AND id <= %s
+            GROUP BY {column}, candidate_id
+            """,
+            (last_id, upper)
+        )
+        rows = cursor.fetchall()
+        # Reward claims have no candidate; they still move the watermark
+        groups = [(source, category, candidate_id, n) for category, candidate_id, n in rows if candidate_id is not None]
+
+        if groups:
+            cursor.executemany(
+                f"""
+                INSERT INTO vote_tallies (source, category, candidate_id, total)
+                VALUES (%s, %s, %s, %s)
+                {backend.add_on_conflict(("source", "category", "candidate_id"), "total")}
+                """,
+                groups
+            )
+            mirror_vote_counts(cursor, {(g[0], g[1]) for g in groups})
+
+        cursor.execute("UPDATE tally_watermarks SET last_id = %s WHERE source = %s", (upper, source))
+        conn.commit()
+        return sum(n for _, _, n in rows)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def mirror_vote_counts(cursor, keys):
+    """Copy vote_tallies into the vote_count column of the candidate tables
+    behind `keys`, a set of (source, category) pairs.
+
+    This runs once per batch from the folder and from reconcile.py's
+    repair, never from a vote request, so it doesn't reintroduce per-vote
+    row locks. Written with correlated subqueries rather than
+    UPDATE ... JOIN so it runs on SQLite too.
+    """
+    tables = {CANDIDATE_TABLES[key] for key in keys if key in CANDIDATE_TABLES}
+    for table in sorted(tables):
+        table_keys = [key for key, t in CANDIDATE_TABLES.items() if t == table]
+        match = " OR ".join("(t.source = %s AND t.category = %s)" for _ in table_keys)
+        params = [value for key in table_keys for value in key]
+        cursor.execute(
+            f"""
+            UPDATE {table}
+            SET vote_count = (
+                SELECT SUM(t.total) FROM vote_tallies t
+                WHERE ({match}) AND t.candidate_id = {table}.id
+            )
+            WHERE id IN (SELECT t.candidate_id FROM vote_tallies t WHERE {match})
+            """,
+            params + params
+        )
+
+
+def fold(conn=None):
+    """Fold every source until nothing ready remains; returns rows folded"""
+    if conn is None:
+        with storage.connection() as conn:
+            return fold(conn)
+    folded = 0
+    for source in SOURCES:
+        while True:
+            with metrics.query("tally.fold"):
+                n = fold_batch(conn, source)
+            if not n:
+                break
+            folded += n
+    return folded
+
+
+def counts(conn, source="votes"):
+    """Current totals for `source` as {category: {candidate_id: count}}.
+
+    Folded totals and the unfolded tail are read in a single statement so
+    they come from one snapshot and a concurrent fold can't double count.
+    """
+    column = SOURCES[source]
+    cursor = conn.cursor()
+    with metrics.query(f"tally.counts.{source}"):
+        cursor.execute(
+            f"""
+            SELECT category, candidate_id, SUM(n) FROM (
+                SELECT category, candidate_id, total AS n FROM vote_tallies
+                WHERE source = %s
+                UNION ALL
+                SELECT b.{column}, b.candidate_id, COUNT(*) FROM {source} b
+                JOIN tally_watermarks w ON w.source = %s
+                WHERE b.id > w.last_id AND b.candidate_id IS NOT NULL
+                GROUP BY b.{column}, b.candidate_id
+            ) x
+            GROUP BY category, candidate_id
+            """,
+            (source, source)
+        )
+        rows = cursor.fetchall()
+    result = {}
+    for category, candidate_id, n in rows:
+        result.setdefault(category, {})[candidate_id] = int(n)
+    cursor.close()
+    return result
+
+
+def with_counts(rows, category_counts):
+    """Return candidate rows with vote_count taken from the tally, highest first"""
+    rows = [dict(row, vote_count=category_counts.get(row["id"], 0)) for row in rows]
+    rows.sort(key=lambda row: row["vote_count"], reverse=True)
+    return rows
+
+
+_folder = None
+_folder_pid = None
+
+
+def _fold_forever(interval):
+    while True:
+        try:
+            fold()
+        except Exception as e:
+            print(f"Tally fold failed: {e}")
+        time.sleep(interval)
+
+
+def start_background_fold(interval=FOLD_INTERVAL):
+    """Run the folder in a daemon thread for this process (idempotent)"""
+    global _folder, _folder_pid
+    if _folder is not None and _folder_pid == os.getpid():
+        return _folder
+    _folder = threading.Thread(target=_fold_forever, args=(interval,), name="tally-fold", daemon=True)
+    _folder_pid = os.getpid()
+    _folder.start()
+    return _folder
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    print(f"Folded {fold()} ballot rows")
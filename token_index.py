@@ -0,0 +1,232 @@
+"""In-memory index of `final_tokens` for early rejection.
+
+`/final_vote` and `/reward_claim` ask the index first, so a mistyped or
+guessed token, or one already spent in that category, is turned away
+without a database round trip. Only tokens the index thinks are usable
+go on to MySQL, which still has the final say.
+
+The index stays current three ways:
+  * write-through: the routes call `mark_used()` after they commit;
+  * every `POLL_SECONDS` new rows (id past the last one seen) are added,
+    so freshly provisioned tokens work within seconds;
+  * every `RECONCILE_SECONDS` the whole table is reloaded to pick up
+    changes made outside this worker (other workers, admin edits).
+
+Until the first load finishes `check()` returns None and callers fall
+back to the database.
+"""
+import os
+import threading
+import time
+
+import metrics
+import storage
+
+CATEGORIES = ("king", "queen", "lantern", "reward")
+_BITS = {category: 1 << i for i, category in enumerate(CATEGORIES)}
+
+POLL_SECONDS = float(os.getenv("TOKEN_INDEX_POLL_SECONDS", 5))
+RECONCILE_SECONDS = float(os.getenv("TOKEN_INDEX_RECONCILE_SECONDS", 60))
+FETCH_SIZE = 5000
+
+# check() results
+USABLE = "usable"
+UNKNOWN = "unknown"
+USED = "used"
+
+_COLUMNS = "id, token, used_for_king, used_for_queen, used_for_lantern, used_for_reward, used_by_reward, reward_value"
+
+
+def normalize(token):
+    return (token or "").strip().upper()
+
+
+class TokenState:
+    __slots__ = ("used", "reward_value", "used_by_reward")
+
+    def __init__(self, used, reward_value, used_by_reward):
+        self.used = used
+        self.reward_value = reward_value
+        self.used_by_reward = used_by_reward
+
+    def is_used(self, category):
+        return bool(self.used & _BITS[category])
+
+
+def _state(row):
+    used = 0
+    for category in CATEGORIES:
+        if row[f"used_for_{category}"]:
+            used |= _BITS[category]
+    return TokenState(used, row["reward_value"], row["used_by_reward"])
+
+
+class TokenIndex:
+    def __init__(self):
+        self.tokens = None
+        self.last_id = 0
+        self.loaded_at = None
+        self.rejected = 0
+        self.passed = 0
+        self._lock = threading.Lock()
+        # Write-throughs made while a full reload is reading the table
+        self._recent = None
+        self._syncer = None
+        self._syncer_pid = None
+
+    def _fetch(self, conn, after_id=0):
+        cursor = conn.cursor(dictionary=True)
+        with metrics.query("final_tokens.index"):
+            cursor.execute(f"SELECT {_COLUMNS} FROM final_tokens WHERE id > %s ORDER BY id", (after_id,))
+            tokens, last_id = {}, after_id
+            while True:
+                rows = cursor.fetchmany(FETCH_SIZE)
+                if not rows:
+                    break
+                for row in rows:
+                    tokens[normalize(row["token"])] = _state(row)
+                    last_id = max(last_id, row["id"])
+        cursor.close()
+        return tokens, last_id
+
+    def reload(self, conn=None):
+        """Replace the index with a fresh read of the whole table"""
+        if conn is None:
+            with storage.connection() as conn:
+                return self.reload(conn)
+        with self._lock:
+            self._recent = []
+        try:
+            tokens, last_id = self._fetch(conn)
+        except Exception:
+            with self._lock:
+                self._recent = None
+            raise
+        with self._lock:
+            # Used flags only ever get set, so replay anything marked mid-read
+            for token, category, user_uid in self._recent:
+                self._apply(tokens, token, category, user_uid)
+            self._recent = None
+            self.tokens = tokens
+            self.last_id = last_id
+            self.loaded_at = time.monotonic()
+        return len(tokens)
+
+    def poll_new(self, conn=None):
+        """Add tokens inserted since the last read"""
+        if self.tokens is None:
+            return self.reload(conn)
+        if conn is None:
+            with storage.connection() as conn:
+                return self.poll_new(conn)
+        tokens, last_id = self._fetch(conn, self.last_id)
+        with self._lock:
+            for token, state in tokens.items():
+                self.tokens.setdefault(token, state)
+            self.last_id = max(self.last_id, last_id)
+        return len(tokens)
+
+    def check(self, token, category=None):
+        """USABLE, UNKNOWN or USED (for `category`); None if not loaded yet"""
+        tokens = self.tokens
+        if tokens is None:
+            return None
+        state = tokens.get(normalize(token))
+        if state is None:
+            self.rejected += 1
+            return UNKNOWN
+        if category in _BITS and state.is_used(category):
+            self.rejected += 1
+            return USED
+        self.passed += 1
+        return USABLE
+
+    def get(self, token):
+        """The TokenState for a token, or None if unknown or not loaded"""
+        tokens = self.tokens
+        return tokens.get(normalize(token)) if tokens is not None else None
+
+    @staticmethod
+    def _apply(tokens, token, category, user_uid):
+        state = tokens.get(token)
+        if state is None:
+            return
+        state.used |= _BITS[category]
+        if category == "reward" and user_uid is not None:
+            state.used_by_reward = user_uid
+
+    def mark_used(self, token, category, user_uid=None):
+        """Record a committed use of `token` for `category`"""
+        token = normalize(token)
+        with self._lock:
+            if self.tokens is not None:
+                self._apply(self.tokens, token, category, user_uid)
+            if self._recent is not None:
+                self._recent.append((token, category, user_uid))
+
+    def _sync_forever(self):
+        next_reload = time.monotonic() + RECONCILE_SECONDS
+        while True:
+            time.sleep(POLL_SECONDS)
+            try:
+                if time.monotonic() >= next_reload or self.tokens is None:
+                    self.reload()
+                    next_reload = time.monotonic() + RECONCILE_SECONDS
+                else:
+                    self.poll_new()
+            except Exception as e:
+                print(f"Token index sync failed: {e}")
+
+    def start_background_sync(self):
+        """Load now (if the database is reachable) and keep syncing in a daemon thread"""
+        with self._lock:
+            if self._syncer is not None and self._syncer_pid == os.getpid():
+                return self._syncer
+            self._syncer = threading.Thread(target=self._sync_forever, name="token-index", daemon=True)
+            self._syncer_pid = os.getpid()
+        try:
+            if self.tokens is None:
+                print(f"Token index loaded {self.reload()} tokens")
+            else:
+                # Inherited from the preloading gunicorn master; just catch up
+                print(f"Token index inherited {len(self.tokens)} tokens, {self.poll_new()} new")
+        except Exception as e:
+            print(f"Token index load failed, will retry: {e}")
+        self._syncer.start()
+        return self._syncer
+
+    def stats(self):
+        tokens = self.tokens
+        return {
+            "loaded": tokens is not None,
+            "tokens": len(tokens) if tokens is not None else 0,
+            "rejected": self.rejected,
+            "passed": self.passed,
+        }
+
+
+_index = TokenIndex()
+
+
+def check(token, category=None):
+    return _index.check(token, category)
+
+
+def get(token):
+    return _index.get(token)
+
+
+def mark_used(token, category, user_uid=None):
+    _index.mark_used(token, category, user_uid)
+
+
+def reload():
+    return _index.reload()
+
+
+def start_background_sync():
+    return _index.start_background_sync()
+
+
+def stats():
+    return _index.stats()
@@ -0,0 +1,274 @@
+"""Verify Firebase ID tokens locally.
+
+`auth.verify_id_token()` does the same checks, but it goes through
+google-auth's cert fetching on every call. Here the signing keys are loaded
+once, refreshed in the background before their `Cache-Control: max-age`
+runs out, and every token that passed is remembered (by its SHA-256) until
+it expires, so a login storm costs one signature check per distinct token.
+
+Keys come from a pluggable source. `GoogleCertSource` is the real one;
+`LocalIssuer` mints tokens with its own key pair so benchmarks and local
+runs need no network:
+
+    issuer = LocalIssuer("demo-project")
+    token_verify.configure("demo-project", key_source=issuer.key_source())
+    claims = token_verify.verify(issuer.mint("some-uid"))
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+import requests
+from cryptography import x509
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+import firebase_client
+
+GOOGLE_CERTS_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+ISSUER_PREFIX = "https://securetoken.google.com/"
+
+CLOCK_SKEW_SECONDS = int(os.getenv("AUTH_CLOCK_SKEW_SECONDS", 0))
+MEMO_SIZE = int(os.getenv("AUTH_MEMO_SIZE", 10000))
+# A token signed with a key we haven't seen triggers a refetch, at most this often
+MIN_REFETCH_SECONDS = 30
+RETRY_SECONDS = 30
+DEFAULT_MAX_AGE = 3600
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def _max_age(cache_control):
+    match = re.search(r"max-age=(\d+)", cache_control or "")
+    return int(match.group(1)) if match else DEFAULT_MAX_AGE
+
+
+class GoogleCertSource:
+    """Google's published x509 certs for Firebase ID tokens"""
+
+    def __init__(self, url=GOOGLE_CERTS_URL, timeout=5):
+        self.url = url
+        self.timeout = timeout
+
+    def fetch(self):
+        """Return ({kid: public key}, seconds the keys may be cached)"""
+        response = requests.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        keys = {
+            kid: x509.load_pem_x509_certificate(pem.encode("utf-8")).public_key()
+            for kid, pem in response.json().items()
+        }
+        return keys, _max_age(response.headers.get("Cache-Control"))
+
+
+class StaticKeySource:
+    """A fixed key set, e.g. from a LocalIssuer"""
+
+    def __init__(self, keys, max_age=DEFAULT_MAX_AGE):
+        self.keys = dict(keys)
+        self.max_age = max_age
+
+    def fetch(self):
+        return dict(self.keys), self.max_age
+
+
+class LocalIssuer:
+    """Mints Firebase-shaped ID tokens with a throwaway RSA key"""
+
+    def __init__(self, project_id, kid="local-1"):
+        self.project_id = project_id
+        self.kid = kid
+        self._private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+    def key_source(self):
+        return StaticKeySource({self.kid: self._private_key.public_key()})
+
+    def mint(self, uid, lifetime=3600, **claims):
+        now = int(time.time())
+        payload = {
+            "iss": ISSUER_PREFIX + self.project_id,
+            "aud": self.project_id,
+            "auth_time": now,
+            "iat": now,
+            "exp": now + lifetime,
+            "sub": uid,
+            "user_id": uid,
+        }
+        payload.update(claims)
+        return jwt.encode(payload, self._private_key, algorithm="RS256", headers={"kid": self.kid})
+
+
+class KeySet:
+    """Signing keys from a source, kept fresh by a background thread"""
+
+    def __init__(self, source):
+        self.source = source
+        self.keys = {}
+        self.fetched_at = None
+        self.refresh_at = 0
+        self.fetches = 0
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._refresher = None
+        self._refresher_pid = None
+
+    def refresh(self):
+        keys, max_age = self.source.fetch()
+        with self._lock:
+            self.keys = keys
+            self.fetched_at = time.monotonic()
+            # Refetch a little before the published lifetime runs out
+            self.refresh_at = self.fetched_at + max(max_age * 0.9, 60)
+            self.fetches += 1
+
+    def _refresh_forever(self):
+        while True:
+            delay = self.refresh_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+                continue
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Signing key refresh failed: {e}")
+                self.refresh_at = time.monotonic() + RETRY_SECONDS
+
+    def start_background_refresh(self):
+        """Load the keys now and keep them fresh in a daemon thread (idempotent)"""
+        with self._lock:
+            if self._refresher is not None and self._refresher_pid == os.getpid():
+                return
+            self._refresher = threading.Thread(target=self._refresh_forever, name="key-refresh", daemon=True)
+            self._refresher_pid = os.getpid()
+        if self.fetched_at is None:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Signing key preload failed: {e}")
+        self._refresher.start()
+
+    def get(self, kid):
+        key = self.keys.get(kid)
+        if key is not None:
+            return key
+        with self._fetch_lock:
+            # Another request may have fetched while we waited
+            key = self.keys.get(kid)
+            if key is None and (self.fetched_at is None or time.monotonic() - self.fetched_at > MIN_REFETCH_SECONDS):
+                # Keys rotated (or never loaded): fetch now rather than wait for the schedule
+                self.refresh()
+                key = self.keys.get(kid)
+        if key is None:
+            raise InvalidToken(f"Unknown signing key {kid!r}")
+        return key
+
+
+class Verifier:
+    def __init__(self, project_id, key_source=None, clock_skew=CLOCK_SKEW_SECONDS, memo_size=MEMO_SIZE):
+        self.project_id = project_id
+        self.keys = KeySet(key_source or GoogleCertSource())
+        self.clock_skew = clock_skew
+        self.memo_size = memo_size
+        self.hits = 0
+        self.misses = 0
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remembered(self, digest):
+        with self._lock:
+            item = self._memo.get(digest)
+            if item is None:
+                return None
+            claims, exp = item
+            if exp + self.clock_skew <= time.time():
+                del self._memo[digest]
+                return None
+            self._memo.move_to_end(digest)
+            self.hits += 1
+            return claims
+
+    def _remember(self, digest, claims):
+        with self._lock:
+            self._memo[digest] = (claims, claims["exp"])
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+
+    def verify(self, token):
+        """Return the token's claims (plus `uid`) or raise InvalidToken"""
+        if not self.project_id:
+            raise InvalidToken("Firebase project id is not configured")
+        if not isinstance(token, str) or not token:
+            raise InvalidToken("Token must be a non-empty string")
+
+        digest = hashlib.sha256(token.encode("utf-8")).digest()
+        claims = self._remembered(digest)
+        if claims is not None:
+            return dict(claims)
+
+        with self._lock:
+            self.misses += 1
+        try:
+            header = jwt.get_unverified_header(token)
+            if header.get("alg") != "RS256":
+                raise InvalidToken(f"Unexpected algorithm {header.get('alg')!r}")
+            claims = jwt.decode(
+                token,
+                self.keys.get(header.get("kid")),
+                algorithms=["RS256"],
+                audience=self.project_id,
+                issuer=ISSUER_PREFIX + self.project_id,
+                leeway=self.clock_skew,
+                options={"require": ["exp", "iat", "sub", "auth_time"]},
+            )
+        except jwt.PyJWTError as e:
+            raise InvalidToken(str(e)) from e
+
+        sub = claims.get("sub")
+        if not isinstance(sub, str) or not sub or len(sub) > 128:
+            raise InvalidToken("Token has an invalid subject")
+        if claims["auth_time"] > time.time() + self.clock_skew:
+            raise InvalidToken("Token auth_time is in the future")
+        claims["uid"] = sub
+
+        self._remember(digest, claims)
+        return dict(claims)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "memo": len(self._memo), "key_fetches": self.keys.fetches}
+
+
+_verifier = None
+
+
+def configure(project_id, key_source=None, **kwargs):
+    """Set up the module-level verifier (call again to swap the key source)"""
+    global _verifier
+    _verifier = Verifier(project_id, key_source, **kwargs)
+    return _verifier
+
+
+def get_verifier():
+    global _verifier
+    if _verifier is None:
+        _verifier = Verifier(firebase_client.project_id())
+    return _verifier
+
+
+def verify(token):
+    return get_verifier().verify(token)
+
+
+def load_keys():
+    """Fetch the signing keys now, without a refresh thread (for the gunicorn master)"""
+    get_verifier().keys.refresh()
+
+
+def preload():
+    """Fetch the signing keys (unless inherited) and start refreshing them in the background"""
+    get_verifier().keys.start_background_refresh()
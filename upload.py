@@ -1,67 +1,277 @@
+"""Provision final-round tokens into `final_tokens`.
+
+    python upload.py                              # load Token350.csv (the default)
+    python upload.py --csv tokens.csv             # load tokens from any CSV (first column)
+    python upload.py --generate 50000 --out printed.csv
+    python upload.py --generate 500 --add --out extra.csv   # more tokens on top of a loaded table
+    python upload.py --rewards "2x30000MMK,5x10000MMK,rest:1000MMK"
+    python upload.py --replace --yes              # old behaviour: wipe final_votes/final_tokens first
+
+Tokens are streamed and inserted in multi-row batches (`--batch`), one
+transaction per batch. Re-running a CSV load is safe: tokens that are
+already in the table are skipped, so an interrupted load resumes where it
+stopped.
+
+`--generate` is different: every run makes N new tokens, so running it
+again would add N more, drawing their rewards from whatever is left. It
+therefore refuses to run against a table that already has tokens unless
+`--add` says that is what you want (or `--replace` empties it first).
+Failures exit non-zero.
+
+`--rewards` describes the prizes for the whole table. Rewards already
+assigned are subtracted, and each new token draws its reward at random
+from what is left. The order of the CSV (or of the printed sheet) says
+nothing about who wins what. The last tier may be `rest:<value>` to cover
+however many tokens remain.
+"""
+import argparse
 import csv
-import mysql.connector
 import os
+import secrets
+import sys
+import time
+
+import mysql.connector
 from dotenv import load_dotenv
 
-load_dotenv()
-
-# Connect to database
-db = mysql.connector.connect(
-    host=os.getenv("DB_HOST"),
-    port=int(os.getenv("DB_PORT", "19840")),
-    user=os.getenv("DB_USER"),
-    password=os.getenv("DB_PASSWORD"),
-    database=os.getenv("DB_NAME"),
-    ssl_ca="ca.pem"
-)
-
-cursor = db.cursor()
-
-try:
-    print("⚡ Clearing final_tokens and final_votes tables...")
-    cursor.execute("DELETE FROM final_votes")
-    cursor.execute("DELETE FROM final_tokens")
-    db.commit()
-    print("✅ Tables cleared.")
-
-    print("📄 Reading tokens from Token350.csv...")
-    with open("Token350.csv", "r", encoding="utf-8") as file:
-        reader = csv.reader(file)
-        tokens = [row[0].strip() for row in reader if row]
-
-    print(f"🔢 Total tokens read: {len(tokens)}")
-    if len(tokens) != 350:
-        print("⚠️ Warning: Expected 350 tokens, but found", len(tokens))
-
-    # Reward distribution
-    reward_distribution = [
-        (2, "30000MMK"),
-        (5, "10000MMK"),
-        (10, "5000MMK"),
-        (20, "3000MMK"),
-        (37, "2000MMK"),
-        (276, "1000MMK")
-    ]
-
-    print("💾 Inserting tokens with rewards...")
-    insert_query = "INSERT INTO final_tokens (token, reward_value) VALUES (%s, %s)"
-
-    idx = 0
-    for count, reward in reward_distribution:
-        for _ in range(count):
-            if idx >= len(tokens):
-                break
-            cursor.execute(insert_query, (tokens[idx], reward))
-            idx += 1
-
-    db.commit()
-    print(f"✅ Inserted {idx} tokens successfully with reward distribution!")
-
-except Exception as e:
-    print(f"❌ Error: {e}")
-    db.rollback()
-
-finally:
-    cursor.close()
-    db.close()
-    print("🔒 Database connection closed.")
+import db_pool
+import storage
+
+# Same prize table as the 2025 event: 350 tokens
+DEFAULT_REWARDS = "2x30000MMK,5x10000MMK,10x5000MMK,20x3000MMK,37x2000MMK,rest:1000MMK"
+
+# No 0/O or 1/I/L, so printed tokens can't be misread
+TOKEN_ALPHABET = "ABCDEFGHJKMNPQRSTUVWXYZ23456789"
+TOKEN_LENGTH = 6
+
+
+def parse_rewards(spec):
+    """'2x30000MMK,...,rest:1000MMK' -> ([(count, value), ...], rest value or None)"""
+    tiers, rest = [], None
+    for part in spec.split(","):
+        part = part.strip()
+        if part.startswith("rest:"):
+            rest = part[len("rest:"):]
+        elif "x" in part:
+            count, value = part.split("x", 1)
+            tiers.append((int(count), value))
+        elif part:
+            raise ValueError(f"Bad reward tier {part!r}; use '<count>x<value>' or 'rest:<value>'")
+    return tiers, rest
+
+
+class RewardPool:
+    """Draws rewards without replacement; equivalent to shuffling the full list"""
+
+    def __init__(self, tiers, rest, total):
+        self.remaining = {}
+        for count, value in tiers:
+            if count > 0:
+                self.remaining[value] = self.remaining.get(value, 0) + count
+        fixed = sum(self.remaining.values())
+        if rest is not None and total > fixed:
+            self.remaining[rest] = self.remaining.get(rest, 0) + total - fixed
+        self._random = secrets.SystemRandom()
+
+    def draw(self):
+        left = sum(self.remaining.values())
+        if not left:
+            return None
+        pick = self._random.randrange(left)
+        for value, count in self.remaining.items():
+            if pick < count:
+                self.remaining[value] -= 1
+                return value
+            pick -= count
+
+    def subtract(self, assigned):
+        """Take rewards already in the table out of the pool"""
+        for value, count in assigned.items():
+            if value in self.remaining:
+                self.remaining[value] = max(0, self.remaining[value] - count)
+
+
+def read_csv(path):
+    """Yield tokens from the first column, one row at a time"""
+    with open(path, "r", encoding="utf-8-sig", newline="") as file:
+        for row in csv.reader(file):
+            if row and row[0].strip():
+                yield row[0].strip()
+
+
+def count_new(cursor, tokens, batch_size):
+    """(tokens in the stream, how many of them aren't in the table yet)"""
+    total = new = 0
+    seen = set()
+    for batch in batches(tokens, batch_size):
+        present = existing(cursor, batch)
+        for token in batch:
+            total += 1
+            key = token.upper()
+            if key not in present and key not in seen:
+                seen.add(key)
+                new += 1
+    return total, new
+
+
+def generate(count):
+    """Yield `count` distinct random tokens"""
+    seen = set()
+    while len(seen) < count:
+        token = "".join(secrets.choice(TOKEN_ALPHABET) for _ in range(TOKEN_LENGTH))
+        if token not in seen:
+            seen.add(token)
+            yield token
+
+
+def batches(tokens, size):
+    batch = []
+    for token in tokens:
+        batch.append(token)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def existing(cursor, tokens):
+    """Which of `tokens` are already in final_tokens (the column is case-insensitive)"""
+    placeholders = ", ".join(["%s"] * len(tokens))
+    cursor.execute(f"SELECT token FROM final_tokens WHERE token IN ({placeholders})", tokens)
+    return {row[0].upper() for row in cursor.fetchall()}
+
+
+def assigned_rewards(cursor):
+    cursor.execute("SELECT reward_value, COUNT(*) FROM final_tokens GROUP BY reward_value")
+    return {value: count for value, count in cursor.fetchall()}
+
+
+def insert_batch(cursor, rows):
+    placeholders = ", ".join(["(%s, %s)"] * len(rows))
+    params = [value for row in rows for value in row]
+    # A token loaded by a concurrent run keeps its original reward
+    cursor.execute(
+        f"INSERT INTO final_tokens (token, reward_value) VALUES {placeholders} "
+        f"{storage.get_backend().ignore_on_conflict(('token',))}",
+        params
+    )
+    return cursor.rowcount
+
+
+def connect():
+    """A connection to STORAGE_BACKEND (MySQL on DB_PORT, default 19840)"""
+    if storage.get_backend().name != "mysql":
+        return storage.connect()
+    kwargs = db_pool.connect_kwargs()
+    kwargs["port"] = int(os.getenv("DB_PORT", "19840"))
+    return mysql.connector.connect(**kwargs)
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Provision final-round tokens")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--csv", default="Token350.csv", help="CSV with one token per row (default Token350.csv)")
+    source.add_argument("--generate", type=int, metavar="N", help="create N random tokens instead of reading a CSV")
+    parser.add_argument("--out", help="with --generate: write the loaded tokens here for printing")
+    parser.add_argument("--add", action="store_true",
+                        help="with --generate: add the tokens even though final_tokens already has some")
+    parser.add_argument("--rewards", default=DEFAULT_REWARDS, help=f"prize table (default {DEFAULT_REWARDS})")
+    parser.add_argument("--batch", type=int, default=1000, help="rows per INSERT / transaction")
+    parser.add_argument("--replace", action="store_true", help="delete all final_votes and final_tokens first")
+    parser.add_argument("--yes", action="store_true", help="confirm --replace")
+    args = parser.parse_args()
+
+    if args.replace and not args.yes:
+        sys.exit("--replace deletes every final token and final vote; add --yes to confirm")
+    if args.out and not args.generate:
+        sys.exit("--out only applies to --generate")
+    if args.add and not args.generate:
+        sys.exit("--add only applies to --generate")
+
+    tiers, rest = parse_rewards(args.rewards)
+
+    db = connect()
+    cursor = db.cursor()
+    out_file = None
+    try:
+        if args.replace:
+            print("⚡ Clearing final_tokens and final_votes tables...")
+            cursor.execute("DELETE FROM final_votes")
+            cursor.execute("DELETE FROM final_tokens")
+            db.commit()
+            print("✅ Tables cleared.")
+
+        if args.generate:
+            cursor.execute("SELECT COUNT(*) FROM final_tokens")
+            loaded = cursor.fetchone()[0]
+            if loaded and not args.add:
+                sys.exit(f"final_tokens already has {loaded} tokens, and --generate always makes new ones. "
+                         f"Add --add to put {args.generate} more on top, or --replace --yes to start over.")
+            incoming = new = args.generate
+            tokens = generate(args.generate)
+            print(f"🎲 Generating {incoming} tokens...")
+        else:
+            print(f"📄 Reading tokens from {args.csv}...")
+            incoming, new = count_new(cursor, read_csv(args.csv), args.batch)
+            tokens = read_csv(args.csv)
+            print(f"🔢 Total tokens read: {incoming} ({incoming - new} already loaded)")
+
+        # The prize table covers everything in final_tokens once this run is done
+        already = assigned_rewards(cursor)
+        pool = RewardPool(tiers, rest, sum(already.values()) + new)
+        pool.subtract(already)
+
+        if args.out:
+            out_file = open(args.out, "w", encoding="utf-8", newline="")
+            writer = csv.writer(out_file)
+
+        print("💾 Inserting tokens with rewards...")
+        inserted = skipped = unrewarded = 0
+        start = time.perf_counter()
+        for batch in batches(tokens, args.batch):
+            present = existing(cursor, batch)
+            rows = []
+            for token in batch:
+                if token.upper() in present:
+                    skipped += 1
+                    continue
+                present.add(token.upper())
+                reward = pool.draw()
+                unrewarded += reward is None
+                rows.append((token, reward))
+            if rows:
+                inserted += insert_batch(cursor, rows)
+            db.commit()
+            if out_file:
+                writer.writerows([token] for token, _ in rows)
+            elapsed = time.perf_counter() - start
+            print(f"   {inserted + skipped}/{incoming} processed, {inserted} new, "
+                  f"{(inserted + skipped) / elapsed:,.0f} rows/s", end="\r")
+
+        elapsed = time.perf_counter() - start
+        print()
+        print(f"✅ Inserted {inserted} tokens ({skipped} already present) in {elapsed:.1f}s, "
+              f"{(inserted + skipped) / elapsed if elapsed else 0:,.0f} rows/s")
+        if unrewarded:
+            print(f"⚠️ {unrewarded} tokens got no reward; the prize table covers fewer tokens (add a rest: tier)")
+        left = {value: n for value, n in pool.remaining.items() if n}
+        if left:
+            print(f"ℹ️ Rewards not handed out: {left}")
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        db.rollback()
+        sys.exit(1)
+
+    finally:
+        if out_file:
+            out_file.close()
+        cursor.close()
+        db.close()
+        print("🔒 Database connection closed.")
+
+
+if __name__ == "__main__":
+    main()